@@ -20,16 +20,30 @@ DEFAULT_PERCENTILE = 0.98  # Percentil (0–1) por defecto para el umbral extern
 
 # Directorios y rutas de artefactos
 MODEL_DIR = "/app/models"
+PREPROCESSED_CSV = f"{MODEL_DIR}/suricata_preprocessed.csv"
+PREPROCESSED_META_JSON = f"{MODEL_DIR}/suricata_preprocessed.meta.json"  # Sesión y filas del último preprocesado
 SURICATA_ANALYSIS_CSV = f"{MODEL_DIR}/suricata_anomaly_analysis.csv"
 GROUND_TRUTH_CSV = f"{MODEL_DIR}/ground_truth.csv"
+LABELED_SCORES_NPZ = f"{MODEL_DIR}/labeled_scores.npz"  # Scores + etiquetas por event_id, columnar (labeled_store.py)
 THRESHOLD_REPORT_CSV = f"{MODEL_DIR}/threshold_report.csv"
 SELECTED_THRESHOLD_FILE = f"{MODEL_DIR}/selected_threshold.txt"
 THRESHOLDS_JSON = f"{MODEL_DIR}/thresholds.json"
 FEATURE_COLS_JSON = f"{MODEL_DIR}/feature_cols.json"
 IFOREST_MODEL = f"{MODEL_DIR}/isolation_forest_model.pkl"
-SUPERVISED_MODEL = f"{MODEL_DIR}/supervised.pkl"
+COMPILED_FOREST_DIR = f"{MODEL_DIR}/iforest_compiled"   # Bosque exportado a arreglos numpy (forest_compiler.py)
+ONECLASS_MODEL = f"{MODEL_DIR}/oneclass_sgd.pkl"             # One-class por bloques (oneclass_trainer.py)
+ONECLASS_CHECKPOINT = f"{MODEL_DIR}/oneclass_checkpoint.pkl"
+SUPERVISED_MODEL = f"{MODEL_DIR}/supervised.pkl"                # Scorer compacto HistGradientBoosting (supervised_model.py)
+SUPERVISED_METRICS_JSON = f"{MODEL_DIR}/supervised_metrics.json"
 PROTOTYPES_PKL = f"{MODEL_DIR}/prototypes.pkl"
 APP_MODE_FILE = f"{MODEL_DIR}/app_mode.json"
+REGISTRY_DIR = f"{MODEL_DIR}/registry"                # Versiones del modelo + puntero CURRENT (model_registry.py)
+TRAINING_STATUS_JSON = f"{MODEL_DIR}/training_job.json"
+STAGE_CACHE_JSON = f"{MODEL_DIR}/stage_cache.json"      # Huellas de entradas/salidas por etapa (pipeline_runner.py)
+RULE_STORE_DB = f"{MODEL_DIR}/rules.sqlite3"           # Reglas indexadas por SID/patrón; sml.rules se publica desde aquí (rule_store.py)
+PROFILE_INDEX_NPZ = f"{MODEL_DIR}/src_profiles.npz"    # Perfiles por src_ip para reglas contextuales (profile_index.py)
+STREAM_DETECTOR_STATE = f"{MODEL_DIR}/stream_hst.npz"   # Snapshot del detector en línea (stream_detector.py)
+IP_POLICY_FILE = f"{MODEL_DIR}/ip_policy.json"     # Listas CIDR allow/deny y políticas de puertos
 
 # Modos de operación
 MODE_NORMAL = "normal"   # etiqueta en vivo como normal
@@ -39,6 +53,67 @@ MODE_OFF = "off"         # detección/producción, sin etiquetado
 # Políticas anti-falsos positivos
 ALERT_ONLY_PORTS = {53, 80, 123, 443}              # Nunca DROP por score aislado
 LOCAL_SERVICES = {"10.0.2.3", "192.168.10.1"}      # DNS VBox y Smlu (excluir de DROP)
+# Nota: si existe IP_POLICY_FILE, sus listas CIDR sustituyen a LOCAL_SERVICES/ALERT_ONLY_PORTS (ver ip_policy.py)
+
+# Muestreo de entrenamiento (training_sampler.py): tamaño del reservorio estratificado
+TRAINING_SAMPLE_SIZE = 50000
+
+# Compactación del entrenamiento (training_compaction.py): decimales al cuantizar antes de deduplicar (None = exacto)
+TRAINING_COMPACTION_DECIMALS = 4
+
+# Detector en línea (Half-Space Trees): árboles, profundidad, eventos por ventana y umbral de anomaly_score
+STREAM_TREES = 25
+STREAM_DEPTH = 10
+STREAM_WINDOW = 250
+STREAM_ANOMALY_THRESHOLD = 0.4
+
+# Evaluación en línea (online_evaluator.py): ventana, ventanas en memoria, histograma de scores y retención
+ONLINE_EVAL_WINDOW_S = 300
+ONLINE_EVAL_KEEP_WINDOWS = 12
+ONLINE_EVAL_BINS = 200
+ONLINE_EVAL_SCORE_RANGE = (-0.5, 0.5)   # decision_function del IF; fuera de rango → cubeta extrema
+ONLINE_EVAL_COLLECTION = "eval_metrics"   # Colección time series de MongoDB
+ONLINE_EVAL_RETENTION_DAYS = 30
+
+# Servicio de generación de reglas (rule_daemon.py): sondeo sin change streams, latido y latido caducado
+RULE_DAEMON_POLL_S = 2.0
+RULE_DAEMON_HEARTBEAT_S = 15.0
+RULE_DAEMON_STALE_S = 60.0
+
+# Vaciado de eventos pendientes (generate_rules.py): lote inicial/mín/máx, duración objetivo por lote,
+# presupuesto por ejecución, intervalo mínimo entre recargas de Suricata y ids por UpdateMany al marcar
+RULES_BATCH_INITIAL = 500
+RULES_BATCH_MIN = 100
+RULES_BATCH_MAX = 20000
+RULES_BATCH_TARGET_S = 2.0
+RULES_DRAIN_BUDGET_S = 60.0
+RULES_RELOAD_INTERVAL_S = 15.0
+RULES_MARK_CHUNK = 1000
+
+# Compactación de reglas al publicar sml.rules (rule_compactor.py): activada, elementos máximos por lista,
+# puerto origen efímero (≥ 1024) → any sólo en reglas alert (opt-in; nunca en drop) y primer SID de las
+# reglas de grupo
+RULES_COMPACT = True
+RULES_COMPACT_MAX_ITEMS = 200
+RULES_COMPACT_ANY_SPORT = False
+RULES_COMPACT_SID_BASE = 4000000
+
+# Detector supervisado (supervised_model.py): tamaño mínimo de las ventanas de entrenamiento (el último lote de
+# un vaciado puede ser menor que RULES_BATCH_MIN), pasadas de ventanas sobre los eventos de entrenamiento y
+# comprobación con un lote de anomalías de validación
+SUPERVISED_WINDOW_MIN = 20
+SUPERVISED_WINDOW_PASSES = 8
+SUPERVISED_CHECK_BATCH = 50
+SUPERVISED_MIN_BATCH_RECALL = 0.5
+
+# Intervalos de confianza (bootstrap_ci.py): remuestreos, nivel (1 - alpha) y semilla fija
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_ALPHA = 0.05
+BOOTSTRAP_SEED = 42
+
+# Entrenamiento incremental (warm_start): árboles nuevos por ventana y tope del bosque
+INCREMENTAL_TREES_PER_WINDOW = 25
+INCREMENTAL_MAX_TREES = 200
 
 # Criterios de decisión
 MIN_PRECISION_FOR_THRESHOLD = 0.95                 # Precisión mínima al calibrar umbral IF
@@ -38,32 +38,15 @@ mkdir -p "$MODEL_DIR"
 # Iniciar monitoreo de Suricata en segundo plano
 python suricata_to_mongo.py &
 
-# Ejecutar ml_processing.py (best-effort, no bloquear primer arranque)
+# Ejecutar ml_processing.py (best-effort, no bloquear primer arranque) a través de pipeline_runner.py:
+# si los eventos y el código no cambiaron desde el último arranque, el CSV en caché se reutiliza
 echo "[ENTRY] Ejecutando ml_processing.py (best-effort)..."
-python ml_processing.py || echo "[ENTRY] ml_processing.py no generó filas (puede ser normal en primer arranque)."
-
-
-# Entrenar modelo sólo si hay datos reales (más de cabecera) o si no existe el PKL
-CSV="/app/models/suricata_preprocessed.csv"
-PKL="/app/models/isolation_forest_model.pkl"
-
-[ -f "$CSV" ] && LINES=$(wc -l < "$CSV" | tr -d ' ')
-
-if [ ! -f "$PKL" ]; then
-  if [ "$LINES" -gt 1 ]; then
-    echo "[ENTRY] Modelo no encontrado y hay datos. Entrenando Isolation Forest..."
-    python train_model.py || echo "[ENTRY] Entrenamiento falló."
-  else
-    echo "[ENTRY] Modelo no encontrado pero el CSV no tiene datos (solo cabecera). Omitiendo entrenamiento por ahora."
-  fi
-else
-  # PKL existe; reentrenar sólo si hay datos y se desea lógica futura
-  if [ "$LINES" -gt 1 ]; then
-    echo "[ENTRY] Modelo encontrado. Continuando sin reentrenar."
-  else
-    echo "[ENTRY] Modelo encontrado, pero el CSV está vacío (solo cabecera)."
-  fi
-fi
+python pipeline_runner.py --stages preprocess || echo "[ENTRY] ml_processing.py no generó filas (puede ser normal en primer arranque)."
+
+
+# El entrenamiento ya no se ejecuta aquí de forma síncrona: al arrancar, FastAPI encola un
+# entrenamiento en segundo plano si no existe el PKL y hay datos (ver training_service.py).
+# Reentrenamientos posteriores: POST /train (estado en GET /train/status).
 
 # Ejecutar el script de monitoreo de logs en segundo plano
 python log_watcher.py &
@@ -1,23 +1,35 @@
+"""
+evaluate.py
+
+📌 Función principal:
+    Evaluar las predicciones del modelo contra el ground truth y calibrar el umbral por F1 con precisión
+    mínima (MIN_PRECISION_FOR_THRESHOLD). Scores y etiquetas se leen alineados de LABELED_SCORES_NPZ
+    (labeled_store.py); los CSV sólo se cruzan si ese almacén no existe.
+
+⚙️ Modos:
+    - Sólo métricas (por defecto): compute_metrics() calcula las métricas base y el umbral y persiste
+      THRESHOLD_REPORT_CSV, SELECTED_THRESHOLD_FILE, THRESHOLDS_JSON y el umbral en el registro de modelos.
+      No importa seaborn/matplotlib/rich: arranca rápido y usa poca memoria.
+    - Intervalos de confianza (`--ci`, opt-in): compute_metrics(bootstrap=N) añade "ci" con el bootstrap
+      vectorizado de bootstrap_ci.py. Por defecto bootstrap=0: el reentrenamiento no paga los remuestreos.
+    - Informe (`--plots`, opt-in): render_reports() dibuja las matrices de confusión en PNG y las muestra
+      con rich; estas librerías se importan sólo en ese paso.
+
+🔗 Usado por:
+    - training_service.py → compute_metrics() en el mismo worker tras entrenar (sin otro intérprete)
+    - pipeline_runner.py  → etapa "evaluate"
+
+🧪 Uso:
+    python evaluate.py [--plots] [--ci]
+"""
 import sys
 import json
 import pandas as pd
-from sklearn.metrics import (
-    precision_score,
-    recall_score,
-    f1_score,
-    roc_auc_score,
-    confusion_matrix,
-    classification_report,
-    precision_recall_curve,
-    average_precision_score,
-)
-import seaborn as sns
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import numpy as np
-from rich.console import Console
-from rich.table import Table
+from threshold_optimizer import best_threshold
+from model_registry import set_threshold
+from labeled_store import read_aligned
+from bootstrap_ci import bootstrap_metrics
 from constants import (
     ANOMALY_PREDICTION,
     GROUND_TRUTH_CSV as GROUND_TRUTH_PATH,
@@ -26,9 +38,17 @@ from constants import (
     SELECTED_THRESHOLD_FILE,
     THRESHOLDS_JSON,
     MIN_PRECISION_FOR_THRESHOLD,
+    LABELED_SCORES_NPZ,
+    BOOTSTRAP_RESAMPLES,
+    BOOTSTRAP_ALPHA,
+    BOOTSTRAP_SEED,
 )
 
 
+class EvaluationError(Exception):
+    """Datos de evaluación ausentes o inválidos (mensaje apto para logs/API)."""
+
+
 def _pick_label_column(gt: pd.DataFrame) -> str:
     # Compatibilidad con tus variantes previas
     for c in ["prediction_g", "training_label", "label"]:
@@ -37,51 +57,84 @@ def _pick_label_column(gt: pd.DataFrame) -> str:
     return None
 
 
-def evaluar_modelo():
-    print("📊 Evaluando el rendimiento del modelo con base en el ground truth…")
+def load_evaluation_frame(ground_truth_path=GROUND_TRUTH_PATH, model_output_path=MODEL_OUTPUT_PATH,
+                          store_path=LABELED_SCORES_NPZ):
+    """Eventos con score del modelo y etiqueta del ground truth. Devuelve (df, score_col).
+
+    Lee el almacén de labeled_store.py: columnas ya alineadas por event_id, sin merge. Si el almacén
+    aún no existe (artefactos anteriores a él) se cruzan los CSV por event_id como antes.
+    """
+    aligned = read_aligned(store_path)
+    if aligned is not None:
+        if aligned["score"].size == 0:
+            raise EvaluationError("El almacén etiquetado no tiene eventos con score y etiqueta a la vez.")
+        df = pd.DataFrame({
+            "event_id": aligned["event_id"], "anomaly_score": aligned["score"],
+            "prediction": aligned["prediction"], "gt_label": aligned["label"],
+            "proto": aligned["proto"], "dest_port": aligned["dest_port"],
+        })
+        print(f"[DBG] 📦 Eventos con score y etiqueta (almacén): {df.shape[0]}")
+        return df, "anomaly_score"
 
     try:
-        ground_truth = pd.read_csv(GROUND_TRUTH_PATH, dtype={"event_id": str})
-        model_output = pd.read_csv(MODEL_OUTPUT_PATH, dtype={"event_id": str})
+        ground_truth = pd.read_csv(ground_truth_path, dtype={"event_id": str})
+        model_output = pd.read_csv(model_output_path, dtype={"event_id": str})
     except Exception as e:
-        print(f"❌ Error al cargar archivos: {e}")
-        sys.exit(1)
+        raise EvaluationError(f"Error al cargar archivos: {e}")
 
     if ground_truth.empty or model_output.empty:
-        print("⚠ Archivos vacíos. Asegúrate de haber generado correctamente los datos.")
-        sys.exit(1)
+        raise EvaluationError("Archivos vacíos. Asegúrate de haber generado correctamente los datos.")
 
     # Chequeos mínimos
     if "event_id" not in model_output.columns:
-        print("❌ El archivo de modelo debe contener 'event_id'.")
-        sys.exit(1)
+        raise EvaluationError("El archivo de modelo debe contener 'event_id'.")
 
     score_col_candidates = ["anomaly_score", "anomaly_score_x"]
     score_col = next((c for c in score_col_candidates if c in model_output.columns), None)
     if score_col is None:
-        print("❌ El archivo de salida del modelo no contiene columna 'anomaly_score'.")
-        sys.exit(1)
+        raise EvaluationError("El archivo de salida del modelo no contiene columna 'anomaly_score'.")
 
     label_col = _pick_label_column(ground_truth)
     if label_col is None:
-        print("❌ ground_truth.csv no contiene 'prediction_g', 'training_label' ni 'label'.")
-        sys.exit(1)
-
-    #print("[DBG] 🧾 Primeros event_id en model_output:")
-    #print(model_output["event_id"].head())
-
-    #print("[DBG] 🧾 Primeros event_id en ground_truth:")
-    #print(ground_truth["event_id"].head())
+        raise EvaluationError("ground_truth.csv no contiene 'prediction_g', 'training_label' ni 'label'.")
 
     df = pd.merge(model_output, ground_truth[["event_id", label_col]], on="event_id", how="inner")
     print(f"[DBG] 🔄 Eventos cruzados (merge): {df.shape[0]}")
     df = df.rename(columns={label_col: "gt_label"})
-    #print("[DBG] Ejemplo después del merge:")
-    #print(df[["event_id", "gt_label"]].head())
 
     if df.empty:
-        print("⚠ No hay intersección entre eventos del modelo y ground truth.")
-        sys.exit(1)
+        raise EvaluationError("No hay intersección entre eventos del modelo y ground truth.")
+
+    # Tras el merge puede duplicarse como *_x; priorizamos la del modelo
+    if "anomaly_score_x" in df.columns:
+        score_col = "anomaly_score_x"
+    elif "anomaly_score" in df.columns:
+        score_col = "anomaly_score"
+    else:
+        raise EvaluationError("No se encontró columna de 'anomaly_score' tras el merge.")
+    return df, score_col
+
+
+def compute_metrics(ground_truth_path=GROUND_TRUTH_PATH, model_output_path=MODEL_OUTPUT_PATH, persist=True,
+                    store_path=LABELED_SCORES_NPZ, bootstrap=0) -> dict:
+    """Métricas base + umbral calibrado, sin gráficos. Con `persist=True` escribe los artefactos del umbral.
+    Con `bootstrap` > 0 añade "ci": intervalos bootstrap de AUC/AP y de precision/recall/F1 (base y umbral).
+
+    Lanza EvaluationError si los datos no permiten evaluar. Devuelve un dict serializable en JSON
+    (las matrices de confusión como listas) más `df`/`score_col` para los pasos opcionales.
+    """
+    from sklearn.metrics import (
+        precision_score,
+        recall_score,
+        f1_score,
+        roc_auc_score,
+        confusion_matrix,
+        classification_report,
+        average_precision_score,
+    )
+
+    print("📊 Evaluando el rendimiento del modelo con base en el ground truth…")
+    df, score_col = load_evaluation_frame(ground_truth_path, model_output_path, store_path)
 
     # Normalizamos predicción del modelo a binaria: 1 = anomalía, 0 = normal
     if "prediction" in df.columns:
@@ -95,14 +148,6 @@ def evaluar_modelo():
     print("🔍 Conteo de predicciones en prediction_bin:", pd.Series(df['prediction_bin']).value_counts().to_dict())
 
     # Puntaje de normalidad del modelo (mayor = más normal)
-    # Tras el merge puede duplicarse como *_x; priorizamos la del modelo
-    if "anomaly_score_x" in df.columns:
-        score_col = "anomaly_score_x"
-    elif "anomaly_score" in df.columns:
-        score_col = "anomaly_score"
-    else:
-        print("❌ No se encontró columna de 'anomaly_score' tras el merge.")
-        sys.exit(1)
     y_score = df[score_col].astype(float).values
 
     print(f"🔍 Total eventos combinados: {len(df)}")
@@ -114,7 +159,6 @@ def evaluar_modelo():
 
     # Convertimos el score de "normalidad" a score de anomalía invirtiendo el signo
     anomaly_score_for_metrics = (-y_score)
-    precision_curve, recall_curve, _ = precision_recall_curve(y_true, anomaly_score_for_metrics)
     ap_score = average_precision_score(y_true, anomaly_score_for_metrics)
 
     print("\n📋 Reporte de Clasificación (predicción original del modelo):")
@@ -136,38 +180,53 @@ def evaluar_modelo():
     print("\n📊 Matriz de Confusión (BASE) [TN FP; FN TP]:")
     print(cm_base)
 
-    # Guardar imagen de la matriz de confusión base
-    sns.heatmap(cm_base, annot=True, fmt="d", cmap="Blues",
-                xticklabels=["Pred: Normal", "Pred: Anomaly"],
-                yticklabels=["Real: Normal", "Real: Anomaly"])
-    plt.title("Matriz de Confusión - Base")
-    plt.xlabel("Predicción")
-    plt.ylabel("Real")
-    plt.savefig("/app/models/confusion_matrix_base.png")
-    plt.close()
-
     # ========= 2) SELECCIÓN DE UMBRAL por F1 con restricción de precisión =========
-    grid = np.unique(np.quantile(y_score, np.linspace(0.80, 0.999, 120)))
-    if grid.size == 0:
-        print("⚠ Rejilla vacía para scores. Revisa 'anomaly_score'.")
-        sys.exit(1)
+    if y_score.size == 0:
+        raise EvaluationError("Rejilla vacía para scores. Revisa 'anomaly_score'.")
+
+    # Barrido exacto (un solo ordenamiento + sumas acumuladas) sobre los cuantiles 0.80–0.999
+    best = best_threshold(y_score, y_true, min_precision=MIN_PRECISION_FOR_THRESHOLD, quantile_range=(0.80, 0.999))
 
-    evals = []
-    for t in grid:
-        y_pred_thr = (y_score < t).astype(int)
-        p = precision_score(y_true, y_pred_thr, zero_division=0)
-        r = recall_score(y_true, y_pred_thr, zero_division=0)
-        f1v = f1_score(y_true, y_pred_thr, zero_division=0)
-        if p >= MIN_PRECISION_FOR_THRESHOLD:
-            evals.append((t, p, r, f1v))
-
-    if evals:
-        thr, p, r, f1v = max(evals, key=lambda x: x[3])
+    if best is not None:
+        thr, p, r, f1v = best["threshold"], best["precision"], best["recall"], best["f1"]
     else:
         # Fallback conservador: percentil 98
         thr = float(np.quantile(y_score, 0.98))
         p = r = f1v = 0.0
 
+    if persist:
+        _persist_threshold(thr, p, r, f1v, best)
+
+    cm_thr = confusion_matrix(y_true, (y_score < thr).astype(int))
+
+    print("\n🎯 Selección de umbral por F1 (con scores):")
+    print(f"Precision={p:.3f} Recall={r:.3f} F1={f1v:.3f} Thr={thr:.6f}")
+    print("CM (umbral):")
+    print(cm_thr)
+
+    ci = None
+    if bootstrap and len(set(y_true)) == 2:
+        ci = bootstrap_metrics(y_score, y_true, {"base": y_pred_base == 1, "threshold": y_score < thr},
+                               n_resamples=bootstrap, alpha=BOOTSTRAP_ALPHA, seed=BOOTSTRAP_SEED)
+        print(f"\n📏 Intervalos de confianza {1 - BOOTSTRAP_ALPHA:.0%} ({bootstrap} remuestreos, {ci['seconds']:.1f}s):")
+        for name, m in [("AUC-ROC", ci["auc"]), ("AP", ci["ap"]),
+                        *[(f"{k} {part}", ci[part][k]) for part in ("base", "threshold")
+                          for k in ("precision", "recall", "f1")]]:
+            print(f"  🔹 {name:<20} {m['point']:.3f}  [{m['low']:.3f}, {m['high']:.3f}]")
+
+    return {
+        "n_events": int(len(df)),
+        "base": {"precision": float(precision_base), "recall": float(recall_base), "f1": float(f1_base),
+                 "auc": float(auc_base), "ap": float(ap_score), "confusion_matrix": cm_base.tolist()},
+        "threshold": {"threshold": float(thr), "precision": float(p), "recall": float(r), "f1": float(f1v),
+                      "min_precision": float(MIN_PRECISION_FOR_THRESHOLD), "confusion_matrix": cm_thr.tolist()},
+        "ci": ci,
+        "df": df,
+        "score_col": score_col,
+    }
+
+
+def _persist_threshold(thr, p, r, f1v, best):
     # Persistir artefactos del umbral
     pd.DataFrame({"threshold": [thr], "precision": [p], "recall": [r], "f1": [f1v]}).to_csv(THRESHOLD_REPORT, index=False)
     with open(SELECTED_THRESHOLD_FILE, "w") as f:
@@ -179,17 +238,39 @@ def evaluar_modelo():
             json.dump({
                 "thr_if": float(thr),
                 "min_precision": float(MIN_PRECISION_FOR_THRESHOLD),
-                "grid": {"start": 0.80, "end": 0.999, "steps": 120}
+                "grid": {"start": 0.80, "end": 0.999, "candidates": best["candidates"] if best else 0}
             }, jf)
     except Exception as e:
         print(f"⚠ No se pudo escribir {THRESHOLDS_JSON}: {e}")
 
-    cm_thr = confusion_matrix(y_true, (y_score < thr).astype(int))
+    # Registrar el umbral calibrado en la versión vigente (los procesos en marcha lo recargan en caliente)
+    try:
+        set_threshold(thr, extra={"min_precision": float(MIN_PRECISION_FOR_THRESHOLD)})
+    except Exception as e:
+        print(f"⚠ No se pudo registrar el umbral en el registro de modelos: {e}")
 
-    print("\n🎯 Selección de umbral por F1 (con scores):")
-    print(f"Precision={p:.3f} Recall={r:.3f} F1={f1v:.3f} Thr={thr:.6f}")
-    print("CM (umbral):")
-    print(cm_thr)
+
+def render_reports(result: dict):
+    """Paso opcional: PNGs de las matrices de confusión y tablas rich (importaciones diferidas)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from rich.console import Console
+    from rich.table import Table
+
+    cm_base = result["base"]["confusion_matrix"]
+    cm_thr = result["threshold"]["confusion_matrix"]
+
+    # Guardar imagen de la matriz de confusión base
+    sns.heatmap(cm_base, annot=True, fmt="d", cmap="Blues",
+                xticklabels=["Pred: Normal", "Pred: Anomaly"],
+                yticklabels=["Real: Normal", "Real: Anomaly"])
+    plt.title("Matriz de Confusión - Base")
+    plt.xlabel("Predicción")
+    plt.ylabel("Real")
+    plt.savefig("/app/models/confusion_matrix_base.png")
+    plt.close()
 
     # Guardar imagen de la matriz de confusión con umbral
     sns.heatmap(cm_thr, annot=True, fmt="d", cmap="Greens",
@@ -212,12 +293,24 @@ def evaluar_modelo():
         table.add_row("Real: Anomaly", str(cm[1][0]), str(cm[1][1]))
         console.print(table)
 
-    analizar_falsos_negativos(df, score_col)
+
+def evaluar_modelo(plots=False, ci=False):
+    """Evaluación completa desde la CLI: métricas + umbral, intervalos, informe opcional y análisis de FN/FP."""
+    try:
+        result = compute_metrics(bootstrap=BOOTSTRAP_RESAMPLES if ci else 0)
+    except EvaluationError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if plots:
+        render_reports(result)
+    analizar_falsos_negativos(result["df"], result["score_col"])
+    return result
 
 
 def analizar_falsos_negativos(df: pd.DataFrame, score_col: str):
     # Falsos negativos respecto al UMBRAL F1: reales anomalías pero predichas como normal
-    gt = (df["gt_label"].astype(str).str.lower() == "anomaly").astype(int)
+    # gt_label llega como texto ("anomaly") o como 0/1 (almacén etiquetado, prediction_g)
+    gt = df["gt_label"].astype(str).str.lower().isin(["anomaly", "1"]).astype(int)
     # Si guardaste el umbral, recupéralo; si no, usa percentil 98 como fallback
     try:
         thr = float(open(SELECTED_THRESHOLD_FILE).read().strip())
@@ -277,4 +370,4 @@ def analizar_falsos_negativos(df: pd.DataFrame, score_col: str):
 
 
 if __name__ == "__main__":
-    evaluar_modelo()
\ No newline at end of file
+    evaluar_modelo(plots="--plots" in sys.argv, ci="--ci" in sys.argv)
\ No newline at end of file
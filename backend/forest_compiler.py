@@ -0,0 +1,220 @@
+"""
+forest_compiler.py
+
+📌 Función principal:
+    Exportar un IsolationForest entrenado a arreglos numpy contiguos (un "bosque compilado") y evaluarlo
+    por lotes sin sklearn: score y etiqueta en una sola pasada.
+
+📐 Formato en disco (`/app/models/iforest_compiled/`):
+    - feature.npy   int32   → índice de feature GLOBAL por nodo
+    - threshold.npy float64 → umbral de corte por nodo (+inf en hojas)
+    - left.npy / right.npy int32 → hijo izquierdo/derecho (índices globales; las hojas apuntan a sí mismas)
+    - leaf_value.npy float64 → profundidad de la hoja + corrección c(n) de las muestras en la hoja
+    - roots.npy     int32   → nodo raíz de cada árbol
+    - meta.json             → columnas, offset_, denominador, profundidad máxima, origen (.pkl)
+    Los .npy se cargan con mmap (np.load(mmap_mode="r")): abrir el modelo cuesta milisegundos.
+
+⚙️ Scoring:
+    Todos los árboles avanzan a la vez sobre una matriz (lote × árboles) de nodos actuales,
+    tantas iteraciones como profundidad máxima. Igual que sklearn, X se compara en float32.
+    decision = -2^(-E[h(x)] / (T · c(max_samples))) - offset_ ; etiqueta = -1 si decision < 0.
+
+🔗 Usado por:
+    - train_model.py (exporta tras entrenar)
+    - generate_rules.py (load_scorer: bosque compilado si está al día; si no, el .pkl de sklearn)
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from constants import IFOREST_MODEL, COMPILED_FOREST_DIR, ANOMALY_PREDICTION
+
+_ARRAYS = ("feature", "threshold", "left", "right", "leaf_value", "roots")
+_CHUNK_ROWS = 4096
+
+
+def _average_path_length(n):
+    """c(n): longitud media de una búsqueda fallida en un BST de n elementos (Liu et al.)."""
+    n = np.asarray(n, dtype=np.float64)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+
+def _node_depths(tree):
+    """Profundidad de cada nodo (raíz = 0)."""
+    depth = np.zeros(tree.node_count, dtype=np.float64)
+    for i in range(tree.node_count):
+        for child in (tree.children_left[i], tree.children_right[i]):
+            if child >= 0:
+                depth[child] = depth[i] + 1
+    return depth
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+
+def compile_forest(model, source_path=None):
+    """Aplana un IsolationForest ajustado en arreglos + metadata (en memoria)."""
+    feats, thrs, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for t, (est, features) in enumerate(zip(model.estimators_, model.estimators_features_)):
+        tree = est.tree_
+        features = np.asarray(features)
+        is_leaf = tree.children_left < 0
+        depth = _node_depths(tree)
+        max_depth = max(max_depth, int(depth.max()))
+        # Contribución de cada hoja a la longitud de camino: profundidad + c(muestras en la hoja)
+        leaf_value = depth + _average_path_length(tree.n_node_samples)
+
+        # Las hojas apuntan a sí mismas con umbral +inf: el recorrido no necesita ramas para detenerse
+        self_idx = np.arange(tree.node_count) + offset
+        feats.append(np.where(is_leaf, 0, features[np.clip(tree.feature, 0, None)]).astype(np.int32))
+        thrs.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        lefts.append(np.where(is_leaf, self_idx, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, self_idx, tree.children_right + offset).astype(np.int32))
+        values.append(np.where(is_leaf, leaf_value, 0.0))
+        roots.append(offset)
+        offset += tree.node_count
+
+    max_samples = getattr(model, "_max_samples", getattr(model, "max_samples_", None))
+    arrays = {
+        "feature": np.concatenate(feats), "threshold": np.concatenate(thrs),
+        "left": np.concatenate(lefts), "right": np.concatenate(rights),
+        "leaf_value": np.concatenate(values), "roots": np.asarray(roots, dtype=np.int32),
+    }
+    meta = {
+        "feature_names": [str(c) for c in getattr(model, "feature_names_in_", [])],
+        "n_features": int(model.n_features_in_),
+        "n_trees": len(model.estimators_),
+        "n_nodes": int(offset),
+        "max_depth": max_depth,
+        "offset": float(model.offset_),
+        "denominator": float(len(model.estimators_) * _average_path_length([max_samples])[0]),
+        "source": _source_stamp(source_path) if source_path and os.path.exists(source_path) else None,
+    }
+    return arrays, meta
+
+
+def export_forest(model, out_dir=COMPILED_FOREST_DIR, source_path=IFOREST_MODEL):
+    """Exporta el bosque compilado a `out_dir` (directorio temporal + renombrado)."""
+    arrays, meta = compile_forest(model, source_path)
+    tmp = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in _ARRAYS:
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    old = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old)
+    os.rename(tmp, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"[FC] ✅ Bosque compilado: {meta['n_trees']} árboles, {meta['n_nodes']} nodos → {out_dir}")
+    return meta
+
+
+class CompiledForest:
+    """Scorer vectorizado sobre los arreglos exportados por export_forest()."""
+
+    def __init__(self, arrays, meta):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.feature_names_in_ = np.array(meta["feature_names"], dtype=object)
+        self.n_features_in_ = meta["n_features"]
+        self.offset_ = meta["offset"]
+
+    @classmethod
+    def load(cls, path=COMPILED_FOREST_DIR, mmap=True):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in _ARRAYS}
+        return cls(arrays, meta)
+
+    def is_fresh(self, source_path=IFOREST_MODEL):
+        """True si el .pkl de origen no cambió desde la exportación."""
+        src = self.meta.get("source")
+        if not src or not os.path.exists(source_path):
+            return False
+        st = os.stat(source_path)
+        return st.st_size == src["size"] and abs(st.st_mtime - src["mtime"]) < 1e-6
+
+    def _path_lengths(self, X):
+        n, n_features = X.shape
+        node = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        row_base = (np.arange(n, dtype=np.int64) * n_features)[:, None]
+        flat = X.ravel()
+        for _ in range(self.meta["max_depth"]):
+            x = np.take(flat, row_base + np.take(self.feature, node))
+            go_left = x <= np.take(self.threshold, node)
+            node = np.where(go_left, np.take(self.left, node), np.take(self.right, node))
+        return np.take(self.leaf_value, node).sum(axis=1)
+
+    def _as_matrix(self, X):
+        """X como matriz float64 en el orden de columnas del entrenamiento.
+
+        Un DataFrame se reordena por `feature_names_in_` (como sklearn, que valida los nombres); faltar una
+        columna o traer NaN/inf es un error: el bosque compilado no los rechazaría y puntuaría basura."""
+        if hasattr(X, "columns"):
+            missing = [c for c in self.feature_names_in_ if c not in X.columns]
+            if missing:
+                raise ValueError(f"Faltan columnas del modelo: {missing}")
+            X = X[list(self.feature_names_in_)]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X tiene forma {X.shape}; el modelo espera {self.n_features_in_} columnas")
+        if not np.isfinite(X).all():
+            raise ValueError("X contiene NaN o valores infinitos")
+        return np.ascontiguousarray(X, dtype=np.float64)
+
+    def decision_function(self, X):
+        X = self._as_matrix(X)
+        out = np.empty(X.shape[0], dtype=np.float64)
+        denom = self.meta["denominator"]
+        for start in range(0, X.shape[0], _CHUNK_ROWS):
+            depth = self._path_lengths(X[start:start + _CHUNK_ROWS])
+            ratio = depth / denom if denom != 0 else np.ones_like(depth)
+            out[start:start + _CHUNK_ROWS] = -(2.0 ** (-ratio)) - self.offset_
+        return out
+
+    def score(self, X):
+        """(decision_function, etiqueta) en una sola pasada por el bosque."""
+        decision = self.decision_function(X)
+        return decision, np.where(decision < 0, ANOMALY_PREDICTION, 1)
+
+
+class SklearnScorer:
+    """Adaptador del modelo sklearn con la misma interfaz score() (un solo recorrido del bosque)."""
+
+    def __init__(self, model):
+        self.model = model
+        self.feature_names_in_ = getattr(model, "feature_names_in_", None)
+        self.n_features_in_ = model.n_features_in_
+
+    def score(self, X):
+        decision = self.model.decision_function(X)
+        return decision, np.where(decision < 0, ANOMALY_PREDICTION, 1)
+
+
+def load_scorer(model_path=IFOREST_MODEL, compiled_dir=COMPILED_FOREST_DIR):
+    """Bosque compilado (mmap) si existe y corresponde al .pkl vigente; si no, el modelo sklearn."""
+    if os.path.exists(os.path.join(compiled_dir, "meta.json")):
+        try:
+            forest = CompiledForest.load(compiled_dir)
+            if forest.is_fresh(model_path):
+                return forest
+            print("[FC] ⚠ Bosque compilado desactualizado; se usa el modelo sklearn.")
+        except Exception as e:
+            print(f"[FC] ⚠ No se pudo cargar el bosque compilado: {e}")
+    import joblib
+    return SklearnScorer(joblib.load(model_path))
@@ -3,13 +3,15 @@ from db_connection import db
 from datetime import datetime
 import os
 import asyncio
+from labeled_store import write_labels
 
 GROUND_TRUTH_PATH = "/app/models/ground_truth.csv"
 
-async def generate_ground_truth_from_mongo():
+async def generate_ground_truth_from_mongo(session=None):
     """
     Extrae eventos de MongoDB marcados como normal o anomalía durante modo entrenamiento y los guarda en un CSV.
     Añade campos de predicción simulada y etiqueta tipo.
+    Si se pasa `session` (p. ej. desde pipeline_runner.py) no se pregunta por la sesión.
     """
     collection = db["events"]
     #config = await db["config"].find_one({"_id": "mode"})
@@ -25,16 +27,22 @@ async def generate_ground_truth_from_mongo():
         print("⚠ No se encontraron sesiones de entrenamiento activas.")
         return
 
-    print("🔢 Selecciona una sesión de entrenamiento para generar el ground_truth:")
-    for idx, sess in enumerate(sessions):
-        print(f"{idx + 1}. {sess}")
-    
-    try:
-        choice = int(input("Selecciona una opción (número): "))
-        selected_session = sessions[choice - 1]
-    except (ValueError, IndexError):
-        print("❌ Opción inválida.")
-        return
+    if session is not None:
+        if session not in sessions:
+            print(f"❌ La sesión {session} no existe.")
+            return
+        selected_session = session
+    else:
+        print("🔢 Selecciona una sesión de entrenamiento para generar el ground_truth:")
+        for idx, sess in enumerate(sessions):
+            print(f"{idx + 1}. {sess}")
+
+        try:
+            choice = int(input("Selecciona una opción (número): "))
+            selected_session = sessions[choice - 1]
+        except (ValueError, IndexError):
+            print("❌ Opción inválida.")
+            return
 
     print(f"🔍 Extrayendo eventos de la sesión: {selected_session}")
 
@@ -92,6 +100,11 @@ async def generate_ground_truth_from_mongo():
         print(df.head(5))
     except Exception as e:
         print(f"❌ Error al guardar el archivo: {e}")
+    # Etiquetas en el almacén por event_id que lee evaluate.py (sin merge de CSVs)
+    try:
+        write_labels(df["event_id"], df["gt_label"])
+    except Exception as e:
+        print(f"❌ Error al actualizar el almacén de etiquetas: {e}")
 
 if __name__ == "__main__":
     asyncio.run(generate_ground_truth_from_mongo())
\ No newline at end of file
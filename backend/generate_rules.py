@@ -10,24 +10,35 @@ generate_rules.py
     - Generar y guardar reglas de Suricata para los eventos detectados como anómalos.
     - Recargar dinámicamente las reglas en Suricata a través del socket.
 
-🔁 Flujo general:
-    1. Cargar modelo entrenado y datos de preprocesamiento.
-    2. Obtener eventos recientes de MongoDB.
+🔁 Flujo general (generate_suricata_rules: lotes hasta vaciar la cola o agotar RULES_DRAIN_BUDGET_S):
+    1. Cargar modelo entrenado y el índice de perfiles por src_ip.
+    2. Obtener el siguiente lote de eventos pendientes (orden de _id; tamaño adaptativo, BatchSizer).
     3. Evaluar si está activo el modo entrenamiento.
         - Si está activo, no se generan reglas, solo se marcan eventos.
     4. Preprocesar los eventos para el modelo de ML.
     5. Predecir con Isolation Forest y extraer anomalías.
     6. Generar reglas y evitar duplicados.
-    7. Guardar nuevas reglas en el archivo sml.rules.
-    8. Recargar las reglas en Suricata mediante suricatasc.
-    9. Marcar los eventos como procesados en la base de datos.
+    7. Guardar las reglas nuevas en el almacén de reglas (rule_store.py, SQLite indexado por SID y patrón).
+    8. Marcar los eventos como procesados (bulk_write por trozos de RULES_MARK_CHUNK ids).
+    9. Publicar sml.rules (reglas compactadas en CIDR/rangos de puertos, escritura atómica, sólo si cambió) y
+       recargar Suricata mediante suricatasc (una vez por vaciado). El resumen incluye reglas antes/después de
+       compactar y el tiempo de recarga.
+    El resumen devuelto incluye el backlog restante y el tiempo estimado para vaciarlo.
+
+▶ Ejecución:
+    - Servicio: rule_daemon.py mantiene modelo y perfiles en memoria y llama a generate_suricata_rules()
+      en cuanto llegan eventos nuevos (sustituye al cron de 5 minutos).
+    - Una sola pasada: python generate_rules.py
 
 🧩 Dependencias:
     - MongoDB (colección 'events' y 'config')
     - Archivos:
-        * /app/models/suricata_preprocessed.csv
-        * /app/models/isolation_forest_model.pkl
-        * /var/lib/suricata/rules/sml.rules
+        * /app/models/src_profiles.npz → perfiles por src_ip para las reglas contextuales (profile_index.py)
+        * /app/models/registry/CURRENT → versión vigente del modelo (o /app/models/isolation_forest_model.pkl sin registro)
+        * /app/models/supervised.pkl (opcional) → detector supervisado HistGradientBoosting
+        * /app/models/prototypes.pkl (opcional) → filtro de prototipos previo al bosque
+        * /app/models/rules.sqlite3 → almacén de reglas (rule_store.py)
+        * /var/lib/suricata/rules/sml.rules → publicado desde el almacén
     - Suricata con acceso a suricatasc y su socket.
 
 🛠 Requiere:
@@ -35,101 +46,84 @@ generate_rules.py
     - Datos preprocesados en formato compatible.
     - Docker con contenedores montados correctamente y permisos adecuados.
 """
-import joblib
 import pandas as pd
 from db_connection import db
 import os
 import asyncio
-import ipaddress
 import numpy as np
 import subprocess
-from pathlib import Path
-import hashlib
 from bson import ObjectId
+from pymongo import UpdateMany
 import json
+import time
+from ip_codec import ip_to_numeric
+from ip_policy import load_policy
+from model_registry import ModelHandle
+from supervised_model import SupervisedHandle
+from prototype_model import PrototypeHandle
+from profile_index import ProfileIndex
+from rule_renderer import render_rules
+from rule_store import RuleStore
 from constants import (
-    ANOMALY_THRESHOLD,
     ANOMALY_PREDICTION,
     IFOREST_MODEL,
-    THRESHOLDS_JSON,
-    SELECTED_THRESHOLD_FILE,
-    ALERT_ONLY_PORTS,
-    LOCAL_SERVICES,
     MIN_SEVERITY_TO_DROP,
     MIN_FREQ_TO_DROP,
-    RULES_FILE,
+    RULES_BATCH_INITIAL,
+    RULES_BATCH_MIN,
+    RULES_BATCH_MAX,
+    RULES_BATCH_TARGET_S,
+    RULES_DRAIN_BUDGET_S,
+    RULES_RELOAD_INTERVAL_S,
+    RULES_MARK_CHUNK,
 )
 
 
-# --- Funciones auxiliares para reglas contextuales ---
-def gen_sid(event):
-    """Genera un SID único basado en IP y puertos"""
-    unique_str = f"{event['src_ip']}-{event['dest_port']}-{event['proto']}"
-    return 3000000 + int(hashlib.sha256(unique_str.encode()).hexdigest(), 16) % 900000
+# Modelo + umbral vigentes (registro de modelos): se recargan en caliente al promoverse una versión nueva
+MODEL_HANDLE = ModelHandle()
+
+
+# Detector supervisado opcional (supervised.pkl); se usa junto al IF sólo si existe
+SUPERVISED_HANDLE = SupervisedHandle()
+# Filtro de prototipos opcional (prototypes.pkl) previo al bosque
+PROTOTYPE_HANDLE = PrototypeHandle()
+
+
+def live_anomalies(scores, labels, thr):
+    """Decisión en vivo del bosque: etiqueta -1 (score < 0) y score por debajo del umbral calibrado.
+    online_evaluator.py mide exactamente este predicado."""
+    return (np.asarray(labels) == ANOMALY_PREDICTION) & (np.asarray(scores, dtype=np.float64) < thr)
 
-def generate_contextual_rule(event, historical_data):
-    """Genera reglas basadas en comportamiento histórico"""
-    ip_behavior = historical_data[historical_data['src_ip'] == event['src_ip']]
-    
-    if len(ip_behavior) > 10:
-        port_range = f"{ip_behavior['dest_port'].min()}:{ip_behavior['dest_port'].max()}"
-        return (
-            f"alert {event['proto']} {event['src_ip']} any -> any {port_range} "
-            f'(msg:"Suspicious port range access from {event["src_ip"]}"; sid:{gen_sid(event)};)'
-        )
-    return None
-
-
-# Umbral seleccionado por evaluación (opcional)
-SELECTED_THRESHOLD = None
-try:
-    # Prioridad 1: thresholds.json
-    p = Path(THRESHOLDS_JSON)
-    if p.exists():
-        data = json.loads(p.read_text())
-        SELECTED_THRESHOLD = float(data.get("thr_if"))
-        print(f"[GR] thr_if desde thresholds.json: {SELECTED_THRESHOLD:.6f}")
-    else:
-        # Prioridad 2: selected_threshold.txt
-        thr_path = Path(SELECTED_THRESHOLD_FILE)
-        if thr_path.exists():
-            SELECTED_THRESHOLD = float(thr_path.read_text().strip())
-            print(f"[GR] Umbral seleccionado cargado: {SELECTED_THRESHOLD:.6f}")
-        else:
-            print("[GR] No hay thresholds.json ni selected_threshold.txt; se usará ANOMALY_THRESHOLD.")
-except Exception as e:
-    print(f"[GR] No se pudo leer thresholds: {e}")
+
+# Política de red (CIDR allow/deny + puertos sólo-alerta); sustituye a LOCAL_SERVICES/ALERT_ONLY_PORTS
+IP_POLICY = load_policy()
 
 
 # 📌 Configuración de rutas
 # Ruta de reglas según tu despliegue real
 
-HISTORICAL_CSV = "/app/models/suricata_preprocessed.csv"  # opcional
 MODEL_PATH = IFOREST_MODEL
 SOCKET_PATH = "/var/run/suricata/suricata-command.socket"
 
+# Perfiles por src_ip (nº de eventos, rango de puertos, puertos distintos, última vez visto) para las reglas
+# contextuales; se actualiza con cada lote y se guarda al final de cada vaciado
+PROFILE_INDEX = ProfileIndex().load()
+
+# Reglas indexadas por SID y patrón base (SQLite); sml.rules se publica desde aquí de forma atómica
+RULE_STORE = RuleStore(policy=IP_POLICY)
+
+
 # 📦 Cargar modelo y datos
 def load_resources():
-    """Carga el modelo y (opcional) datos históricos"""
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError(f"No existe el modelo en {MODEL_PATH}")
-    model = joblib.load(MODEL_PATH)
-    print("✔ Modelo cargado correctamente")
+    """Carga el modelo (con su umbral, de la misma versión) y el índice de perfiles por src_ip (histórico para
+    las reglas contextuales)"""
+    # Versión vigente del registro (bosque compilado en mmap si existe); sólo se relee si cambió
+    model, thr, version = MODEL_HANDLE.get()
+    print(f"✔ Modelo {version} ({type(model).__name__}), umbral={thr:.6f}")
+    return model, thr, PROFILE_INDEX
 
-    hist_df = pd.read_csv(HISTORICAL_CSV) if os.path.exists(HISTORICAL_CSV) else pd.DataFrame()
-    if hist_df.empty:
-        print("[GR] Sin histórico CSV; las reglas contextuales usarán sólo conteos en memoria.")
-    else:
-        print("[GR] Columnas histórico:", hist_df.columns.tolist())
-    return model, hist_df
 
 
-def safe_ip_to_int(ip):
-    try:
-        return int(ipaddress.ip_address(ip))
-    except (ValueError, ipaddress.AddressValueError):
-        return 0
-    
 async def is_training_mode():
     try:
         config = await db["config"].find_one({"_id": "mode"})
@@ -152,7 +146,7 @@ def preprocess_data(df, expected_columns):
     # Convertir IPs a enteros si existen como texto
     for ip_col in ["src_ip", "dest_ip"]:
         if ip_col in df.columns:
-            df[ip_col] = df[ip_col].astype(str).apply(safe_ip_to_int)
+            df[ip_col] = ip_to_numeric(df[ip_col].astype(str))
 
     # Asegurar todas las columnas esperadas como numéricas
     out = {}
@@ -165,12 +159,14 @@ def preprocess_data(df, expected_columns):
     return X.fillna(0)[expected_columns]
 
 # 📥 Obtener eventos desde MongoDB
-async def fetch_latest_events(limit=100):
-    """Obtiene los últimos eventos de MongoDB"""
+async def fetch_latest_events(limit=100, after_id=None):
+    """Obtiene hasta `limit` eventos pendientes en orden de inserción (sólo `_id > after_id` si se pasa)."""
     collection = db["events"]
-    #cursor = collection.find({}, {"_id": 0}).limit(limit)
+    query = {"processed": {"$ne": True}}
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
     cursor = collection.find(
-    {"processed": {"$ne": True}},
+        query,
         {
             "_id": 1,
             "src_ip": 1,
@@ -182,65 +178,16 @@ async def fetch_latest_events(limit=100):
             "packet_length": 1,
             "timestamp": 1
         }
-    ).limit(limit)
+    ).sort("_id", 1).limit(limit)
 
     return await cursor.to_list(length=limit)
 
 # 🛡️ Gestión de reglas existentes
 def load_existing_rules():
-    """Carga y clasifica las reglas existentes"""
-    existing_rules = set()
-    rule_patterns = set()
-    
-    if Path(RULES_FILE).exists():
-        with open(RULES_FILE, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    existing_rules.add(line)
-                    # Extraer patrón base (sin metadatos)
-                    rule_base = line.split('(')[0].strip()
-                    rule_patterns.add(rule_base)
-    
-    return existing_rules, rule_patterns
-
-# ✨ Generación de reglas
-def generate_rule(event):
-    """Genera una regla Suricata individual con políticas anti-FP."""
-    try:
-        proto = str(event.get("proto", "")).lower()
-        if proto not in {"tcp", "udp"}:
-            return None
-        src_ip = str(ipaddress.ip_address(event.get("src_ip")))
-        dst_ip = str(ipaddress.ip_address(event.get("dest_ip")))
-        src_port = int(event.get("src_port", 0)) if event.get("src_port") else "any"
-        dst_port = int(event.get("dest_port", 0))
-        if dst_port <= 0:
-            return None
-    except Exception:
-        return None
-
-    # No reglas DROP hacia servicios locales conocidos
-    if str(event.get("dest_ip")) in LOCAL_SERVICES:
-        return None
-
-    sev = int(pd.to_numeric(event.get("alert_severity", 0)))
-    pkt_len = int(pd.to_numeric(event.get("packet_length", 0)))
-    score = float(pd.to_numeric(event.get("anomaly_score", 0.0)))
-    thr = SELECTED_THRESHOLD if SELECTED_THRESHOLD is not None else ANOMALY_THRESHOLD
-
-    # Política de acción
-    alert_only = dst_port in ALERT_ONLY_PORTS
-    should_drop = bool(event.get("should_drop", False)) and not alert_only
-    action = "drop" if should_drop and (score < thr) else "alert"
-
-    severity_str = "HIGH risk" if action == "drop" else "suspicious"
-    unique_id = f"{src_ip}-{dst_ip}-{proto}-{dst_port}-{sev}-{pkt_len}-{round(score, 3)}"
-    sid = 3000000 + (int(hashlib.sha256(unique_id.encode()).hexdigest(), 16) % 500000)
-
-    msg = f'"ML anomaly (score: {score:.2f}, len: {pkt_len}, severity: {sev}, thr: {thr:.2f})"'
-    return f"{action} {proto} {src_ip} {src_port} -> {dst_ip} {dst_port} (msg:{msg}; sid:{sid}; rev:1;)"
-
+    """Reglas y patrones base ya conocidos (activos o desactivados), desde los índices en memoria del
+    almacén de reglas; sólo se recargan si otro proceso escribió o sml.rules se editó a mano."""
+    RULE_STORE.refresh()
+    return RULE_STORE.rules, RULE_STORE.patterns
 
 # 🔄 Recarga de reglas en Suricata
 async def reload_suricata_rules():
@@ -265,34 +212,167 @@ async def reload_suricata_rules():
         print(f"[GR] Excepción al recargar reglas: {str(e)}")
         return False
 
-async def mark_events_as_processed(event_ids):
-    """Marca eventos como procesados en MongoDB"""
+async def mark_events_as_processed(event_ids, chunk=RULES_MARK_CHUNK):
+    """Marca eventos como procesados en MongoDB con un bulk_write de UpdateMany por trozos de `chunk` ids
+    (nunca una única lista $in gigante). Devuelve cuántos se modificaron."""
     if not event_ids:
-        return
+        return 0
     
     try:
-        result = await db["events"].update_many(
-            {"_id": {"$in": event_ids}},
-            {"$set": {"processed": True}}
-        )
+        ops = [UpdateMany({"_id": {"$in": event_ids[i:i + chunk]}}, {"$set": {"processed": True}})
+               for i in range(0, len(event_ids), chunk)]
+        result = await db["events"].bulk_write(ops, ordered=False)
         print(f"[GR] Eventos marcados como procesados: {result.modified_count}")
+        return result.modified_count
     except Exception as e:
         print(f"[GR] Error al marcar eventos como procesados: {str(e)}")
+        return 0
+
+async def count_backlog():
+    """Eventos pendientes (`processed != True`)."""
+    return await db["events"].count_documents({"processed": {"$ne": True}})
+
+
+class BatchSizer:
+    """Tamaño de lote adaptativo: apunta a RULES_BATCH_TARGET_S por lote con el coste por evento medido
+    (media móvil exponencial de lectura + scoring + reglas + marcado), sin crecer más de ×2 por lote."""
+
+    def __init__(self, initial=RULES_BATCH_INITIAL, target_s=RULES_BATCH_TARGET_S,
+                 min_size=RULES_BATCH_MIN, max_size=RULES_BATCH_MAX, alpha=0.3):
+        self.size = initial
+        self.target_s = target_s
+        self.min_size = min_size
+        self.max_size = max_size
+        self.alpha = alpha
+        self.per_event_s = None
+
+    def observe(self, n_events, seconds):
+        if n_events <= 0:
+            return
+        per_event = seconds / n_events
+        self.per_event_s = per_event if self.per_event_s is None else \
+            self.alpha * per_event + (1 - self.alpha) * self.per_event_s
+        wanted = self.target_s / max(self.per_event_s, 1e-9)
+        self.size = int(min(max(wanted, self.min_size), self.max_size, 2 * self.size))
+
+    def eta(self, backlog):
+        """Segundos estimados para vaciar `backlog` eventos al coste medido (None sin medición)."""
+        return None if self.per_event_s is None else round(backlog * self.per_event_s, 1)
+
+
+# Se conserva entre ejecuciones: en rule_daemon.py el coste medido sobrevive de un despertar al siguiente
+BATCH_SIZER = BatchSizer()
+
 
 # 🚀 Función principal actualizada y corregida
-async def generate_suricata_rules():
+async def generate_suricata_rules(time_budget_s=RULES_DRAIN_BUDGET_S, sizer=None):
+    """Vacía la cola de eventos pendientes por lotes de tamaño adaptativo hasta que no quede ninguno o se
+    agote `time_budget_s`. Suricata se recarga al final (y como mucho cada RULES_RELOAD_INTERVAL_S durante
+    un vaciado largo). Devuelve un resumen: eventos leídos/marcados, anomalías, reglas nuevas, lotes,
+    backlog restante, tiempo estimado de vaciado y, si lo hubo, el error (rule_daemon.py y su endpoint)."""
+    sizer = sizer or BATCH_SIZER
+    PROFILE_INDEX.refresh()
+    stats = {"events": 0, "processed": 0, "anomalies": 0, "new_rules": 0, "training_mode": False, "error": None,
+             "batches": 0, "drained": False}
+    deadline = time.monotonic() + time_budget_s
+    after_id = None
+    pending_reload = False
+    last_reload = time.monotonic()
+    while True:
+        size = sizer.size
+        t0 = time.perf_counter()
+        try:
+            events = await fetch_latest_events(size, after_id)
+        except Exception as e:
+            print(f"[GR] ❌ Error leyendo eventos: {e}")
+            stats["error"] = str(e)
+            break
+        if not events:
+            if not stats["batches"]:
+                print("[GR] No hay eventos recientes para analizar")
+            stats["drained"] = True
+            break
+        # Marca de agua de esta ejecución: si el marcado de un lote falla, no se relee en bucle
+        after_id = events[-1]["_id"]
+        batch = await process_batch(events)
+        sizer.observe(len(events), time.perf_counter() - t0)
+        stats["batches"] += 1
+        for k in ("events", "processed", "anomalies", "new_rules"):
+            stats[k] += batch[k]
+        stats["training_mode"] = batch["training_mode"]
+        pending_reload |= batch["new_rules"] > 0
+        if batch["error"]:
+            stats["error"] = batch["error"]
+            break
+        if pending_reload and time.monotonic() - last_reload >= RULES_RELOAD_INTERVAL_S:
+            await _reload(stats)
+            pending_reload, last_reload = False, time.monotonic()
+        if len(events) < size:
+            stats["drained"] = True
+            break
+        if time.monotonic() >= deadline:
+            break
+
+    # 9. Recargar reglas en Suricata (una vez por vaciado, no una por lote)
+    if pending_reload:
+        await _reload(stats)
+    try:
+        PROFILE_INDEX.save()
+    except Exception as e:
+        print(f"[GR] ⚠ No se pudo guardar el índice de perfiles: {e}")
+    try:
+        stats["backlog"] = 0 if stats["drained"] and not stats["error"] else await count_backlog()
+    except Exception as e:
+        stats["backlog"] = None
+        print(f"[GR] ⚠ No se pudo contar el backlog: {e}")
+    stats["batch_size"] = sizer.size
+    stats["drain_eta_s"] = sizer.eta(stats["backlog"] or 0)
+    if stats["batches"] > 1 or stats["backlog"]:
+        print(f"[GR] 📦 {stats['processed']} eventos en {stats['batches']} lotes; backlog={stats['backlog']}, "
+              f"vaciado estimado={stats['drain_eta_s']}s, siguiente lote={sizer.size}")
+    return stats
+
+
+async def _reload(stats):
+    """Publica sml.rules desde el almacén (compactado, sólo si cambió) y recarga Suricata midiendo la recarga."""
+    try:
+        await asyncio.to_thread(RULE_STORE.publish)  # compactar/escribir no bloquea el bucle de eventos
+    except Exception as e:
+        print(f"[GR] ❌ No se pudo publicar sml.rules: {e}")
+        stats["reload_failed"] = True
+        return
+    if RULE_STORE.last_compaction:
+        stats["rules_before_compaction"] = RULE_STORE.last_compaction["before"]
+        stats["rules_after_compaction"] = RULE_STORE.last_compaction["after"]
+    t0 = time.perf_counter()
+    ok = await reload_suricata_rules()
+    stats["reload_s"] = round(time.perf_counter() - t0, 3)
+    print(f"[GR] 🔄 Recarga de Suricata en {stats['reload_s']:.3f}s "
+          f"(reglas del modelo: {stats.get('rules_before_compaction')} → {stats.get('rules_after_compaction')})")
+    if not ok:
+        print("[GR] ⚠ Las reglas se guardaron pero no se recargaron en Suricata")
+        stats["reload_failed"] = True
+
+
+async def process_batch(events):
+    """Un lote: scoring, filtros, reglas nuevas en el almacén de reglas y marcado como procesados (sin publicar
+    sml.rules ni recargar Suricata)."""
+    stats = {"events": len(events), "processed": 0, "anomalies": 0, "new_rules": 0, "training_mode": False,
+             "error": None}
+    # Todos los eventos (también en modo entrenamiento) alimentan los perfiles por src_ip. Se aplican antes de
+    # generar reglas (las contextuales ven el lote) y se deshacen si el lote no llega a marcarse como procesado:
+    # esos eventos se releerán y no deben contarse dos veces
+    profile_mark = PROFILE_INDEX.checkpoint()
     try:
-        # 1. Obtener eventos recientes
-        events = await fetch_latest_events()
+        PROFILE_INDEX.update([e.get("src_ip") for e in events], [e.get("dest_port") for e in events],
+                             [e.get("timestamp") for e in events])
         if await is_training_mode():
             print("[GR] 🧠 Modo entrenamiento activo: no se generarán reglas para estos eventos.")
-            await mark_events_as_processed([event["_id"] for event in events if "_id" in event])
-            return
+            stats["training_mode"] = True
+            stats["processed"] = await mark_events_as_processed([event["_id"] for event in events if "_id" in event])
+            return stats
         # 2. Cargar modelo
-        model, historical_data = load_resources()
-        if not events:
-            print("[GR] No hay eventos recientes para analizar")
-            return
+        model, thr, profiles = load_resources()
 
         df_events = pd.DataFrame(events)
         event_ids = [event["_id"] for event in events if "_id" in event]
@@ -311,7 +391,8 @@ async def generate_suricata_rules():
         missing = [col for col in expected_cols if col not in df_numeric.columns]
         if missing:
             print(f"[GR] ❌ Faltan columnas esperadas: {missing}")
-            return
+            stats["error"] = f"Faltan columnas esperadas: {missing}"
+            return stats
 
         df_numeric = df_numeric[expected_cols]
 
@@ -319,24 +400,53 @@ async def generate_suricata_rules():
         if df_numeric.shape[1] != model.n_features_in_:
             print("[GR] Columnas utilizadas por el modelo:", df_numeric.columns.tolist())
             print(f"[GR] Error: El modelo espera {model.n_features_in_} features, se obtuvieron {df_numeric.shape[1]}")
-            return
+            stats["error"] = f"El modelo espera {model.n_features_in_} features, se obtuvieron {df_numeric.shape[1]}"
+            return stats
 
         # 5. Predecir anomalías
-        df_events["anomaly_score"] = model.decision_function(df_numeric)
-        df_events["prediction"] = model.predict(df_numeric)
+        # Score y etiqueta en una sola pasada por el bosque
+        costs = {}
+        # Primera etapa: los eventos claramente normales según los prototipos no pasan por el bosque
+        needs_forest = np.ones(len(df_events), dtype=bool)
+        prototypes = PROTOTYPE_HANDLE.get()
+        if prototypes is not None:
+            t0 = time.perf_counter()
+            needs_forest = prototypes.needs_forest(df_events)
+            costs["prototypes"] = time.perf_counter() - t0
+            print(f"[GR] 🧭 Prototipos: {int((~needs_forest).sum())} de {len(df_events)} eventos descartados como normales")
+        df_events["anomaly_score"] = np.nan
+        df_events["prediction"] = 1
+        if needs_forest.any():
+            t0 = time.perf_counter()
+            scores, labels = model.score(df_numeric[needs_forest])
+            costs["iforest"] = time.perf_counter() - t0
+            df_events.loc[needs_forest, "anomaly_score"] = scores
+            df_events.loc[needs_forest, "prediction"] = labels
         print("[GR] Conteo de predicciones:", df_events["prediction"].value_counts().to_dict())
-        anomalies = df_events[df_events["prediction"] == ANOMALY_PREDICTION].copy()
 
-        # 📏 Filtro por umbral y políticas anti-FP
-        thr = SELECTED_THRESHOLD if SELECTED_THRESHOLD is not None else ANOMALY_THRESHOLD
-        anomalies = anomalies.copy()
+        # 5b. Detector supervisado (si está entrenado): sus positivos también son candidatos
+        df_events["supervised_anomaly"] = False
+        supervised = SUPERVISED_HANDLE.get()
+        if supervised is not None:
+            try:
+                t0 = time.perf_counter()
+                df_events["supervised_score"], sup_pred = supervised.score_events(events)
+                costs["supervised"] = time.perf_counter() - t0
+                df_events["supervised_anomaly"] = sup_pred == ANOMALY_PREDICTION
+                print(f"[GR] Supervisado: {int(df_events['supervised_anomaly'].sum())} positivos")
+            except Exception as e:
+                print(f"[GR] ⚠ Error en el detector supervisado: {e}")
+        print("[GR] ⏱ Coste de scoring por lote: " + ", ".join(
+            f"{name}={sec * 1e3:.2f} ms ({sec / len(df_events) * 1e6:.1f} µs/evento)" for name, sec in costs.items()))
+
+        # 📏 Umbral externo del IF (no aplica a los positivos del supervisado) y políticas anti-FP
+        forest_anomaly = live_anomalies(df_events["anomaly_score"], df_events["prediction"], thr)
+        anomalies = df_events[forest_anomaly | df_events["supervised_anomaly"]].copy()
 
         # Tipados y exclusiones
         anomalies["dest_port"] = pd.to_numeric(anomalies.get("dest_port", 0), errors="coerce").fillna(0).astype(int)
-        anomalies = anomalies[~anomalies["dest_ip"].astype(str).isin(LOCAL_SERVICES)]
-
-        # Umbral externo del IF
-        anomalies = anomalies[anomalies["anomaly_score"] < thr]
+        excluded = IP_POLICY.is_allowed(anomalies["dest_ip"].astype(str)) | IP_POLICY.is_ignored(anomalies["dest_port"])
+        anomalies = anomalies[~excluded]
 
         # Frecuencia por {src_ip, dest_port}
         if {"src_ip", "dest_port", "_id"}.issubset(anomalies.columns):
@@ -346,7 +456,10 @@ async def generate_suricata_rules():
 
         # Señales mínimas para permitir DROP
         sev = pd.to_numeric(anomalies.get("alert_severity", 0), errors="coerce").fillna(0).astype(int)
-        anomalies["should_drop"] = (sev >= MIN_SEVERITY_TO_DROP) & (anomalies["freq_sp"] >= MIN_FREQ_TO_DROP) & (~anomalies["dest_port"].isin(ALERT_ONLY_PORTS))
+        alert_only = IP_POLICY.is_alert_only(anomalies["dest_port"])
+        denied_src = IP_POLICY.is_denied(anomalies["src_ip"].astype(str))
+        # Orígenes en lista deny: DROP permitido sin exigir severidad/frecuencia (salvo puertos sólo-alerta)
+        anomalies["should_drop"] = (((sev >= MIN_SEVERITY_TO_DROP) & (anomalies["freq_sp"] >= MIN_FREQ_TO_DROP)) | denied_src) & ~alert_only
 
         # Clustering simple para no duplicar reglas: prioriza menor score
         keys = ["proto", "src_ip", "dest_ip", "dest_port"]
@@ -354,78 +467,31 @@ async def generate_suricata_rules():
         if existing_cols:
             anomalies = anomalies.sort_values("anomaly_score").drop_duplicates(existing_cols, keep="first")
 
+        stats["anomalies"] = int(len(anomalies))
         if anomalies.empty:
             print("[GR] No hay anomalías tras aplicar umbral y filtros")
-            return
+            # También se marcan: si no, el siguiente lote volvería a leer los mismos eventos
+            stats["processed"] = await mark_events_as_processed(event_ids)
+            return stats
 
-        # 6. Cargar reglas existentes
+        # 6. Cargar reglas existentes y generar las nuevas por columnas (escaneo de puertos, contextuales
+        #    por perfil del src_ip y una por evento, evitando duplicados y reglas redundantes)
         existing_rules, rule_patterns = load_existing_rules()
-        new_rules = []
-
-        # 🔍 Paso adicional: detectar escaneo de puertos y generar regla por IP
-        from collections import defaultdict
-        port_scan_ips = defaultdict(set)
-
-        for _, row in anomalies.iterrows():
-            port_scan_ips[row["src_ip"]].add(row["src_port"])
-
-        for ip, ports in port_scan_ips.items():
-            if len(ports) > 10:  # Umbral de escaneo de puertos
-                try:
-                    ip_str = str(ipaddress.ip_address(ip))
-                    rule_base = f"alert ip {ip_str} any -> any any"
-                    if rule_base not in rule_patterns:
-                        sid = 2000000 + int(hashlib.sha256(ip_str.encode()).hexdigest(), 16) % 900000
-                        rule = f'{rule_base} (msg:"Detected port scanning activity from {ip_str}"; sid:{sid}; rev:1;)'
-                        new_rules.append(rule)
-                        rule_patterns.add(rule_base)
-                        print(f"[GR] 🚨 Regla de escaneo añadida para {ip_str}")
-                except Exception as e:
-                    print(f"[GR] ⚠ Error generando regla para IP {ip}: {e}")
-
-        # 6b. Generar reglas contextuales por comportamiento histórico
-        if not historical_data.empty:
-            for _, event in anomalies.iterrows():
-                contextual_rule = generate_contextual_rule(event, historical_data)
-                if contextual_rule and contextual_rule not in existing_rules:
-                    print(f"[GR] ➕ Regla contextual generada:\n{contextual_rule}")
-                    new_rules.append(contextual_rule)
-
-        # 7. Generar nuevas reglas evitando duplicados y reglas redundantes (mismo src_ip, dest_ip, dest_port)
-        seen_combinations = set()
-        for _, event in anomalies.iterrows():
-            key = (event["src_ip"], event["dest_ip"], event["dest_port"])
-            if key in seen_combinations:
-                continue
-            seen_combinations.add(key)
-            if pd.notna(event["src_ip"]) and pd.notna(event["dest_ip"]):
-                rule = generate_rule(event)
-                print(f"[GR] ➕ Posible nueva regla:\n{rule}")
-                if rule and rule.split('(')[0].strip() not in rule_patterns:
-                    if rule not in existing_rules:
-                        print("[GR] ✅ Esta regla es nueva y se agregará")
-                        new_rules.append(rule)
-                        rule_patterns.add(rule.split('(')[0].strip())
-
-        # 8. Guardar reglas (manteniendo manuales intactas)
+        new_rules = render_rules(anomalies, IP_POLICY, thr, existing_rules, rule_patterns, profiles)
+
+        # 7. Guardar reglas nuevas en el almacén (sml.rules se publica al recargar Suricata)
         if new_rules:
-            manual_rules = [r for r in existing_rules if not r.startswith(('drop ip', 'alert ip'))]
-            with open(RULES_FILE, 'w') as f:
-                if manual_rules:
-                    f.write("\n".join(manual_rules) + "\n")
-                f.write("\n".join(new_rules) + "\n")
-
-            print(f"[GR] ✅✅✅ {len(new_rules)} nuevas reglas añadidas (Total: {len(manual_rules) + len(new_rules)})")
-
-            # 9. Recargar reglas en Suricata
-            if not await reload_suricata_rules():
-                print("[GR] ⚠ Las reglas se guardaron pero no se recargaron en Suricata")
-        #else:
-        #    print("[GR] No se generaron reglas nuevas (todas existían previamente)")
-        # 10. Marcar eventos como procesados (tanto anomalías como normales)
-        await mark_events_as_processed(event_ids)
+            stats["new_rules"] = RULE_STORE.add(new_rules)
+            print(f"[GR] ✅✅✅ {stats['new_rules']} nuevas reglas añadidas (Total: {len(RULE_STORE.rules)})")
+        # 8. Marcar eventos como procesados (tanto anomalías como normales)
+        stats["processed"] = await mark_events_as_processed(event_ids)
     except Exception as e:
         print(f"[GR] ❌ Error crítico: {str(e)}")
+        stats["error"] = str(e)
+    finally:
+        if not stats["processed"]:
+            PROFILE_INDEX.rollback(profile_mark)
+    return stats
 
 
 # Punto de entrada principal
@@ -0,0 +1,160 @@
+"""
+hyperparam_sweep.py
+
+📌 Función principal:
+    Barrido de hiperparámetros del Isolation Forest (contamination, n_estimators, max_samples) con
+    evaluación por división temporal, ejecutado en paralelo, para medir cuánto cuesta cada configuración
+    frente a lo que detecta.
+
+📏 Métricas por configuración:
+    - fit_s:         tiempo de ajuste
+    - score_us:      microsegundos de scoring por evento (decision_function sobre el bloque de evaluación)
+    - model_kb:      tamaño del modelo serializado
+    - ap / f1_best:  Average Precision y F1 al mejor umbral (si hay etiquetas)
+    - f1_predict:    F1 de model.predict (umbral implícito por contamination)
+
+📤 Salida:
+    - /app/models/sweep_report.csv   → todas las configuraciones (columna `pareto` = frente de Pareto)
+    - /app/models/sweep_report.json  → frente de Pareto y configuración recomendada
+
+🧪 Uso:
+    python hyperparam_sweep.py [--test-frac 0.3] [--jobs -1] [--target-ap 0.9]
+    Con `--target-ap` se recomienda la configuración más barata (score_us) que alcanza ese AP.
+"""
+import argparse
+import itertools
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import IsolationForest
+from sklearn.metrics import average_precision_score, f1_score
+
+from constants import MODEL_DIR, PREPROCESSED_CSV, GROUND_TRUTH_CSV, ANOMALY_PREDICTION
+from threshold_optimizer import best_threshold
+from train_model import load_training_frame, feature_frame, normal_rows, true_labels
+
+SWEEP_CSV = os.path.join(MODEL_DIR, "sweep_report.csv")
+SWEEP_JSON = os.path.join(MODEL_DIR, "sweep_report.json")
+
+GRID = {
+    "contamination": [0.01, 0.02, 0.05, 0.1],
+    "n_estimators": [25, 50, 100, 200],
+    "max_samples": [64, 128, 256, 512],
+}
+
+
+def _labels(data_path, df):
+    """y_true desde el propio CSV o, si no hay, desde ground_truth.csv por event_id."""
+    # Las columnas de etiqueta se leen en crudo: load_training_frame las fuerza a numéricas
+    label_cols = ["label", "label_text", "training_label", "label_num"]
+    raw = pd.read_csv(data_path, usecols=lambda c: c in label_cols, dtype=str)
+    if "label_num" in raw.columns:
+        raw["label_num"] = pd.to_numeric(raw["label_num"], errors="coerce")
+    y = true_labels(raw) if not raw.columns.empty else None
+    if y is not None or "event_id" not in df.columns or not os.path.exists(GROUND_TRUTH_CSV):
+        return y
+    gt = pd.read_csv(GROUND_TRUTH_CSV, dtype={"event_id": str})
+    col = next((c for c in ["gt_label", "prediction_g"] if c in gt.columns), None)
+    if col is None:
+        return None
+    mapped = df["event_id"].astype(str).map(gt.drop_duplicates("event_id").set_index("event_id")[col])
+    if mapped.notna().sum() == 0:
+        return None
+    return mapped.fillna(0).astype(int).values
+
+
+def time_split(df, test_frac):
+    """Entrenamiento = primeras filas (orden de llegada); evaluación = el bloque final."""
+    cut = int(len(df) * (1 - test_frac))
+    return df.iloc[:cut], df.iloc[cut:]
+
+
+def evaluate_config(params, X_train, X_test, y_test):
+    model = IsolationForest(random_state=42, n_jobs=1, **params)
+    t0 = time.perf_counter()
+    model.fit(X_train)
+    fit_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scores = model.decision_function(X_test)
+    score_us = (time.perf_counter() - t0) / max(len(X_test), 1) * 1e6
+    pred = (model.predict(X_test) == ANOMALY_PREDICTION).astype(int)
+
+    row = {**params, "fit_s": round(fit_s, 4), "score_us": round(score_us, 3),
+           "model_kb": round(len(pickle.dumps(model)) / 1024, 1),
+           "ap": None, "f1_best": None, "f1_predict": None}
+    if y_test is not None and 0 < y_test.sum() < len(y_test):
+        row["ap"] = round(float(average_precision_score(y_test, -scores)), 4)
+        best = best_threshold(scores, y_test)
+        row["f1_best"] = round(best["f1"], 4) if best else None
+        row["f1_predict"] = round(float(f1_score(y_test, pred, zero_division=0)), 4)
+    return row
+
+
+def pareto_front(report):
+    """Marca configuraciones no dominadas: menor score_us, fit_s y model_kb; mayor ap."""
+    costs = report[["score_us", "fit_s", "model_kb"]].to_numpy(dtype=float)
+    gain = report["ap"].fillna(0).to_numpy(dtype=float)
+    n = len(report)
+    front = np.ones(n, dtype=bool)
+    for i in range(n):
+        no_worse = (costs <= costs[i]).all(axis=1) & (gain >= gain[i])
+        better = (costs < costs[i]).any(axis=1) | (gain > gain[i])
+        front[i] = not (no_worse & better).any()
+    return front
+
+
+def run_sweep(data_path=PREPROCESSED_CSV, test_frac=0.3, n_jobs=-1, grid=None, target_ap=None):
+    grid = grid or GRID
+    df = load_training_frame(data_path)
+    y = _labels(data_path, df)
+    train_df, test_df = time_split(df, test_frac)
+    X_train = feature_frame(normal_rows(train_df))
+    X_test = feature_frame(test_df)
+    y_test = None if y is None else np.asarray(y)[len(train_df):]
+    print(f"[SW] 🧪 Train={len(X_train)} Test={len(X_test)} etiquetas={'sí' if y_test is not None else 'no'}")
+
+    combos = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    print(f"[SW] 🔁 Evaluando {len(combos)} configuraciones en paralelo (n_jobs={n_jobs})...")
+    rows = Parallel(n_jobs=n_jobs)(delayed(evaluate_config)(p, X_train, X_test, y_test) for p in combos)
+
+    report = pd.DataFrame(rows)
+    report["pareto"] = pareto_front(report)
+    report = report.sort_values(["pareto", "score_us"], ascending=[False, True]).reset_index(drop=True)
+
+    recommended = None
+    if target_ap is not None and report["ap"].notna().any():
+        ok = report[report["ap"] >= target_ap]
+        if not ok.empty:
+            recommended = ok.sort_values(["score_us", "fit_s"]).iloc[0].to_dict()
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    report.to_csv(SWEEP_CSV, index=False)
+    with open(SWEEP_JSON, "w") as f:
+        json.dump({
+            "train_rows": int(len(X_train)), "test_rows": int(len(X_test)),
+            "target_ap": target_ap, "recommended": recommended,
+            "pareto": report[report["pareto"]].drop(columns="pareto").to_dict(orient="records"),
+        }, f, indent=2, default=float)
+
+    print("[SW] 📈 Frente de Pareto (coste vs AP):")
+    print(report[report["pareto"]].drop(columns="pareto").to_string(index=False))
+    if target_ap is not None:
+        print(f"[SW] 🎯 Recomendada para AP>={target_ap}: {recommended}")
+    print(f"[SW] ✅ Reporte guardado en {SWEEP_CSV} y {SWEEP_JSON}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido de hiperparámetros del Isolation Forest")
+    parser.add_argument("--data", default=PREPROCESSED_CSV)
+    parser.add_argument("--test-frac", type=float, default=0.3)
+    parser.add_argument("--jobs", type=int, default=-1)
+    parser.add_argument("--target-ap", type=float, default=None)
+    args = parser.parse_args()
+    run_sweep(args.data, args.test_frac, args.jobs, target_ap=args.target_ap)
@@ -0,0 +1,238 @@
+"""
+ip_codec.py
+
+📌 Función principal:
+    Codificar columnas de direcciones IP (texto) en arreglos numéricos de ancho fijo, de forma vectorizada.
+
+📐 Representación:
+    - `family`: uint8 → 4 (IPv4), 6 (IPv6), 0 (inválida/vacía)
+    - `v4`:     uint32 → dirección IPv4 (0 si no es IPv4)
+    - `v6_hi`:  uint64 → 64 bits altos de la dirección IPv6 (0 si no es IPv6)
+    - `v6_lo`:  uint64 → 64 bits bajos de la dirección IPv6 (0 si no es IPv6)
+
+⚡ Rendimiento:
+    - Se factoriza la columna y sólo se decodifican las direcciones únicas (las repetidas cuestan un lookup).
+    - IPv4 se parsea sobre una matriz de bytes con numpy, sin bucles Python por fila.
+    - IPv6 (poco frecuente en el laboratorio) se decodifica por dirección única y se memoiza entre llamadas.
+
+🔗 Usado por:
+    - ml_processing.py, train_model.py y generate_rules.py (sustituye a las conversiones por fila con `ipaddress`).
+"""
+import ipaddress
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+FAMILY_INVALID = 0
+FAMILY_V4 = 4
+FAMILY_V6 = 6
+
+# Longitud máxima de "255.255.255.255"
+_V4_MAX_LEN = 15
+# Memo de direcciones no-IPv4 (IPv6 e inválidas) → (family, hi, lo)
+_V6_CACHE: Dict[str, Tuple[int, int, int]] = {}
+_V6_CACHE_MAX = 65536
+
+# Sufijos de las columnas derivadas que añade expand_ip_columns()
+IP_DERIVED_SUFFIXES = ("_family", "_v6_hi", "_v6_lo", "_net24", "_net16")
+
+
+class IPArrays(NamedTuple):
+    family: np.ndarray  # uint8
+    v4: np.ndarray      # uint32
+    v6_hi: np.ndarray   # uint64
+    v6_lo: np.ndarray   # uint64
+
+    def __len__(self):
+        return len(self.family)
+
+
+def _empty(n: int) -> IPArrays:
+    return IPArrays(
+        np.zeros(n, dtype=np.uint8),
+        np.zeros(n, dtype=np.uint32),
+        np.zeros(n, dtype=np.uint64),
+        np.zeros(n, dtype=np.uint64),
+    )
+
+
+def _parse_v4_bytes(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Parsea un arreglo de strings como IPv4 sobre una matriz (n, 15) de bytes.
+
+    Devuelve (ok, v4) donde `ok` marca las entradas que son IPv4 válidas.
+    """
+    n = len(values)
+    ok = np.zeros(n, dtype=bool)
+    v4 = np.zeros(n, dtype=np.uint32)
+    if n == 0:
+        return ok, v4
+
+    lengths = np.char.str_len(values)
+    cand = (lengths >= 7) & (lengths <= _V4_MAX_LEN)
+    if not cand.any():
+        return ok, v4
+
+    # Vista directa de los code points UCS-4 (sin codificar): matriz (m, 15), relleno con 0
+    raw = np.ascontiguousarray(values[cand].astype(f"U{_V4_MAX_LEN}"))
+    cols = np.ascontiguousarray(raw.view(np.uint32).reshape(-1, _V4_MAX_LEN).T)
+    m = cols.shape[1]
+
+    valid = np.ones(m, dtype=bool)
+    ended = np.zeros(m, dtype=bool)      # ya se vio el relleno NUL
+    octet = np.zeros(m, dtype=np.uint32) # valor del octeto en curso
+    ndig = np.zeros(m, dtype=np.uint8)   # dígitos del octeto en curso
+    lead0 = np.zeros(m, dtype=bool)      # el octeto empieza por '0'
+    ndots = np.zeros(m, dtype=np.uint8)
+    acc = np.zeros(m, dtype=np.uint32)
+
+    # Barrido por columna (15 pasos), vectorizado sobre todas las filas
+    for j in range(_V4_MAX_LEN + 1):
+        c = cols[j] if j < _V4_MAX_LEN else np.zeros(m, dtype=np.uint32)
+        d = c - np.uint32(48)            # underflow → valor enorme, no dígito
+        is_dig = d <= 9
+        is_nul = c == 0
+        is_dot = c == 46
+        valid &= (is_dig | is_dot | is_nul) & ~(ended & ~is_nul)
+        closing = (is_dot | is_nul) & ~ended
+        if closing.any():
+            valid &= ~closing | ((ndig >= 1) & (ndig <= 3) & (octet <= 255) & ~(lead0 & (ndig > 1)))
+            np.copyto(acc, (acc << np.uint32(8)) | (octet & np.uint32(0xFF)), where=closing)
+            octet[closing] = 0
+            ndig[closing] = 0
+        ndots += is_dot
+        np.copyto(lead0, d == 0, where=is_dig & (ndig == 0))
+        np.copyto(octet, octet * np.uint32(10) + d, where=is_dig)
+        ndig += is_dig
+        ended |= is_nul
+    valid &= ndots == 3
+
+    cand_idx = np.flatnonzero(cand)
+    ok[cand_idx] = valid
+    v4[cand_idx] = np.where(valid, acc, 0).astype(np.uint32)
+    return ok, v4
+
+
+def _decode_other(value: str) -> Tuple[int, int, int]:
+    """Decodifica (memoizado) una dirección que no es IPv4 canónica."""
+    hit = _V6_CACHE.get(value)
+    if hit is not None:
+        return hit
+    try:
+        addr = ipaddress.ip_address(value)
+    except ValueError:
+        res = (FAMILY_INVALID, 0, 0)
+    else:
+        if addr.version == 4:
+            res = (FAMILY_V4, int(addr), 0)
+        else:
+            n = int(addr)
+            res = (FAMILY_V6, n >> 64, n & 0xFFFFFFFFFFFFFFFF)
+    if len(_V6_CACHE) >= _V6_CACHE_MAX:
+        _V6_CACHE.clear()
+    _V6_CACHE[value] = res
+    return res
+
+
+def encode_ips(values: Iterable) -> IPArrays:
+    """Codifica una colección de IPs (texto) en arreglos de ancho fijo.
+
+    Las entradas vacías/NaN o inválidas quedan con family=0 y valores en cero.
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(list(values) if not isinstance(values, np.ndarray) else values)
+    n = len(s)
+    if n == 0:
+        return _empty(0)
+
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    uniq = np.asarray(uniques, dtype=object)
+    u_str = np.asarray([u if isinstance(u, str) else str(u) for u in uniq], dtype=str) if len(uniq) else np.array([], dtype=str)
+
+    u = _empty(len(u_str))
+    ok4, v4 = _parse_v4_bytes(u_str)
+    u.family[ok4] = FAMILY_V4
+    u.v4[ok4] = v4[ok4]
+
+    # Resto (IPv6, IPv4 con espacios, basura): una decodificación por dirección única
+    for i in np.flatnonzero(~ok4):
+        fam, hi, lo = _decode_other(u_str[i])
+        u.family[i] = fam
+        if fam == FAMILY_V4:
+            u.v4[i] = hi
+        elif fam == FAMILY_V6:
+            u.v6_hi[i] = hi
+            u.v6_lo[i] = lo
+
+    out = _empty(n)
+    present = codes >= 0
+    idx = codes[present]
+    out.family[present] = u.family[idx]
+    out.v4[present] = u.v4[idx]
+    out.v6_hi[present] = u.v6_hi[idx]
+    out.v6_lo[present] = u.v6_lo[idx]
+    return out
+
+
+def network_v4(v4: np.ndarray, prefix: int) -> np.ndarray:
+    """Red IPv4 (/prefix) como uint32: la dirección con los bits de host a cero."""
+    if prefix <= 0:
+        return np.zeros_like(v4, dtype=np.uint32)
+    mask = np.uint32((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF)
+    return (v4.astype(np.uint32) & mask).astype(np.uint32)
+
+
+def prefix_features(arr: IPArrays) -> Dict[str, np.ndarray]:
+    """Features de prefijo: red /24 y /16 para IPv4; /64 y /48 (bits altos) para IPv6."""
+    is6 = arr.family == FAMILY_V6
+    hi48 = arr.v6_hi & np.uint64(0xFFFFFFFFFFFF0000)
+    net24 = np.where(is6, arr.v6_hi, network_v4(arr.v4, 24).astype(np.uint64)).astype(np.uint64)
+    net16 = np.where(is6, hi48, network_v4(arr.v4, 16).astype(np.uint64)).astype(np.uint64)
+    return {"net24": net24, "net16": net16}
+
+
+def v4_to_str(v4: np.ndarray) -> np.ndarray:
+    """Renderiza un arreglo uint32 como texto IPv4 (vectorizado por octeto)."""
+    v = np.asarray(v4, dtype=np.uint32)
+    parts = [((v >> s) & 0xFF).astype(str) for s in (24, 16, 8, 0)]
+    out = parts[0]
+    for p in parts[1:]:
+        out = np.char.add(np.char.add(out, "."), p)
+    return out
+
+
+def ip_to_numeric(values: Iterable) -> np.ndarray:
+    """Vista de una sola columna: IPv4 como entero (int64); IPv6/inválidas → 0.
+
+    Si la columna ya es numérica (p. ej. releída desde el CSV preprocesado) se devuelve tal cual.
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(s):
+        return s.fillna(0).to_numpy()
+    return encode_ips(s).v4.astype(np.int64)
+
+
+def derived_ip_columns(cols: Iterable[str]) -> List[str]:
+    """Nombres de las columnas que expand_ip_columns() añade para `cols`."""
+    return [f"{c}{suf}" for c in cols for suf in IP_DERIVED_SUFFIXES]
+
+
+def expand_ip_columns(df: pd.DataFrame, cols: Iterable[str]) -> pd.DataFrame:
+    """Reemplaza cada columna IP por su valor IPv4 (uint32) y añade columnas derivadas.
+
+    Para cada `col` se añaden `col_family`, `col_v6_hi`, `col_v6_lo`, `col_net24` y `col_net16`.
+    """
+    for col in cols:
+        if col not in df.columns:
+            continue
+        arr = encode_ips(df[col])
+        invalid = int(((arr.family == FAMILY_INVALID) & df[col].notna().to_numpy()).sum())
+        if invalid:
+            print(f"[IP] ⚠ {invalid} IPs inválidas en '{col}' (codificadas como 0)")
+        feats = prefix_features(arr)
+        df[col] = arr.v4
+        df[f"{col}_family"] = arr.family
+        df[f"{col}_v6_hi"] = arr.v6_hi
+        df[f"{col}_v6_lo"] = arr.v6_lo
+        df[f"{col}_net24"] = feats["net24"]
+        df[f"{col}_net16"] = feats["net16"]
+    return df
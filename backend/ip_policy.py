@@ -0,0 +1,203 @@
+"""
+ip_policy.py
+
+📌 Función principal:
+    Motor de listas de red (CIDR) con coincidencia de prefijo más largo y políticas de puertos,
+    evaluado de forma vectorizada sobre columnas completas de IPs.
+
+🧾 Configuración (`/app/models/ip_policy.json`):
+    {
+        "allow": ["10.0.2.3/32", "192.168.10.0/24"],   # nunca generar reglas hacia estas redes
+        "deny":  ["203.0.113.0/24"],                  # orígenes hostiles: DROP permitido sin exigir frecuencia
+        "alert_only_ports": [53, 80, 123, 443],        # nunca DROP por score aislado
+        "ignore_ports": []                             # puertos destino excluidos de reglas
+    }
+    Si el archivo no existe se usan `LOCAL_SERVICES` (como /32) y `ALERT_ONLY_PORTS` de constants.py.
+
+⚙️ Estructura compilada:
+    Los prefijos CIDR están anidados o son disjuntos, así que se aplanan (una sola vez) en intervalos
+    ordenados y disjuntos, cada uno con la acción de su prefijo más específico. La búsqueda es un
+    `np.searchsorted` por familia: O(log P) por IP, sin bucles Python por fila.
+    - IPv4: claves uint32 (en uint64).
+    - IPv6: claves de 16 bytes big-endian (`S16`), cuyo orden lexicográfico coincide con el numérico.
+    En empate exacto de prefijo gana `allow` (criterio anti-falsos positivos).
+"""
+import ipaddress
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from constants import ALERT_ONLY_PORTS, LOCAL_SERVICES, IP_POLICY_FILE
+from ip_codec import FAMILY_V4, FAMILY_V6, IPArrays, encode_ips
+
+ACTION_NONE = 0
+ACTION_ALLOW = 1
+ACTION_DENY = 2
+
+# Prioridad en empate exacto de prefijo (mayor gana)
+_TIE_PRIORITY = {ACTION_DENY: 0, ACTION_ALLOW: 1}
+
+
+def _v6_key(hi: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    """Clave ordenable de 16 bytes big-endian para direcciones IPv6."""
+    buf = np.empty((len(hi), 2), dtype=">u8")
+    buf[:, 0] = hi
+    buf[:, 1] = lo
+    return buf.view("S16").ravel()
+
+
+def _v6_key_int(n: int) -> bytes:
+    return n.to_bytes(16, "big")
+
+
+def _flatten(prefixes: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """Aplana prefijos (start, end, action) anidados/disjuntos en intervalos disjuntos.
+
+    Cada intervalo hereda la acción del prefijo más específico que lo cubre.
+    """
+    # Más amplio primero a igual inicio; en empate exacto, el de mayor prioridad queda arriba de la pila
+    items = sorted(prefixes, key=lambda p: (p[0], -(p[1] - p[0]), _TIE_PRIORITY[p[2]]))
+    out: List[Tuple[int, int, int]] = []
+    stack: List[Tuple[int, int]] = []  # (end, action)
+    cursor = 0
+
+    def emit(a, b, action):
+        if a <= b:
+            if out and out[-1][2] == action and out[-1][1] + 1 == a:
+                out[-1] = (out[-1][0], b, action)
+            else:
+                out.append((a, b, action))
+
+    for start, end, action in items:
+        while stack and stack[-1][0] < start:
+            top_end, top_action = stack.pop()
+            emit(cursor, top_end, top_action)
+            cursor = top_end + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][1])
+        stack.append((end, action))
+        cursor = start
+    while stack:
+        top_end, top_action = stack.pop()
+        emit(cursor, top_end, top_action)
+        cursor = top_end + 1
+    return out
+
+
+class PrefixTable:
+    """Tabla de prefijos compilada para IPv4 e IPv6 con búsqueda vectorizada."""
+
+    def __init__(self, entries: Iterable[Tuple[str, int]]):
+        v4: List[Tuple[int, int, int]] = []
+        v6: List[Tuple[int, int, int]] = []
+        self.size = 0
+        for cidr, action in entries:
+            try:
+                net = ipaddress.ip_network(str(cidr).strip(), strict=False)
+            except ValueError:
+                print(f"[POL] ⚠ Prefijo inválido ignorado: {cidr}")
+                continue
+            item = (int(net.network_address), int(net.broadcast_address), action)
+            (v4 if net.version == 4 else v6).append(item)
+            self.size += 1
+
+        segs4 = _flatten(v4)
+        self._v4_start = np.array([s for s, _, _ in segs4], dtype=np.uint64)
+        self._v4_end = np.array([e for _, e, _ in segs4], dtype=np.uint64)
+        self._v4_action = np.array([a for _, _, a in segs4], dtype=np.uint8)
+
+        segs6 = _flatten(v6)
+        self._v6_start = np.array([_v6_key_int(s) for s, _, _ in segs6], dtype="S16")
+        self._v6_end = np.array([_v6_key_int(e) for _, e, _ in segs6], dtype="S16")
+        self._v6_action = np.array([a for _, _, a in segs6], dtype=np.uint8)
+
+    @staticmethod
+    def _search(keys, starts, ends, actions) -> np.ndarray:
+        out = np.zeros(len(keys), dtype=np.uint8)
+        if len(starts) == 0 or len(keys) == 0:
+            return out
+        idx = np.searchsorted(starts, keys, side="right") - 1
+        safe = np.clip(idx, 0, None)
+        hit = (idx >= 0) & (keys <= ends[safe])
+        out[hit] = actions[safe[hit]]
+        return out
+
+    def lookup(self, ips) -> np.ndarray:
+        """Acción (ACTION_*) del prefijo más específico para cada IP; ACTION_NONE si no hay coincidencia."""
+        arr = ips if isinstance(ips, IPArrays) else encode_ips(ips)
+        out = np.zeros(len(arr), dtype=np.uint8)
+        is4 = arr.family == FAMILY_V4
+        if is4.any():
+            out[is4] = self._search(arr.v4[is4].astype(np.uint64), self._v4_start, self._v4_end, self._v4_action)
+        is6 = arr.family == FAMILY_V6
+        if is6.any():
+            keys = _v6_key(arr.v6_hi[is6], arr.v6_lo[is6])
+            out[is6] = self._search(keys, self._v6_start, self._v6_end, self._v6_action)
+        return out
+
+
+class IPPolicy:
+    """Listas allow/deny (CIDR) más políticas de puertos destino."""
+
+    def __init__(self, allow: Iterable[str] = (), deny: Iterable[str] = (),
+                 alert_only_ports: Iterable[int] = (), ignore_ports: Iterable[int] = ()):
+        allow = list(allow)
+        deny = list(deny)
+        self.table = PrefixTable([(c, ACTION_ALLOW) for c in allow] + [(c, ACTION_DENY) for c in deny])
+        self.alert_only_ports = frozenset(int(p) for p in alert_only_ports)
+        self.ignore_ports = frozenset(int(p) for p in ignore_ports)
+        self._alert_only_arr = np.array(sorted(self.alert_only_ports), dtype=np.int64)
+        self._ignore_arr = np.array(sorted(self.ignore_ports), dtype=np.int64)
+        self.n_allow, self.n_deny = len(allow), len(deny)
+
+    @classmethod
+    def defaults(cls) -> "IPPolicy":
+        return cls(allow=[f"{ip}/32" if ":" not in ip else f"{ip}/128" for ip in LOCAL_SERVICES],
+                   alert_only_ports=ALERT_ONLY_PORTS)
+
+    @classmethod
+    def from_file(cls, path: str = IP_POLICY_FILE) -> "IPPolicy":
+        p = Path(path)
+        if not p.exists():
+            return cls.defaults()
+        data: Dict = json.loads(p.read_text())
+        return cls(
+            allow=data.get("allow", []),
+            deny=data.get("deny", []),
+            alert_only_ports=data.get("alert_only_ports", sorted(ALERT_ONLY_PORTS)),
+            ignore_ports=data.get("ignore_ports", []),
+        )
+
+    def lookup(self, ips) -> np.ndarray:
+        return self.table.lookup(ips)
+
+    def is_allowed(self, ips) -> np.ndarray:
+        return self.lookup(ips) == ACTION_ALLOW
+
+    def is_denied(self, ips) -> np.ndarray:
+        return self.lookup(ips) == ACTION_DENY
+
+    @staticmethod
+    def _ports(ports) -> np.ndarray:
+        return pd.to_numeric(pd.Series(np.asarray(ports).ravel()), errors="coerce").fillna(-1).astype(np.int64).to_numpy()
+
+    def is_alert_only(self, ports) -> np.ndarray:
+        return np.isin(self._ports(ports), self._alert_only_arr)
+
+    def is_ignored(self, ports) -> np.ndarray:
+        return np.isin(self._ports(ports), self._ignore_arr)
+
+
+def load_policy(path: Optional[str] = None) -> IPPolicy:
+    """Carga la política desde disco; ante error vuelve a los valores de constants.py."""
+    try:
+        policy = IPPolicy.from_file(path or IP_POLICY_FILE)
+    except Exception as e:
+        print(f"[POL] ⚠ No se pudo leer la política de red ({e}); usando valores por defecto.")
+        policy = IPPolicy.defaults()
+    print(f"[POL] Política de red: {policy.n_allow} allow, {policy.n_deny} deny, "
+          f"{len(policy.alert_only_ports)} puertos sólo-alerta")
+    return policy
@@ -0,0 +1,158 @@
+"""
+labeled_store.py
+
+📌 Función principal:
+    Almacén columnar único de scores del modelo y etiquetas del ground truth, indexado por event_id.
+    Sustituye el cruce (merge) por texto entre ground_truth.csv y suricata_anomaly_analysis.csv:
+    evaluate.py lee arreglos ya alineados.
+
+📦 Formato (LABELED_SCORES_NPZ, un .npz escrito con archivo temporal + os.replace):
+    keys        → event_id en bytes; la posición en este arreglo es la clave sustituta entera
+    score       → float64, anomaly_score del último entrenamiento (NaN si no hay)
+    prediction  → int8, -1/1 (0 si no hay)
+    label       → int8, 1 = anomalía, 0 = normal (-1 si no hay)
+    proto, dest_port → float64, columnas de contexto para el análisis de FN/FP
+    Todas las columnas están alineadas con `keys`: no hay joins al leer.
+
+⚙️ Escritura:
+    - write_scores() (train_model.py) reemplaza las columnas del modelo; write_labels()
+      (generate_ground_truth.py) reemplaza la de etiquetas. Los event_id nuevos se añaden al final;
+      las filas que se quedan sin score y sin etiqueta se eliminan.
+    - event_id → clave sustituta con una búsqueda binaria vectorizada (argsort + searchsorted).
+    - Un flock sobre `<store>.lock` serializa a los escritores (entrenamiento y exportación del ground truth
+      pueden correr en procesos distintos).
+
+🔗 Usado por:
+    - train_model.py           → write_scores() en la etapa "results"
+    - generate_ground_truth.py → write_labels() al exportar
+    - evaluate.py              → read_aligned()
+"""
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from constants import LABELED_SCORES_NPZ
+
+# columna → (dtype, valor para "sin dato")
+COLUMNS = {
+    "score": (np.float64, np.nan),
+    "prediction": (np.int8, 0),
+    "label": (np.int8, -1),
+    "proto": (np.float64, np.nan),
+    "dest_port": (np.float64, np.nan),
+}
+SCORE_COLUMNS = ("score", "prediction", "proto", "dest_port")
+LABEL_COLUMNS = ("label",)
+
+
+def _empty():
+    store = {"keys": np.empty(0, dtype="S1")}
+    for name, (dtype, _) in COLUMNS.items():
+        store[name] = np.empty(0, dtype=dtype)
+    store["meta"] = {}
+    return store
+
+
+def load(path=LABELED_SCORES_NPZ) -> dict:
+    """Columnas del almacén (vacías si no existe)."""
+    if not os.path.exists(path):
+        return _empty()
+    with np.load(path) as data:
+        store = {name: data[name] for name in ["keys", *COLUMNS] if name in data.files}
+        meta = json.loads(str(data["meta"])) if "meta" in data.files else {}
+    for name, (dtype, fill) in COLUMNS.items():
+        if name not in store:  # almacén de una versión anterior sin esta columna
+            store[name] = np.full(len(store["keys"]), fill, dtype=dtype)
+    store["meta"] = meta
+    return store
+
+
+def _save(store, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp, meta=np.array(json.dumps(store["meta"])),
+             **{name: store[name] for name in ["keys", *COLUMNS]})
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _locked(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _as_keys(event_ids):
+    return np.asarray([str(e) for e in event_ids]).astype("S")
+
+
+def surrogate_keys(keys, ids) -> np.ndarray:
+    """Posición de cada id en `keys` (-1 si no está), sin bucles de Python."""
+    if len(keys) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, ids), len(keys) - 1)
+    return np.where(sorted_keys[pos] == ids, order[pos], -1).astype(np.int64)
+
+
+def _upsert(event_ids, values, replace, path):
+    """Reemplaza las columnas `replace` con `values` (dict columna → arreglo alineado con event_ids)."""
+    ids = _as_keys(event_ids)
+    with _locked(path):
+        store = load(path)
+        for name in replace:
+            store[name] = np.full(len(store["keys"]), COLUMNS[name][1], dtype=COLUMNS[name][0])
+
+        sk = surrogate_keys(store["keys"], ids)
+        new_ids = np.unique(ids[sk < 0])
+        if new_ids.size:
+            store["keys"] = np.concatenate([store["keys"], new_ids])
+            for name, (dtype, fill) in COLUMNS.items():
+                store[name] = np.concatenate([store[name], np.full(new_ids.size, fill, dtype=dtype)])
+            sk = surrogate_keys(store["keys"], ids)
+        for name, column in values.items():
+            if column is not None:
+                store[name][sk] = np.asarray(column, dtype=COLUMNS[name][0])
+
+        # Filas sin score ni etiqueta ya no aportan nada
+        keep = ~np.isnan(store["score"]) | (store["label"] >= 0)
+        if not keep.all():
+            for name in ["keys", *COLUMNS]:
+                store[name] = store[name][keep]
+        store["meta"][f"{'scores' if 'score' in replace else 'labels'}_at"] = time.time()
+        _save(store, path)
+    return int(len(store["keys"]))
+
+
+def write_scores(event_ids, scores, predictions, proto=None, dest_port=None, path=LABELED_SCORES_NPZ):
+    """Scores y predicciones del último entrenamiento (reemplaza los anteriores)."""
+    n = _upsert(event_ids, {"score": scores, "prediction": predictions, "proto": proto, "dest_port": dest_port},
+                SCORE_COLUMNS, path)
+    print(f"[LS] 💾 Scores de {len(scores)} eventos en el almacén etiquetado ({n} claves)")
+
+
+def write_labels(event_ids, labels, path=LABELED_SCORES_NPZ):
+    """Etiquetas del ground truth (1 = anomalía, 0 = normal; reemplaza las anteriores)."""
+    n = _upsert(event_ids, {"label": labels}, LABEL_COLUMNS, path)
+    print(f"[LS] 💾 Etiquetas de {len(labels)} eventos en el almacén etiquetado ({n} claves)")
+
+
+def read_aligned(path=LABELED_SCORES_NPZ):
+    """Columnas de los eventos con score y etiqueta, alineadas por clave sustituta. None si no hay almacén."""
+    if not os.path.exists(path):
+        return None
+    store = load(path)
+    both = ~np.isnan(store["score"]) & (store["label"] >= 0)
+    out = {name: store[name][both] for name in COLUMNS}
+    out["event_id"] = store["keys"][both].astype(str)
+    out["meta"] = store["meta"]
+    return out
@@ -3,6 +3,10 @@ from fastapi.staticfiles import StaticFiles
 from routes import router  # Asegúrate de que routes.py existe
 import asyncio
 from db_connection import db, init_db
+import os
+import training_service
+from online_evaluator import ONLINE_EVALUATOR
+from constants import IFOREST_MODEL, PREPROCESSED_CSV
 
 
 app = FastAPI(title="API de Seguridad con Suricata y FastAPI")
@@ -17,6 +21,27 @@ app.include_router(router)
 async def startup_event():
     """Se asegura de que la base de datos está lista al iniciar FastAPI."""
     await init_db()
+    # Entrenamiento inicial en segundo plano (sin bloquear el arranque de la API)
+    if not os.path.exists(IFOREST_MODEL) and _csv_has_rows(PREPROCESSED_CSV):
+        print("[API] Modelo no encontrado y hay datos. Encolando entrenamiento inicial...")
+        training_service.submit_training()
+    # Evaluación continua del modelo vigente con los eventos etiquetados que van llegando
+    ONLINE_EVALUATOR.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ONLINE_EVALUATOR.stop()
+    training_service.shutdown()
+
+
+def _csv_has_rows(path):
+    """True si el CSV tiene al menos una fila además de la cabecera."""
+    try:
+        with open(path) as f:
+            return sum(1 for _ in zip(range(2), f)) > 1
+    except OSError:
+        return False
 
     
 @app.get("/")
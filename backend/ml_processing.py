@@ -19,11 +19,14 @@ de tráfico normal y detectar anomalías de manera efectiva.
 """
 import pandas as pd
 import numpy as np
-import ipaddress  # Asegúrate de importar este módulo al inicio del archivo
 import asyncio
+import json
+import time
 from db_connection import db  # Importar la conexión a MongoDB
 import hashlib
 from sklearn.preprocessing import RobustScaler
+from ip_codec import expand_ip_columns, derived_ip_columns
+from constants import PREPROCESSED_META_JSON
 COLLECTION_NAME = "events"
 
 
@@ -56,21 +59,22 @@ async def fetch_suricata_data(train_only=False):
     print(f"[ML] Se encontraron {len(events)} eventos en MongoDB.")
     return events
 
-def ip_to_int(ip):
-    """Convierte una dirección IP (IPv4 o IPv6) a un número entero único."""
-    try:
-        return int(ipaddress.ip_address(ip))
-    except ValueError:
-        print(f"[ML] ⚠ Advertencia: IP inválida detectada -> {ip}")
-        return 0
+def ensure_column(df, col, default=0):
+    if col not in df.columns:
+        df[col] = default
+    return df
+
 
 def preprocess_data(events):
-    df = pd.DataFrame(events)
+    df = build_features(events)
+    if df is None:
+        return None
+    return select_and_normalize(df)
 
-    def ensure_column(df, col, default=0):
-        if col not in df.columns:
-            df[col] = default
-        return df
+
+def build_features(events):
+    """Features por evento (sin etiquetar, seleccionar ni normalizar); None si no hay eventos."""
+    df = pd.DataFrame(events)
 
     if df.empty:
         print("[ML] ⚠ No se encontraron datos en la base de datos. No se generará suricata_preprocessed.csv.")
@@ -224,6 +228,35 @@ def preprocess_data(events):
     df = add_port_ip_rarity_feature(df)
     df = add_conn_5m_feature(df)
 
+    return df
+
+
+# Features con codificación estable entre lotes (sin escalado ni cat.codes dependientes del lote):
+# las usan los modelos entrenados por bloques o sobre varias sesiones (oneclass_trainer, supervised_model)
+STABLE_FEATURES = [
+    "src_port", "dest_port", "alert_severity", "packet_length", "hour", "is_night",
+    "ports_used", "conn_per_ip", "port_rarity", "ip_rarity", "conn_5m", "port_entropy",
+    "failed_ratio", "hour_anomaly", "conn_velocity", "proto_pkt_mean", "proto_pkt_std",
+    "proto_ports", "pkt_anomaly", "proto",
+]
+PROTO_CODES = {"TCP": 1, "UDP": 2, "ICMP": 3, "IPV6-ICMP": 4}
+
+
+def stable_feature_matrix(df):
+    """Matriz float64 (filas × STABLE_FEATURES) a partir de la salida de build_features."""
+    cols = []
+    for col in STABLE_FEATURES:
+        if col not in df.columns:
+            cols.append(np.zeros(len(df)))
+        elif col == "proto":
+            cols.append(df[col].map(lambda p: PROTO_CODES.get(str(p).upper(), 0)).to_numpy(dtype=float))
+        else:
+            cols.append(pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy(dtype=float))
+    return np.column_stack(cols) if cols else np.empty((len(df), 0))
+
+
+def select_and_normalize(df):
+    """Etiqueta, selección de columnas, columnas IP numéricas y normalización (común a todas las rutas)."""
     # Añadir columna 'anomaly' basado en training_mode y training_label
     def label_anomaly(row):
         if row.get("training_mode") == True:
@@ -266,9 +299,9 @@ def preprocess_data(events):
 
     df = df[[c for c in selected_columns if c in df.columns]].copy()
 
-    # Convertir direcciones IP a valores numéricos usando ip_to_int()
-    df["src_ip"] = df["src_ip"].apply(ip_to_int)
-    df["dest_ip"] = df["dest_ip"].apply(ip_to_int)
+    # Convertir direcciones IP a columnas numéricas de ancho fijo (IPv4 uint32, IPv6 hi/lo uint64)
+    ip_cols = ["src_ip", "dest_ip"]
+    df = expand_ip_columns(df, ip_cols)
 
     # Reemplazar valores categóricos del protocolo
     try:
@@ -280,7 +313,8 @@ def preprocess_data(events):
     # Normalizar solo las columnas numéricas
     df = df.drop(columns=["timestamp"], errors="ignore")
     # Seleccionar columnas numéricas para normalizar
-    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    # (las columnas IP derivadas se conservan sin escalar: son identificadores/prefijos, no magnitudes)
+    numeric_cols = df.select_dtypes(include=[np.number]).columns.difference(derived_ip_columns(ip_cols), sort=False)
     df_numeric = df[numeric_cols]
     scaler = RobustScaler()
     df_normalized = pd.DataFrame(scaler.fit_transform(df_numeric), columns=df_numeric.columns)
@@ -290,17 +324,28 @@ def preprocess_data(events):
 
     return df
 
-async def main(train_only=False):
+async def main(train_only=False, sample_size=None):
+    if sample_size:
+        # Muestra estratificada en memoria acotada directamente desde MongoDB (ver training_sampler.py)
+        from training_sampler import main as sample_main
+        await sample_main(size=sample_size)
+        return
     events = await fetch_suricata_data(train_only)
     df = preprocess_data(events)
 
     if df is not None:
         df.to_csv("/app/models/suricata_preprocessed.csv", index=False)  # Guardar datos procesados
         print("[ML] ✅ Datos preprocesados guardados en suricata_preprocessed.csv")
+        # Sesión de origen para el manifest del registro de modelos
+        sessions = sorted({str(e["training_session"]) for e in events if e.get("training_session")})
+        with open(PREPROCESSED_META_JSON, "w") as f:
+            json.dump({"training_session": sessions[-1] if len(sessions) == 1 else sessions or None,
+                       "rows": int(len(df)), "created_at": time.time()}, f)
     else:
         print("[ML] ⚠ No se generó ningún archivo CSV.")
 
 if __name__ == "__main__":
     import sys
     train_only = "--train_only" in sys.argv
-    asyncio.run(main(train_only=train_only))
+    sample_size = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--sample=")), None)
+    asyncio.run(main(train_only=train_only, sample_size=sample_size))
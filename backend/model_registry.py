@@ -0,0 +1,301 @@
+"""
+model_registry.py
+
+📌 Función principal:
+    Registro versionado de artefactos del modelo con promoción atómica y recarga en caliente.
+
+📁 Estructura (`/app/models/registry/`):
+    registry/
+        v0001/
+            isolation_forest_model.pkl
+            iforest_compiled/          (si existe)
+            feature_cols.json
+            thresholds.json
+            manifest.json              → columnas, umbral, sesión, métricas, hash de contenido
+        v0002/ ...
+        CURRENT                        → {"version": "v0002"} (se reescribe con tmp + os.replace)
+
+🔒 Garantías:
+    - Una versión se construye completa en un directorio temporal y se renombra a vNNNN al terminar:
+      un lector nunca ve una versión a medias.
+    - La promoción es el reemplazo atómico de CURRENT.
+    - El número de versión se asigna bajo flock (`registry/.lock`) junto con el renombrado y la promoción;
+      set_threshold() toma el mismo bloqueo para su par thresholds.json + manifest.
+    - ModelHandle recarga sólo cuando cambia la versión o su manifest (un os.stat por consulta,
+      con intervalo mínimo), sin releer artefactos en cada llamada.
+
+🔗 Usado por:
+    - train_model.py  → publish_version() tras entrenar
+    - evaluate.py     → set_threshold() con el umbral calibrado
+    - generate_rules.py / routes.py → ModelHandle
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, NamedTuple, Optional
+
+from constants import (
+    REGISTRY_DIR,
+    IFOREST_MODEL,
+    COMPILED_FOREST_DIR,
+    THRESHOLDS_JSON,
+    SELECTED_THRESHOLD_FILE,
+    ANOMALY_THRESHOLD,
+)
+
+CURRENT_FILE = "CURRENT"
+MANIFEST = "manifest.json"
+MODEL_FILE = "isolation_forest_model.pkl"
+COMPILED_SUBDIR = "iforest_compiled"
+KEEP_VERSIONS = 10
+
+
+def _atomic_json(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _content_hash(root):
+    """SHA-256 de todos los archivos de la versión (excepto el manifest), en orden estable."""
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name == MANIFEST and dirpath == root:
+                continue
+            path = os.path.join(dirpath, name)
+            h.update(os.path.relpath(path, root).encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(d for d in os.listdir(registry_dir)
+                  if d.startswith("v") and d[1:].isdigit() and os.path.isdir(os.path.join(registry_dir, d)))
+
+
+def current_version(registry_dir=REGISTRY_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return json.load(f).get("version")
+    except (OSError, ValueError):
+        return None
+
+
+def version_dir(version, registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir, version)
+
+
+def current_model_path(registry_dir=REGISTRY_DIR, fallback=IFOREST_MODEL) -> str:
+    """.pkl de la versión vigente; sin registro (instalaciones antiguas), el modelo suelto."""
+    version = current_version(registry_dir)
+    if version is None:
+        return fallback
+    return os.path.join(version_dir(version, registry_dir), MODEL_FILE)
+
+
+def load_manifest(version, registry_dir=REGISTRY_DIR) -> dict:
+    with open(os.path.join(version_dir(version, registry_dir), MANIFEST)) as f:
+        return json.load(f)
+
+
+def promote(version, registry_dir=REGISTRY_DIR):
+    """Apunta CURRENT a `version` (reemplazo atómico)."""
+    if not os.path.exists(os.path.join(version_dir(version, registry_dir), MANIFEST)):
+        raise FileNotFoundError(f"La versión {version} no existe o está incompleta")
+    _atomic_json(os.path.join(registry_dir, CURRENT_FILE), {"version": version, "promoted_at": time.time()})
+    print(f"[REG] ✅ Versión {version} promovida a CURRENT")
+
+
+@contextmanager
+def _registry_lock(registry_dir):
+    """flock sobre `registry/.lock`: serializa publicaciones, promociones y cambios de umbral."""
+    os.makedirs(registry_dir, exist_ok=True)
+    with open(os.path.join(registry_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _prune(registry_dir, keep):
+    current = current_version(registry_dir)
+    for old in list_versions(registry_dir)[:-keep]:
+        if old != current:
+            shutil.rmtree(version_dir(old, registry_dir), ignore_errors=True)
+
+
+def publish_version(feature_cols, threshold=None, training_session=None, metrics=None,
+                    model_path=IFOREST_MODEL, compiled_dir=COMPILED_FOREST_DIR,
+                    registry_dir=REGISTRY_DIR, promote_now=True, keep=KEEP_VERSIONS) -> str:
+    """Copia los artefactos a una versión nueva, escribe su manifest y (por defecto) la promueve."""
+    os.makedirs(registry_dir, exist_ok=True)
+    staging = os.path.join(registry_dir, f".staging-{os.getpid()}-{time.time_ns()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    shutil.copy2(model_path, os.path.join(staging, MODEL_FILE))
+    if compiled_dir and os.path.isdir(compiled_dir):
+        shutil.copytree(compiled_dir, os.path.join(staging, COMPILED_SUBDIR))
+        # El stamp del compilado debe referirse a la copia dentro de la versión
+        meta_path = os.path.join(staging, COMPILED_SUBDIR, "meta.json")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        st = os.stat(os.path.join(staging, MODEL_FILE))
+        meta["source"] = {"path": MODEL_FILE, "size": st.st_size, "mtime": st.st_mtime}
+        _atomic_json(meta_path, meta)
+    with open(os.path.join(staging, "feature_cols.json"), "w") as f:
+        json.dump(list(feature_cols), f)
+    with open(os.path.join(staging, "thresholds.json"), "w") as f:
+        json.dump({"thr_if": threshold}, f)
+
+    content_hash = _content_hash(staging)
+
+    # Número de versión y renombrado bajo flock: dos publicadores concurrentes no reclaman el mismo vNNNN
+    with _registry_lock(registry_dir):
+        existing = list_versions(registry_dir)
+        version = f"v{(int(existing[-1][1:]) + 1) if existing else 1:04d}"
+        manifest = {
+            "version": version,
+            "created_at": time.time(),
+            "feature_cols": list(feature_cols),
+            "threshold": threshold,
+            "training_session": training_session,
+            "metrics": metrics or {},
+            "content_hash": content_hash,
+        }
+        _atomic_json(os.path.join(staging, MANIFEST), manifest)
+        os.rename(staging, version_dir(version, registry_dir))
+        print(f"[REG] 📦 Versión {version} publicada (hash {content_hash[:12]})")
+
+        if promote_now:
+            promote(version, registry_dir)
+        _prune(registry_dir, keep)
+    return version
+
+
+def set_threshold(threshold, extra=None, version=None, registry_dir=REGISTRY_DIR):
+    """Actualiza el umbral calibrado de una versión (por defecto la vigente).
+
+    thresholds.json y el manifest se reescriben bajo el flock del registro: otra calibración o una
+    publicación concurrente no intercalan su lectura-modificación-escritura. El manifest va último, así
+    que ModelHandle (que recarga al cambiar el manifest) nunca ve el umbral nuevo antes que el archivo."""
+    if not os.path.isdir(registry_dir):
+        return None
+    with _registry_lock(registry_dir):
+        version = version or current_version(registry_dir)
+        if not version:
+            return None
+        vdir = version_dir(version, registry_dir)
+        thresholds = {"thr_if": float(threshold), **(extra or {})}
+        _atomic_json(os.path.join(vdir, "thresholds.json"), thresholds)
+        manifest = load_manifest(version, registry_dir)
+        manifest["threshold"] = float(threshold)
+        manifest["threshold_updated_at"] = time.time()
+        manifest["content_hash"] = _content_hash(vdir)  # thresholds.json forma parte del hash
+        _atomic_json(os.path.join(vdir, MANIFEST), manifest)
+    print(f"[REG] 🎯 Umbral {threshold:.6f} registrado en {version}")
+    return version
+
+
+def _legacy_threshold():
+    """Umbral desde los archivos sueltos (thresholds.json > selected_threshold.txt)."""
+    try:
+        if os.path.exists(THRESHOLDS_JSON):
+            with open(THRESHOLDS_JSON) as f:
+                return float(json.load(f).get("thr_if"))
+        if os.path.exists(SELECTED_THRESHOLD_FILE):
+            with open(SELECTED_THRESHOLD_FILE) as f:
+                return float(f.read().strip())
+    except Exception as e:
+        print(f"[REG] No se pudo leer thresholds: {e}")
+    return None
+
+
+class ModelSnapshot(NamedTuple):
+    """Modelo, umbral y versión de una misma carga: nunca se mezclan un modelo nuevo y un umbral viejo."""
+    scorer: Any
+    threshold: float
+    version: Optional[str]
+
+
+class ModelHandle:
+    """Modelo + umbral vigentes con recarga en caliente al cambiar la versión.
+
+    Sin registro (instalaciones antiguas) usa los archivos sueltos de /app/models. get() es seguro entre
+    hilos (la API puntúa desde asyncio.to_thread mientras el bucle genera reglas): la recarga va bajo un
+    lock y el estado se publica como una sola tupla inmutable.
+    """
+
+    def __init__(self, registry_dir=REGISTRY_DIR, check_interval=5.0):
+        self.registry_dir = registry_dir
+        self.check_interval = check_interval
+        self._key = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ModelSnapshot] = None
+        self.manifest = {}
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot else None
+
+    @property
+    def scorer(self):
+        return self._snapshot.scorer if self._snapshot else None
+
+    def _current_key(self):
+        version = current_version(self.registry_dir)
+        if version is None:
+            try:
+                st = os.stat(IFOREST_MODEL)
+                return ("legacy", st.st_mtime_ns, st.st_size)
+            except OSError:
+                return None
+        try:
+            st = os.stat(os.path.join(version_dir(version, self.registry_dir), MANIFEST))
+        except OSError:
+            return None
+        return (version, st.st_mtime_ns)
+
+    def _load(self, key):
+        from forest_compiler import load_scorer
+        if key[0] == "legacy":
+            scorer = load_scorer()
+            threshold = _legacy_threshold()
+            manifest = {}
+        else:
+            vdir = version_dir(key[0], self.registry_dir)
+            scorer = load_scorer(os.path.join(vdir, MODEL_FILE), os.path.join(vdir, COMPILED_SUBDIR))
+            manifest = load_manifest(key[0], self.registry_dir)
+            threshold = manifest.get("threshold")
+        threshold = float(threshold) if threshold is not None else ANOMALY_THRESHOLD
+        self.manifest = manifest
+        self._snapshot = ModelSnapshot(scorer, threshold, key[0])
+        self._key = key
+        print(f"[REG] 🔄 Modelo cargado: versión {key[0]} (umbral={threshold})")
+
+    def get(self, force=False) -> ModelSnapshot:
+        """Devuelve (scorer, threshold, version) de una misma carga; recarga sólo si cambió la versión vigente."""
+        with self._lock:
+            now = time.monotonic()
+            if force or self._snapshot is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                key = self._current_key()
+                if key is None:
+                    if self._snapshot is None:
+                        raise FileNotFoundError("No hay modelo publicado ni modelo suelto en /app/models")
+                elif key != self._key:
+                    self._load(key)
+            return self._snapshot
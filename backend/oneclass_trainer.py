@@ -0,0 +1,153 @@
+"""
+oneclass_trainer.py
+
+📌 Función principal:
+    Entrenamiento "out-of-core" de un modelo one-class lineal sobre TODO el histórico de tráfico normal,
+    leyendo MongoDB por bloques: la memoria depende del tamaño del bloque, no de la cantidad de meses.
+
+⚙️ Cómo funciona:
+    1. Recorre los eventos con training_mode=True y training_label="normal" (todas las sesiones) ordenados
+       por _id, en bloques de `chunk_size` (consulta `_id > último`, sin cursores largos ni skip).
+    2. Cada bloque pasa por ml_processing.build_features (los agregados por IP/proto se calculan dentro
+       del bloque, como una ventana) y por una transformación sin estado: log1p con signo sobre
+       ml_processing.stable_feature_matrix (proto con código fijo). Así todos los bloques comparten
+       escala sin una segunda pasada.
+    3. RBFSampler (aproximación de kernel RBF, pesos aleatorios fijos) + SGDOneClassSVM.partial_fit.
+    4. Tras cada bloque se guarda un checkpoint (modelo + último _id + contadores) con archivo temporal
+       + os.replace: si el proceso se interrumpe, la siguiente ejecución continúa desde ahí.
+
+📤 Salida:
+    - /app/models/oneclass_sgd.pkl          → modelo final (score(X) → decision, etiqueta -1/1)
+    - /app/models/oneclass_checkpoint.pkl   → estado de reanudación
+
+🧪 Uso:
+    python oneclass_trainer.py [--chunk 20000] [--restart]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import joblib
+import numpy as np
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDOneClassSVM
+
+from constants import ONECLASS_MODEL, ONECLASS_CHECKPOINT, ANOMALY_PREDICTION, LABEL_NORMAL
+from ml_processing import build_features, stable_feature_matrix, STABLE_FEATURES
+
+COLLECTION_NAME = "events"
+PROJECTION = {
+    "_id": 1, "src_ip": 1, "dest_ip": 1, "proto": 1, "src_port": 1, "dest_port": 1,
+    "alert_severity": 1, "packet_length": 1, "timestamp": 1, "tcp_flags": 1, "tcp_flags_tc": 1,
+}
+
+
+class OneClassBaseline:
+    """Transformación fija + RBFSampler + SGDOneClassSVM entrenable por bloques."""
+
+    def __init__(self, n_components=256, gamma=0.1, nu=0.05, seed=42):
+        self.feature_names_in_ = np.array(STABLE_FEATURES, dtype=object)
+        self.n_features_in_ = len(STABLE_FEATURES)
+        self.kernel = RBFSampler(gamma=gamma, n_components=n_components, random_state=seed)
+        self.kernel.fit(np.zeros((1, len(STABLE_FEATURES))))  # sólo fija los pesos aleatorios
+        self.model = SGDOneClassSVM(nu=nu, random_state=seed)
+        self.rows_seen = 0
+
+    @staticmethod
+    def to_matrix(df):
+        X = stable_feature_matrix(df)
+        return np.sign(X) * np.log1p(np.abs(X))
+
+    def partial_fit(self, df):
+        self.model.partial_fit(self.kernel.transform(self.to_matrix(df)))
+        self.rows_seen += len(df)
+        return self
+
+    def decision_function(self, df):
+        return self.model.decision_function(self.kernel.transform(self.to_matrix(df)))
+
+    def score(self, df):
+        """(decision_function, etiqueta) con la misma convención que los demás scorers."""
+        decision = self.decision_function(df)
+        return decision, np.where(decision < 0, ANOMALY_PREDICTION, 1)
+
+
+def _atomic_dump(obj, path):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path=ONECLASS_CHECKPOINT):
+    if not os.path.exists(path):
+        return None
+    try:
+        state = joblib.load(path)
+    except Exception as e:
+        print(f"[OC] ⚠ Checkpoint ilegible ({e}); se empieza de cero.")
+        return None
+    return None if state.get("done") else state
+
+
+async def train_out_of_core(chunk_size=20000, restart=False, model_path=ONECLASS_MODEL,
+                            checkpoint_path=ONECLASS_CHECKPOINT, max_chunks=None):
+    """Entrena por bloques desde MongoDB con checkpoints reanudables. Devuelve un resumen."""
+    from bson import ObjectId
+    from db_connection import db
+
+    state = None if restart else load_checkpoint(checkpoint_path)
+    if state:
+        print(f"[OC] ♻️ Reanudando: {state['chunks']} bloques, {state['model'].rows_seen} filas, último _id {state['last_id']}")
+    else:
+        state = {"model": OneClassBaseline(), "last_id": None, "chunks": 0, "seconds": 0.0, "done": False}
+
+    collection = db[COLLECTION_NAME]
+    base_query = {"training_mode": True, "training_label": LABEL_NORMAL}
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    done_now = 0
+    while max_chunks is None or done_now < max_chunks:
+        query = dict(base_query)
+        if state["last_id"] is not None:
+            query["_id"] = {"$gt": ObjectId(state["last_id"])}
+        t0 = time.perf_counter()
+        events = await collection.find(query, PROJECTION).sort("_id", 1).limit(chunk_size).to_list(length=chunk_size)
+        if not events:
+            break
+        last_id = events[-1]["_id"]
+        df = build_features(events)
+        del events
+        if df is not None and not df.empty:
+            state["model"].partial_fit(df)
+        state["last_id"] = str(last_id)
+        state["chunks"] += 1
+        state["seconds"] += time.perf_counter() - t0
+        _atomic_dump(state, checkpoint_path)
+        done_now += 1
+        print(f"[OC] 📦 Bloque {state['chunks']}: {state['model'].rows_seen} filas acumuladas "
+              f"({time.perf_counter() - t0:.2f}s)")
+
+    summary = {"chunks": state["chunks"], "rows": state["model"].rows_seen,
+               "seconds": round(state["seconds"], 3), "complete": False}
+    if state["model"].rows_seen == 0:
+        print("[OC] ⚠ No hay eventos normales etiquetados para entrenar.")
+        return summary
+    if max_chunks is not None and done_now >= max_chunks:
+        print("[OC] ⏸ Límite de bloques alcanzado; se reanudará desde el checkpoint.")
+        return summary
+
+    _atomic_dump(state["model"], model_path)
+    state["done"] = True
+    _atomic_dump(state, checkpoint_path)
+    summary["complete"] = True
+    print(f"[OC] ✅ Modelo one-class guardado en {model_path} ({summary['rows']} filas, {summary['seconds']}s)")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrenamiento one-class por bloques desde MongoDB")
+    parser.add_argument("--chunk", type=int, default=20000)
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint y empezar de cero")
+    parser.add_argument("--max-chunks", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(train_out_of_core(args.chunk, args.restart, max_chunks=args.max_chunks))
@@ -0,0 +1,297 @@
+"""
+online_evaluator.py
+
+📌 Función principal:
+    Evaluación continua del modelo vigente con los eventos etiquetados (modo entrenamiento normal/anomaly)
+    a medida que llegan a MongoDB, sin releer CSVs ni ejecutar evaluate.py a mano.
+
+⚙️ Cómo funciona:
+    - Tarea en segundo plano del proceso de FastAPI (main.py). Lee por lotes los eventos etiquetados con
+      `_id > marca de agua` (la marca se guarda en db.config {_id: "online_eval"}), los puntúa con
+      MODEL_HANDLE (misma versión, umbral y predicado que generate_rules.py) y actualiza contadores por ventana.
+    - Ventanas de ONLINE_EVAL_WINDOW_S segundos según la hora de inserción del evento (ObjectId), por
+      versión del modelo. Cada ventana guarda TP/FP/FN/TN en el umbral activo y dos histogramas de score
+      (anomalías / normales) de ONLINE_EVAL_BINS cubetas fijas: memoria acotada y sumables entre ventanas.
+    - AP se calcula sobre los histogramas (cada cubeta es un umbral candidato; aproximación por cubetas).
+    - Las ventanas cerradas se insertan en la colección time series ONLINE_EVAL_COLLECTION y se conservan
+      las últimas ONLINE_EVAL_KEEP_WINDOWS en memoria para las métricas móviles.
+
+🔗 Usado por:
+    - main.py   → start() al arrancar, stop() al cerrar
+    - routes.py → GET /metrics/online (ventana móvil) y GET /metrics/online/history (serie temporal)
+"""
+import asyncio
+import datetime as dt
+from collections import deque
+
+import numpy as np
+
+from constants import (
+    LABEL_NORMAL,
+    LABEL_ANOMALY,
+    ONLINE_EVAL_WINDOW_S,
+    ONLINE_EVAL_KEEP_WINDOWS,
+    ONLINE_EVAL_BINS,
+    ONLINE_EVAL_SCORE_RANGE,
+    ONLINE_EVAL_COLLECTION,
+    ONLINE_EVAL_RETENTION_DAYS,
+)
+
+PROJECTION = {
+    "_id": 1, "src_ip": 1, "dest_ip": 1, "proto": 1, "src_port": 1, "dest_port": 1,
+    "alert_severity": 1, "packet_length": 1, "timestamp": 1, "training_label": 1,
+}
+COUNTS = ("tp", "fp", "fn", "tn")
+
+
+def average_precision_from_hist(pos_hist, neg_hist) -> float:
+    """AP con los histogramas de score (menor score = más anómalo): una cubeta por umbral."""
+    positives = pos_hist.sum()
+    if positives == 0:
+        return 0.0
+    tp = np.cumsum(pos_hist)
+    fp = np.cumsum(neg_hist)
+    predicted = tp + fp
+    precision = np.divide(tp, predicted, out=np.zeros(len(tp)), where=predicted > 0)
+    recall_step = pos_hist / positives
+    return float((recall_step * precision).sum())
+
+
+def summarize(counts, pos_hist, neg_hist) -> dict:
+    """Precision/recall/F1 en el umbral activo + AP, a partir de contadores sumados."""
+    tp, fp, fn = counts["tp"], counts["fp"], counts["fn"]
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0
+    return {**{k: int(v) for k, v in counts.items()}, "n": int(sum(counts.values())),
+            "precision": precision, "recall": recall, "f1": f1,
+            "ap": average_precision_from_hist(pos_hist, neg_hist)}
+
+
+class WindowCounters:
+    """Contadores de una ventana (inicio, versión del modelo): tamaño fijo."""
+
+    def __init__(self, start, model_version, threshold, bins=ONLINE_EVAL_BINS):
+        self.start = start
+        self.model_version = model_version
+        self.threshold = threshold
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.pos_hist = np.zeros(bins, dtype=np.int64)
+        self.neg_hist = np.zeros(bins, dtype=np.int64)
+
+    def update(self, scores, y_true, predicted):
+        """y_true / predicted: 1 = anomalía."""
+        self.counts["tp"] += int((predicted & y_true).sum())
+        self.counts["fp"] += int((predicted & ~y_true).sum())
+        self.counts["fn"] += int((~predicted & y_true).sum())
+        self.counts["tn"] += int((~predicted & ~y_true).sum())
+        bins = score_bins(scores, len(self.pos_hist))
+        self.pos_hist += np.bincount(bins[y_true], minlength=len(self.pos_hist))
+        self.neg_hist += np.bincount(bins[~y_true], minlength=len(self.neg_hist))
+
+    def to_doc(self, window_s=ONLINE_EVAL_WINDOW_S) -> dict:
+        return {
+            "ts": dt.datetime.fromtimestamp(self.start, dt.timezone.utc),
+            "meta": {"model_version": self.model_version, "threshold": self.threshold},
+            "window_s": window_s,
+            **summarize(self.counts, self.pos_hist, self.neg_hist),
+            "pos_hist": self.pos_hist.tolist(),
+            "neg_hist": self.neg_hist.tolist(),
+        }
+
+
+def score_bins(scores, bins=ONLINE_EVAL_BINS, score_range=ONLINE_EVAL_SCORE_RANGE):
+    lo, hi = score_range
+    idx = np.floor((np.asarray(scores, dtype=np.float64) - lo) / (hi - lo) * bins)
+    return np.clip(np.nan_to_num(idx, nan=bins - 1), 0, bins - 1).astype(np.int64)
+
+
+class OnlineEvaluator:
+    """Bucle de evaluación incremental; el estado en memoria está acotado por ventana."""
+
+    def __init__(self, window_s=ONLINE_EVAL_WINDOW_S, keep=ONLINE_EVAL_KEEP_WINDOWS,
+                 batch_size=2000, interval=10.0):
+        self.window_s = window_s
+        self.batch_size = batch_size
+        self.interval = interval
+        self.open = {}                   # (inicio, versión) → WindowCounters
+        self.closed = deque(maxlen=keep)
+        self.watermark = None
+        self.last_run = None
+        self.last_error = None
+        self._task = None
+
+    # ── MongoDB ──────────────────────────────────────────────────────────
+    async def _ensure_collection(self):
+        from db_connection import db
+
+        if ONLINE_EVAL_COLLECTION not in await db.list_collection_names():
+            await db.create_collection(
+                ONLINE_EVAL_COLLECTION,
+                timeseries={"timeField": "ts", "metaField": "meta", "granularity": "minutes"},
+                expireAfterSeconds=ONLINE_EVAL_RETENTION_DAYS * 86400,
+            )
+            print(f"[OE] ✅ Colección time series '{ONLINE_EVAL_COLLECTION}' creada.")
+
+    async def _load_watermark(self):
+        from bson import ObjectId
+        from db_connection import db
+
+        doc = await db["config"].find_one({"_id": "online_eval"})
+        if doc and doc.get("last_id"):
+            return ObjectId(doc["last_id"])
+        # Primer arranque: calentar con las ventanas que caben en memoria, no con todo el histórico
+        since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=self.window_s * self.closed.maxlen)
+        return ObjectId.from_datetime(since)
+
+    async def _save_watermark(self):
+        from db_connection import db
+
+        await db["config"].update_one({"_id": "online_eval"}, {"$set": {"last_id": str(self.watermark)}}, upsert=True)
+
+    # ── Evaluación ───────────────────────────────────────────────────────
+    def _score(self, events):
+        """(scores, predicción en vivo, versión, umbral) para un lote de eventos crudos.
+
+        Modelo, umbral y versión salen de una misma instantánea de MODEL_HANDLE, y la predicción es la de
+        generate_rules.live_anomalies (etiqueta -1 y score < umbral)."""
+        import pandas as pd
+        from generate_rules import MODEL_HANDLE, live_anomalies, preprocess_data
+
+        model, thr, version = MODEL_HANDLE.get()
+        X = preprocess_data(pd.DataFrame(events), list(model.feature_names_in_))
+        scores, labels = model.score(X)
+        return scores, live_anomalies(scores, labels, thr), version, float(thr)
+
+    def _update(self, events, scores, predicted, version, thr):
+        y_true = np.array([e.get("training_label") == LABEL_ANOMALY for e in events])
+        starts = np.array([int(e["_id"].generation_time.timestamp()) // self.window_s * self.window_s
+                           for e in events])
+        for start in np.unique(starts):
+            key = (int(start), version)
+            window = self.open.get(key)
+            if window is None:
+                window = self.open[key] = WindowCounters(int(start), version, thr)
+            mask = starts == start
+            window.update(scores[mask], y_true[mask], predicted[mask])
+
+    async def _close_windows(self, force=False):
+        """Persiste las ventanas que ya no recibirán eventos (todas con force=True)."""
+        from db_connection import db
+
+        horizon = dt.datetime.now(dt.timezone.utc).timestamp() - 2 * self.interval
+        done = [k for k, w in self.open.items() if force or w.start + self.window_s <= horizon]
+        if not done:
+            return
+        windows = [self.open.pop(k) for k in sorted(done)]
+        await db[ONLINE_EVAL_COLLECTION].insert_many([w.to_doc(self.window_s) for w in windows])
+        self.closed.extend(windows)
+
+    async def step(self) -> int:
+        """Procesa un lote de eventos etiquetados nuevos. Devuelve cuántos se evaluaron."""
+        from db_connection import db
+
+        if self.watermark is None:
+            await self._ensure_collection()
+            self.watermark = await self._load_watermark()
+        query = {"training_mode": True, "training_label": {"$in": [LABEL_NORMAL, LABEL_ANOMALY]},
+                 "_id": {"$gt": self.watermark}}
+        events = await db["events"].find(query, PROJECTION).sort("_id", 1).limit(self.batch_size) \
+            .to_list(length=self.batch_size)
+        if events:
+            scores, predicted, version, thr = await asyncio.to_thread(self._score, events)
+            self._update(events, np.asarray(scores), np.asarray(predicted, dtype=bool), version, thr)
+            self.watermark = events[-1]["_id"]
+            await self._save_watermark()
+        await self._close_windows()
+        self.last_run = dt.datetime.now(dt.timezone.utc).isoformat()
+        return len(events)
+
+    async def run(self):
+        print(f"[OE] 🚀 Evaluación en línea cada {self.interval:.0f}s (ventanas de {self.window_s}s)")
+        try:
+            while True:
+                try:
+                    n = await self.step()
+                    self.last_error = None
+                except FileNotFoundError:
+                    n = 0  # todavía no hay modelo publicado
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"[OE] ⚠ Error en la evaluación en línea: {e}")
+                    n = 0
+                if n < self.batch_size:
+                    await asyncio.sleep(self.interval)
+        finally:
+            if self.open:
+                try:
+                    await self._close_windows(force=True)
+                except Exception as e:
+                    print(f"[OE] ⚠ No se pudieron guardar las ventanas abiertas: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        """Métricas móviles de la versión vigente (ventanas en memoria, cerradas y abiertas)."""
+        windows = list(self.closed) + [self.open[k] for k in sorted(self.open)]
+        version = windows[-1].model_version if windows else None
+        current = [w for w in windows if w.model_version == version]
+        counts = dict.fromkeys(COUNTS, 0)
+        pos = np.zeros(ONLINE_EVAL_BINS, dtype=np.int64)
+        neg = np.zeros(ONLINE_EVAL_BINS, dtype=np.int64)
+        for w in current:
+            for k in COUNTS:
+                counts[k] += w.counts[k]
+            pos += w.pos_hist
+            neg += w.neg_hist
+        return {
+            "model_version": version,
+            "threshold": current[-1].threshold if current else None,
+            "windows": len(current),
+            "window_s": self.window_s,
+            "since": dt.datetime.fromtimestamp(current[0].start, dt.timezone.utc).isoformat() if current else None,
+            "rolling": summarize(counts, pos, neg),
+            "watermark": None if self.watermark is None else str(self.watermark),
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+async def history(hours=24, model_version=None):
+    """Serie temporal de ONLINE_EVAL_COLLECTION: una fila por ventana y versión (documentos sumados)."""
+    from db_connection import db
+
+    since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(hours=hours)
+    query = {"ts": {"$gte": since}}
+    if model_version:
+        query["meta.model_version"] = model_version
+    docs = await db[ONLINE_EVAL_COLLECTION].find(query, {"_id": 0}).sort("ts", 1).to_list(length=None)
+
+    # Una ventana puede tener varios documentos (eventos tardíos o cierre al apagar): sumar contadores
+    merged = {}
+    for d in docs:
+        key = (d["ts"], d["meta"].get("model_version"))
+        m = merged.setdefault(key, {"meta": d["meta"], "counts": dict.fromkeys(COUNTS, 0),
+                                    "pos": np.zeros(ONLINE_EVAL_BINS, dtype=np.int64),
+                                    "neg": np.zeros(ONLINE_EVAL_BINS, dtype=np.int64)})
+        for k in COUNTS:
+            m["counts"][k] += d.get(k, 0)
+        m["pos"] += np.asarray(d.get("pos_hist", m["pos"] * 0), dtype=np.int64)
+        m["neg"] += np.asarray(d.get("neg_hist", m["neg"] * 0), dtype=np.int64)
+    return [{"ts": ts.isoformat(), **m["meta"], **summarize(m["counts"], m["pos"], m["neg"])}
+            for (ts, _), m in merged.items()]
+
+
+ONLINE_EVALUATOR = OnlineEvaluator()
@@ -0,0 +1,290 @@
+"""
+pipeline_runner.py
+
+📌 Función principal:
+    Ejecutar la cadena preprocess → train → ground_truth → evaluate saltando las etapas cuyas entradas
+    no han cambiado desde la última ejecución y cuyas salidas siguen en disco tal como quedaron.
+
+⚙️ Cómo funciona:
+    - Cada etapa tiene una huella (SHA-256) de sus entradas:
+        · código: contenido de los módulos de la etapa + constants.py
+        · parámetros: train_only / incremental / sesión / versión vigente del registro
+        · datos de MongoDB: huella de la consulta que lee la etapa (los _id que devolvería)
+        · artefactos de etapas anteriores: hash de contenido de los archivos
+    - STAGE_CACHE_JSON guarda, por etapa y huella, el hash de cada salida y la duración de la ejecución.
+      Si la huella ya está registrada y las salidas en disco tienen exactamente esos hashes → acierto:
+      la etapa no se ejecuta y su duración registrada cuenta como tiempo ahorrado.
+    - Los hashes de archivos se reutilizan mientras no cambien (mtime, tamaño): un acierto no relee el CSV.
+    - Si una etapa falla o no produce sus salidas, la cadena se detiene (las siguientes dependen de ella).
+
+📤 Salida:
+    Resumen por etapa (acierto/fallo de caché, segundos, segundos ahorrados), impreso y guardado en
+    STAGE_CACHE_JSON["last_run"].
+
+🧪 Uso:
+    python pipeline_runner.py [--stages preprocess,train,ground_truth,evaluate] [--train-only]
+                              [--session SESION] [--incremental] [--force train,evaluate]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+from constants import (
+    PREPROCESSED_CSV,
+    SURICATA_ANALYSIS_CSV,
+    GROUND_TRUTH_CSV,
+    IFOREST_MODEL,
+    THRESHOLDS_JSON,
+    SELECTED_THRESHOLD_FILE,
+    THRESHOLD_REPORT_CSV,
+    STAGE_CACHE_JSON,
+    LABELED_SCORES_NPZ,
+)
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = ["preprocess", "train", "ground_truth", "evaluate"]
+KEEP_KEYS = 10  # huellas recordadas por etapa
+
+STAGE_SPECS = {
+    "preprocess": {
+        "code": ["ml_processing.py", "ip_codec.py"],
+        "artifacts": [],
+        "outputs": [PREPROCESSED_CSV],
+    },
+    "train": {
+        "code": ["train_model.py", "training_compaction.py", "threshold_optimizer.py", "forest_compiler.py",
+                 "model_registry.py", "ip_codec.py"],
+        "artifacts": [PREPROCESSED_CSV],
+        "outputs": [IFOREST_MODEL, SURICATA_ANALYSIS_CSV],
+    },
+    "ground_truth": {
+        "code": ["generate_ground_truth.py"],
+        "artifacts": [],
+        "outputs": [GROUND_TRUTH_CSV],
+    },
+    "evaluate": {
+        "code": ["evaluate.py", "threshold_optimizer.py", "labeled_store.py", "bootstrap_ci.py"],
+        "artifacts": [GROUND_TRUTH_CSV, SURICATA_ANALYSIS_CSV, LABELED_SCORES_NPZ],
+        "outputs": [THRESHOLDS_JSON, SELECTED_THRESHOLD_FILE, THRESHOLD_REPORT_CSV],
+    },
+}
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class StageCache:
+    """Huellas de etapas y hashes de archivos persistidos en STAGE_CACHE_JSON."""
+
+    def __init__(self, path=STAGE_CACHE_JSON):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.files = data.get("files", {})
+        self.stages = data.get("stages", {})
+        self.last_run = data.get("last_run")
+
+    def file_hash(self, path):
+        """SHA-256 del archivo (None si no existe); se recalcula sólo si cambian mtime o tamaño."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.files.pop(path, None)
+            return None
+        known = self.files.get(path)
+        if known and known["mtime_ns"] == st.st_mtime_ns and known["size"] == st.st_size:
+            return known["sha256"]
+        digest = _sha256_file(path)
+        self.files[path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": digest}
+        return digest
+
+    def lookup(self, stage, key):
+        """Entrada registrada para (etapa, huella) si sus salidas siguen intactas; si no, None."""
+        entry = self.stages.get(stage, {}).get(key)
+        if entry is None:
+            return None
+        if any(self.file_hash(p) != digest for p, digest in entry["outputs"].items()):
+            return None
+        return entry
+
+    def record(self, stage, key, outputs, seconds):
+        entries = self.stages.setdefault(stage, {})
+        entries.pop(key, None)
+        entries[key] = {"outputs": {p: self.file_hash(p) for p in outputs},
+                        "seconds": round(seconds, 4), "created_at": time.time()}
+        while len(entries) > KEEP_KEYS:
+            entries.pop(next(iter(entries)))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"files": self.files, "stages": self.stages, "last_run": self.last_run}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def code_hash(files):
+    h = hashlib.sha256()
+    for name in sorted(set(files) | {"constants.py"}):
+        path = os.path.join(CODE_DIR, name)
+        h.update(name.encode())
+        h.update(_sha256_file(path).encode() if os.path.exists(path) else b"-")
+    return h.hexdigest()
+
+
+async def query_fingerprint(query, limit=None):
+    """Huella de los eventos que devuelve `query`.
+
+    Con `limit` se replican los primeros `limit` _id en orden natural (lo que lee ml_processing.py);
+    sin límite basta con el conteo y el primer/último _id (los eventos sólo se añaden).
+    """
+    from db_connection import db
+
+    collection = db["events"]
+    if limit is not None:
+        docs = await collection.find(query, {"_id": 1}).to_list(length=limit)
+        ids = [str(d["_id"]) for d in docs]
+    else:
+        count = await collection.count_documents(query)
+        first = await collection.find_one(query, {"_id": 1}, sort=[("_id", 1)])
+        last = await collection.find_one(query, {"_id": 1}, sort=[("_id", -1)])
+        ids = [str(count), str(first and first["_id"]), str(last and last["_id"])]
+    return hashlib.sha256("|".join(ids).encode()).hexdigest()
+
+
+async def latest_session():
+    """Sesión de entrenamiento más reciente (el mismo criterio que ml_processing.py con train_only)."""
+    from db_connection import db
+
+    sessions = await db["events"].distinct("training_session", {"training_mode": True})
+    return sessions[-1] if sessions else None
+
+
+async def stage_inputs(stage, cache, ctx):
+    """Entradas de la etapa que determinan su huella."""
+    spec = STAGE_SPECS[stage]
+    inputs = {
+        "code": code_hash(spec["code"]),
+        "artifacts": {p: cache.file_hash(p) for p in spec["artifacts"]},
+    }
+    if stage == "preprocess":
+        # ml_processing.py con train_only usa siempre la sesión más reciente (no la de --session)
+        query = {"training_mode": True, "training_session": ctx["latest_session"]} if ctx["train_only"] else {}
+        inputs["params"] = {"train_only": ctx["train_only"], "session": query.get("training_session")}
+        inputs["query"] = await query_fingerprint(query, limit=1000)
+    elif stage == "train":
+        inputs["params"] = {"incremental": ctx["incremental"]}
+    elif stage == "ground_truth":
+        inputs["params"] = {"session": ctx["session"]}
+        inputs["query"] = await query_fingerprint({"training_mode": True, "training_session": ctx["session"]})
+    elif stage == "evaluate":
+        # evaluate.py escribe el umbral en la versión vigente: una versión nueva exige re-evaluar
+        from model_registry import current_version
+        inputs["params"] = {"registry_version": current_version()}
+    return inputs
+
+
+def stage_key(stage, inputs):
+    return hashlib.sha256(json.dumps({"stage": stage, **inputs}, sort_keys=True).encode()).hexdigest()
+
+
+async def run_stage(stage, ctx):
+    """Ejecuta la etapa en este proceso. Devuelve True si terminó sin error."""
+    try:
+        if stage == "preprocess":
+            from ml_processing import main as preprocess_main
+            await preprocess_main(train_only=ctx["train_only"])
+        elif stage == "train":
+            import train_model
+            train_model.train(incremental=ctx["incremental"])
+        elif stage == "ground_truth":
+            from generate_ground_truth import generate_ground_truth_from_mongo
+            await generate_ground_truth_from_mongo(session=ctx["session"])
+        elif stage == "evaluate":
+            from evaluate import compute_metrics
+            compute_metrics()  # sólo métricas y umbral: sin gráficos (ver evaluate.py --plots)
+    except Exception as e:
+        print(f"[PL] ❌ {stage}: {e}")
+        return False
+    return True
+
+
+async def run_pipeline(stages=PIPELINE, train_only=False, session=None, incremental=False, force=(),
+                       cache_path=STAGE_CACHE_JSON):
+    """Ejecuta `stages` en orden con caché por huella. Devuelve el resumen de la ejecución."""
+    cache = StageCache(cache_path)
+    latest = await latest_session() if train_only or "ground_truth" in stages else None
+    ctx = {"train_only": train_only, "session": session or latest, "latest_session": latest, "incremental": incremental}
+    report = {"started_at": time.time(), "stages": [], "hits": 0, "seconds": 0.0, "saved_s": 0.0}
+
+    for stage in stages:
+        inputs = await stage_inputs(stage, cache, ctx)
+        key = stage_key(stage, inputs)
+        entry = None if stage in force else cache.lookup(stage, key)
+        if entry is not None:
+            print(f"[PL] ⏭ {stage}: sin cambios (caché {key[:12]}), ahorro ~{entry['seconds']}s")
+            report["stages"].append({"stage": stage, "cache": "hit", "key": key, "seconds": 0.0,
+                                     "saved_s": entry["seconds"]})
+            report["hits"] += 1
+            report["saved_s"] += entry["seconds"]
+            continue
+
+        print(f"[PL] ▶ {stage}: ejecutando (huella {key[:12]})")
+        t0 = time.perf_counter()
+        ok = await run_stage(stage, ctx)
+        seconds = time.perf_counter() - t0
+        outputs = STAGE_SPECS[stage]["outputs"]
+        missing = [p for p in outputs if not os.path.exists(p)]
+        if ok and missing:
+            print(f"[PL] ⚠ {stage}: no generó {', '.join(missing)}")
+            ok = False
+        report["stages"].append({"stage": stage, "cache": "miss", "key": key, "seconds": round(seconds, 4),
+                                 "saved_s": 0.0, "ok": ok})
+        report["seconds"] += seconds
+        if not ok:
+            print(f"[PL] ⛔ Cadena detenida en {stage}")
+            break
+        # Se registra tras cada etapa: si una posterior falla, ésta no se repite en el siguiente intento
+        cache.record(stage, key, outputs, seconds)
+        cache.save()
+
+    report["seconds"] = round(report["seconds"], 4)
+    report["saved_s"] = round(report["saved_s"], 4)
+    report["finished_at"] = time.time()
+    cache.last_run = report
+    cache.save()
+    print(f"[PL] 📊 {report['hits']}/{len(report['stages'])} etapas desde caché, "
+          f"{report['seconds']}s ejecutando, ~{report['saved_s']}s ahorrados")
+    return report
+
+
+def _stage_list(value):
+    stages = [s.strip() for s in value.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGE_SPECS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Etapas desconocidas: {', '.join(unknown)}")
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cadena preprocess → train → ground_truth → evaluate con caché por etapa")
+    parser.add_argument("--stages", type=_stage_list, default=PIPELINE, help="Etapas separadas por comas (en orden)")
+    parser.add_argument("--train-only", action="store_true", help="Preprocesar sólo la sesión de entrenamiento más reciente")
+    parser.add_argument("--session", default=None, help="Sesión para ground_truth (por defecto la más reciente)")
+    parser.add_argument("--incremental", action="store_true", help="Entrenamiento incremental (ver train_model.py)")
+    parser.add_argument("--force", type=_stage_list, default=[], help="Etapas a ejecutar aunque estén en caché")
+    args = parser.parse_args()
+    summary = asyncio.run(run_pipeline(args.stages, args.train_only, args.session, args.incremental, args.force))
+    sys.exit(1 if any(s.get("ok") is False for s in summary["stages"]) else 0)
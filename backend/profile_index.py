@@ -0,0 +1,260 @@
+"""
+profile_index.py
+
+📌 Función principal:
+    Índice de perfiles de comportamiento por src_ip para las reglas contextuales de generate_rules.py:
+    nº de eventos, puerto destino mínimo/máximo, nº de puertos distintos y última vez visto.
+    Sustituye al filtrado `historical_data[historical_data['src_ip'] == ip]` (un barrido completo del
+    CSV preprocesado por cada anomalía): la consulta es un acceso a diccionario, O(1) por evento.
+
+⚙️ Cómo funciona:
+    - Estado columnar en memoria: `keys` (src_ip) + un arreglo por métrica, alineados por posición;
+      `pos` (dict src_ip → posición) da el acceso O(1).
+    - Los puertos distintos se llevan como pares únicos ordenados `posición << 16 | puerto` (int64): un
+      lote nuevo sólo inserta los pares que no estaban (búsqueda binaria), sin reordenar el histórico.
+    - update() agrega un lote de eventos crudos (src_ip, dest_port, timestamp) y lo aplica como delta;
+      save() escribe el .npz con archivo temporal + os.replace bajo un flock. Si otro proceso guardó entre
+      medias (API y servicio de reglas), relee el disco y vuelve a aplicar los deltas pendientes: los deltas
+      son combinables (suma, mín, máx, unión), así que no se pierden ni se duplican eventos.
+    - rollback() descarta los deltas de un lote cuyos eventos no se marcaron como procesados.
+    - rebuild_from_mongo() reconstruye el índice con los eventos ya procesados de `events` (primer arranque).
+
+📦 Formato (PROFILE_INDEX_NPZ):
+    keys → src_ip en bytes; count (int64), port_min/port_max/n_ports (int32), last_seen (float64, epoch),
+    pairs (int64, pares posición/puerto únicos y ordenados)
+
+🔗 Usado por:
+    - generate_rules.py → refresh() y save() por vaciado, update() con cada lote (rollback() si no se marca),
+                          get() en las reglas contextuales
+    - rule_daemon.py    → ensure_built() al arrancar
+
+🧪 Uso:
+    python profile_index.py --rebuild
+"""
+import asyncio
+import fcntl
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from constants import PROFILE_INDEX_NPZ
+
+PORT_BITS = 16
+COLUMNS = {
+    "count": np.int64,
+    "port_min": np.int32,
+    "port_max": np.int32,
+    "n_ports": np.int32,
+    "last_seen": np.float64,
+}
+
+
+def aggregate(src_ip, dest_port, ts=None) -> dict:
+    """Delta de un lote: agregados por src_ip y pares (src_ip, puerto) únicos del lote."""
+    src = pd.Series(src_ip, dtype=object).map(str).to_numpy(dtype=object)  # map(str): NaN → "nan" (astype(str) lo deja NaN)
+    port = pd.to_numeric(pd.Series(dest_port), errors="coerce").fillna(0).clip(0, 65535).astype(np.int64).to_numpy()
+    if ts is None:
+        seen = np.full(len(src), time.time())
+    else:
+        parsed = pd.to_datetime(pd.Series(ts), errors="coerce", utc=True)
+        epoch = pd.Timestamp(0, tz="UTC")
+        seen = (parsed - epoch).dt.total_seconds().fillna(time.time()).to_numpy(dtype=np.float64)
+    valid = (src != "") & (src != "nan") & (src != "None")
+    src, port, seen = src[valid], port[valid], seen[valid]
+    keys, inverse = np.unique(src, return_inverse=True)
+    n = len(keys)
+    pairs = np.unique(inverse.astype(np.int64) << PORT_BITS | port)
+    return {
+        "keys": keys,
+        "count": np.bincount(inverse, minlength=n).astype(np.int64),
+        "port_min": _reduce(np.minimum, inverse, port, n, 65535),
+        "port_max": _reduce(np.maximum, inverse, port, n, 0),
+        "last_seen": _reduce(np.maximum, inverse, seen, n, -np.inf),
+        "pair_row": pairs >> PORT_BITS,
+        "pair_port": pairs & 0xFFFF,
+    }
+
+
+def _reduce(ufunc, inverse, values, n, fill):
+    out = np.full(n, fill, dtype=values.dtype)
+    ufunc.at(out, inverse, values)
+    return out
+
+
+class ProfileIndex:
+    """Perfiles por src_ip en memoria con persistencia incremental."""
+
+    def __init__(self, path=PROFILE_INDEX_NPZ):
+        self.path = path
+        self._reset()
+        self._deltas = []
+        self._stamp = None
+
+    def _reset(self):
+        self.keys = []
+        self.pos = {}
+        self.cols = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.pairs = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _disk_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    # ── Lectura ──────────────────────────────────────────────────────────
+    def load(self):
+        """Estado del disco (vacío si no existe). Descarta los deltas no guardados."""
+        self._reset()
+        self._deltas = []
+        self._stamp = self._disk_stamp()
+        if self._stamp is None:
+            return self
+        with np.load(self.path) as data:
+            self.keys = data["keys"].astype(str).tolist()
+            self.cols = {name: data[name].astype(dtype) for name, dtype in COLUMNS.items()}
+            self.pairs = data["pairs"].astype(np.int64)
+        self.pos = {k: i for i, k in enumerate(self.keys)}
+        print(f"[PI] 📖 Índice de perfiles cargado: {len(self.keys)} orígenes, {len(self.pairs)} pares origen/puerto")
+        return self
+
+    def refresh(self):
+        """Relee el disco si otro proceso lo guardó y aquí no hay deltas pendientes (si los hay, save() combina)."""
+        if not self._deltas and self._disk_stamp() != self._stamp:
+            self.load()
+        return self
+
+    def get(self, src_ip):
+        """Perfil de `src_ip` (dict) o None si nunca se vio. O(1)."""
+        i = self.pos.get(str(src_ip))
+        if i is None:
+            return None
+        return {"src_ip": self.keys[i], **{name: col[i].item() for name, col in self.cols.items()}}
+
+    # ── Escritura ────────────────────────────────────────────────────────
+    def _apply(self, delta):
+        rows = np.fromiter((self.pos.get(k, -1) for k in delta["keys"]), dtype=np.int64, count=len(delta["keys"]))
+        new = rows < 0
+        if new.any():
+            start = len(self.keys)
+            added = delta["keys"][new].tolist()
+            self.keys.extend(added)
+            self.pos.update((k, start + j) for j, k in enumerate(added))
+            rows[new] = np.arange(start, start + len(added))
+            fills = {"count": 0, "port_min": 65535, "port_max": 0, "n_ports": 0, "last_seen": -np.inf}
+            for name, dtype in COLUMNS.items():
+                self.cols[name] = np.concatenate([self.cols[name], np.full(len(added), fills[name], dtype=dtype)])
+        c = self.cols
+        c["count"][rows] += delta["count"]
+        c["port_min"][rows] = np.minimum(c["port_min"][rows], delta["port_min"])
+        c["port_max"][rows] = np.maximum(c["port_max"][rows], delta["port_max"])
+        c["last_seen"][rows] = np.maximum(c["last_seen"][rows], delta["last_seen"])
+
+        # Pares nuevos: búsqueda binaria en los existentes e inserción ordenada
+        pairs = np.sort(rows[delta["pair_row"]] << PORT_BITS | delta["pair_port"])
+        at = np.searchsorted(self.pairs, pairs)
+        seen = (at < len(self.pairs)) & (self.pairs[np.minimum(at, len(self.pairs) - 1)] == pairs) \
+            if len(self.pairs) else np.zeros(len(pairs), dtype=bool)
+        fresh = pairs[~seen]
+        if fresh.size:
+            self.pairs = np.insert(self.pairs, at[~seen], fresh)
+            c["n_ports"] += np.bincount(fresh >> PORT_BITS, minlength=len(self.keys)).astype(np.int32)
+
+    def update(self, src_ip, dest_port, ts=None) -> int:
+        """Agrega un lote de eventos al índice (en memoria; save() lo persiste). Devuelve orígenes tocados."""
+        delta = aggregate(src_ip, dest_port, ts)
+        if len(delta["keys"]):
+            self._apply(delta)
+            self._deltas.append(delta)
+        return len(delta["keys"])
+
+    def checkpoint(self) -> int:
+        """Marca para rollback(): nº de deltas pendientes de guardar."""
+        return len(self._deltas)
+
+    def rollback(self, mark):
+        """Deshace los update() posteriores a `mark` que aún no se guardaron (lote que no llegó a marcarse
+        como procesado: se releerá y, si no, se contaría dos veces). Relee el disco y reaplica los anteriores."""
+        if len(self._deltas) <= mark:
+            return
+        deltas = self._deltas[:mark]
+        self.load()
+        for delta in deltas:
+            self._apply(delta)
+        self._deltas = deltas
+
+    @property
+    def dirty(self):
+        return bool(self._deltas)
+
+    def save(self):
+        """Persiste el índice; si otro proceso lo cambió desde la última lectura, combina con el disco."""
+        if not self._deltas:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self._disk_stamp() != self._stamp:
+                    deltas = self._deltas
+                    self.load()
+                    for delta in deltas:
+                        self._apply(delta)
+                tmp = f"{self.path}.tmp-{os.getpid()}.npz"
+                np.savez(tmp, keys=np.asarray(self.keys, dtype=object).astype("S"), pairs=self.pairs, **self.cols)
+                os.replace(tmp, self.path)
+                self._stamp = self._disk_stamp()
+                self._deltas = []
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+async def rebuild_from_mongo(index=None, batch_size=50000):
+    """Reconstruye el índice recorriendo `events` por lotes de _id (sin cargar la colección entera).
+
+    Sólo cuenta los eventos ya procesados: los pendientes los añade generate_rules al procesarlos.
+    """
+    from db_connection import db
+
+    index = index or ProfileIndex()
+    index._reset()
+    index._deltas = []
+    index._stamp = index._disk_stamp()
+    projection = {"_id": 1, "src_ip": 1, "dest_port": 1, "timestamp": 1}
+    last_id, total = None, 0
+    while True:
+        query = {"processed": True} if last_id is None else {"processed": True, "_id": {"$gt": last_id}}
+        docs = await db["events"].find(query, projection).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        df = pd.DataFrame(docs)
+        index.update(df.get("src_ip", ""), df.get("dest_port", 0), df.get("timestamp"))
+        total += len(docs)
+    if not index._deltas:  # colección vacía: dejar un índice vacío en disco igualmente
+        index._deltas.append(aggregate([], []))
+    index.save()
+    print(f"[PI] ✅ Índice reconstruido: {total} eventos, {len(index)} orígenes")
+    return index
+
+
+async def ensure_built(index):
+    """Primer arranque sin índice en disco: reconstruirlo desde MongoDB."""
+    if index._disk_stamp() is None and not len(index):
+        await rebuild_from_mongo(index)
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        asyncio.run(rebuild_from_mongo())
+    else:
+        idx = ProfileIndex().load()
+        for ip in sys.argv[1:]:
+            print(idx.get(ip))
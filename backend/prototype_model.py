@@ -0,0 +1,204 @@
+"""
+prototype_model.py
+
+📌 Función principal:
+    Modelo de prototipos: un conjunto compacto de centroides (MiniBatchKMeans) aprendido de las sesiones
+    etiquetadas normal/anomaly, con búsqueda del prototipo más cercano en un KD-tree.
+    Se usa como filtro barato ANTES del bosque: los eventos claramente normales no pasan por el IF.
+
+⚙️ Cómo funciona:
+    - Features por evento sin agregados (columnas del propio evento, vectorizado): puertos, severidad,
+      longitud de paquete, proto (código fijo) y hora; log1p con signo y estandarización guardada.
+    - MiniBatchKMeans por clase (K_NORMAL prototipos normales, K_ANOMALY anómalos).
+    - Cada prototipo normal guarda su radio: percentil 95 de la distancia de sus miembros.
+    - Un evento es "claramente normal" si cae dentro del radio de su prototipo normal más cercano
+      y está más cerca de él que de cualquier prototipo anómalo.
+    - Las consultas usan sklearn KDTree: O(log k) por evento en vez de comparar con todos los centroides.
+
+📤 Salida:
+    /app/models/prototypes.pkl (PROTOTYPES_PKL)
+
+🔗 Usado por:
+    - generate_rules.py → sólo los eventos no descartados se puntúan con el Isolation Forest
+    - routes.py (/predict) → respuesta inmediata si el evento es claramente normal
+
+🧪 Uso:
+    python prototype_model.py [--k-normal 64] [--k-anomaly 16]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from constants import PROTOTYPES_PKL, LABEL_NORMAL, LABEL_ANOMALY
+from ml_processing import PROTO_CODES
+
+EVENT_FEATURES = ["src_port", "dest_port", "alert_severity", "packet_length", "proto", "hour"]
+PROJECTION = {c: 1 for c in EVENT_FEATURES if c != "hour"} | {"timestamp": 1, "training_label": 1}
+K_NORMAL = 64
+K_ANOMALY = 16
+
+
+def event_matrix(df) -> np.ndarray:
+    """Matriz (filas × EVENT_FEATURES) con los campos crudos del evento, sin agregados."""
+    n = len(df)
+    cols = []
+    for col in EVENT_FEATURES:
+        if col == "proto":
+            s = df["proto"] if "proto" in df.columns else pd.Series("", index=df.index)
+            cols.append(s.astype(str).str.upper().map(PROTO_CODES).fillna(0).to_numpy(dtype=float))
+        elif col == "hour":
+            if "hour" in df.columns:
+                cols.append(pd.to_numeric(df["hour"], errors="coerce").fillna(0).to_numpy(dtype=float))
+            elif "timestamp" in df.columns:
+                ts = pd.to_datetime(df["timestamp"], errors="coerce", utc=True)
+                cols.append(ts.dt.hour.fillna(0).to_numpy(dtype=float))
+            else:
+                cols.append(np.zeros(n))
+        elif col in df.columns:
+            cols.append(pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy(dtype=float))
+        else:
+            cols.append(np.zeros(n))
+    X = np.column_stack(cols)
+    return np.sign(X) * np.log1p(np.abs(X))
+
+
+class PrototypeModel:
+    """Centroides normales/anómalos + KD-trees; decide qué eventos necesitan el bosque."""
+
+    def __init__(self, mean, scale, normal_centers, normal_radius, anomaly_centers):
+        self.mean = mean
+        self.scale = scale
+        self.normal_centers = normal_centers
+        self.normal_radius = normal_radius
+        self.anomaly_centers = anomaly_centers
+        self._build_index()
+
+    def _build_index(self):
+        self.normal_tree = KDTree(self.normal_centers)
+        self.anomaly_tree = KDTree(self.anomaly_centers) if len(self.anomaly_centers) else None
+
+    def __getstate__(self):
+        # Los KD-trees se reconstruyen al cargar (milisegundos): el .pkl sólo guarda arreglos
+        state = self.__dict__.copy()
+        state.pop("normal_tree", None)
+        state.pop("anomaly_tree", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_index()
+
+    def score(self, df):
+        """(distancia normalizada al prototipo normal más cercano, máscara de claramente normal)."""
+        return self.score_matrix(event_matrix(df))
+
+    def score_matrix(self, X):
+        Z = (X - self.mean) / self.scale
+        d_normal, idx = self.normal_tree.query(Z, k=1)
+        d_normal, idx = d_normal[:, 0], idx[:, 0]
+        radius = self.normal_radius[idx]
+        clear = d_normal <= radius
+        if self.anomaly_tree is not None:
+            d_anomaly = self.anomaly_tree.query(Z, k=1)[0][:, 0]
+            clear &= d_normal < d_anomaly
+        return d_normal / np.maximum(radius, 1e-9), clear
+
+    def needs_forest(self, df):
+        """Máscara de eventos que deben pasar a la siguiente etapa (no claramente normales)."""
+        return ~self.score(df)[1]
+
+
+def fit_prototypes(X, y, k_normal=K_NORMAL, k_anomaly=K_ANOMALY, seed=42):
+    from sklearn.cluster import MiniBatchKMeans
+
+    mean = X.mean(axis=0)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    Z = (X - mean) / scale
+
+    Zn, Za = Z[y == 0], Z[y == 1]
+    if len(Zn) == 0:
+        raise ValueError("Se necesitan eventos normales etiquetados para los prototipos")
+    km = MiniBatchKMeans(n_clusters=min(k_normal, len(Zn)), batch_size=4096, n_init=3, random_state=seed).fit(Zn)
+    dist = np.linalg.norm(Zn - km.cluster_centers_[km.labels_], axis=1)
+    radius = np.zeros(km.n_clusters)
+    for c in range(km.n_clusters):
+        members = dist[km.labels_ == c]
+        radius[c] = np.quantile(members, 0.95) if members.size else 0.0
+
+    anomaly_centers = np.empty((0, Z.shape[1]))
+    if len(Za):
+        ka = MiniBatchKMeans(n_clusters=min(k_anomaly, len(Za)), batch_size=4096, n_init=3, random_state=seed).fit(Za)
+        anomaly_centers = ka.cluster_centers_
+    return PrototypeModel(mean, scale, km.cluster_centers_, radius, anomaly_centers)
+
+
+async def load_labeled_events():
+    """(X, y) con las features por evento de todas las sesiones etiquetadas (sin agregados)."""
+    from db_connection import db
+
+    query = {"training_mode": True, "training_label": {"$in": [LABEL_NORMAL, LABEL_ANOMALY]}}
+    events = await db["events"].find(query, PROJECTION).to_list(length=None)
+    if not events:
+        return None, None
+    df = pd.DataFrame(events)
+    return event_matrix(df), (df["training_label"] == LABEL_ANOMALY).to_numpy(dtype=np.int8)
+
+
+async def train_prototypes(path=PROTOTYPES_PKL, k_normal=K_NORMAL, k_anomaly=K_ANOMALY):
+    X, y = await load_labeled_events()
+    if X is None:
+        print("[PT] ⚠ No hay eventos etiquetados para construir prototipos.")
+        return None
+    t0 = time.perf_counter()
+    model = fit_prototypes(X, y, k_normal, k_anomaly)
+    fit_s = time.perf_counter() - t0
+    _, clear = model.score_matrix(X)
+    print(f"[PT] 📊 Filtrados como claramente normales: {clear[y == 0].mean():.1%} de los normales, "
+          f"{clear[y == 1].mean() if (y == 1).any() else 0:.1%} de las anomalías")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(model, tmp)
+    os.replace(tmp, path)
+    print(f"[PT] ✅ {len(model.normal_centers)} prototipos normales + {len(model.anomaly_centers)} anómalos "
+          f"({fit_s:.2f}s) → {path}")
+    return model
+
+
+class PrototypeHandle:
+    """Modelo de prototipos cacheado; se recarga si cambia el archivo. None si no existe."""
+
+    def __init__(self, path=PROTOTYPES_PKL):
+        self.path = path
+        self._stamp = None
+        self.model = None
+
+    def get(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != self._stamp:
+            try:
+                self.model = joblib.load(self.path)
+                self._stamp = stamp
+            except Exception as e:
+                print(f"[PT] ⚠ No se pudo cargar {self.path}: {e}")
+                return None
+        return self.model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrenamiento del modelo de prototipos (MiniBatchKMeans + KD-tree)")
+    parser.add_argument("--k-normal", type=int, default=K_NORMAL)
+    parser.add_argument("--k-anomaly", type=int, default=K_ANOMALY)
+    args = parser.parse_args()
+    asyncio.run(train_prototypes(k_normal=args.k_normal, k_anomaly=args.k_anomaly))
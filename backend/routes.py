@@ -1,9 +1,9 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
-from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, Query
+from typing import List, Optional
 import os
 import json
+import asyncio
 import pandas as pd
-import joblib
 import numpy as np
 from db_connection import db
 from datetime import datetime
@@ -11,8 +11,12 @@ import socket
 from hashlib import sha256
 import time
 
-from generate_rules import generate_suricata_rules  # 👈 Asegúrate que el nombre y la ruta sean correctos
-from constants import IFOREST_MODEL, RULES_FILE, RULES_DIR
+from generate_rules import generate_suricata_rules, MODEL_HANDLE, PROTOTYPE_HANDLE, RULE_STORE  # 👈 Asegúrate que el nombre y la ruta sean correctos
+import model_registry
+import training_service
+import online_evaluator
+import rule_daemon
+from constants import RULES_DIR
 
 
 
@@ -25,6 +29,60 @@ async def generate_rules_endpoint(background_tasks: BackgroundTasks):
     background_tasks.add_task(generate_suricata_rules)
     return {"message": "🚀 Generación de reglas iniciada en segundo plano"}  
 
+@router.post("/train")
+async def train_endpoint(
+    preprocess: bool = Query(False, description="¿Ejecutar ml_processing antes de entrenar?"),
+    incremental: bool = Query(False, description="¿Ampliar el modelo vigente con árboles de la ventana actual?"),
+):
+    """Encola un entrenamiento en el pool de procesos. Rechaza envíos duplicados mientras hay uno en curso."""
+    try:
+        job = training_service.submit_training(preprocess=preprocess, incremental=incremental)
+    except training_service.TrainingAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail=f"Ya hay un entrenamiento en curso ({e}).")
+    return {"message": "🧠 Entrenamiento encolado", **job}
+
+
+@router.get("/train/status")
+async def train_status():
+    """Estado del último entrenamiento: etapa actual y duración por etapa."""
+    return training_service.job_status()
+
+
+@router.get("/model/version")
+async def model_version():
+    """Versión vigente del registro y su manifest."""
+    version = model_registry.current_version()
+    if version is None:
+        return {"version": None, "versions": []}
+    return {"version": version, "versions": model_registry.list_versions(),
+            "manifest": model_registry.load_manifest(version)}
+
+
+@router.post("/model/promote/{version}")
+async def promote_model(version: str):
+    """Promueve (o revierte a) una versión registrada."""
+    try:
+        model_registry.promote(version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"version": version}
+
+
+@router.get("/metrics/online")
+async def online_metrics():
+    """Métricas móviles del modelo vigente (precision/recall/F1 en el umbral activo, AP) desde online_evaluator."""
+    return online_evaluator.ONLINE_EVALUATOR.snapshot()
+
+
+@router.get("/metrics/online/history")
+async def online_metrics_history(
+    hours: float = Query(24, gt=0, le=24 * 30, description="Horas hacia atrás"),
+    model_version: Optional[str] = Query(None, description="Filtrar por versión del modelo"),
+):
+    """Serie temporal por ventana (colección time series) para el dashboard."""
+    return {"windows": await online_evaluator.history(hours, model_version)}
+
+
 @router.get("/host-ip")
 async def get_host_ip():
     """Devuelve la IP local del host donde corre FastAPI (útil para descubrir servicios en red local)."""
@@ -94,25 +152,28 @@ async def get_logs(page: int = 1, limit: int = 100, dia: int = None, mes: int =
 @router.post("/predict")
 async def predict_anomaly(data: dict):
     try:
-        # Cargar modelo dinámicamente al momento de predecir
-        MODEL_PATH = IFOREST_MODEL
-        if not os.path.exists(MODEL_PATH):
-            raise HTTPException(status_code=503, detail="Modelo no encontrado. Entrena antes de predecir.")
-        
+        # Versión vigente del registro; sólo se recarga cuando se promueve una nueva
         try:
-            model = joblib.load(MODEL_PATH)
+            model, _, version = MODEL_HANDLE.get()
+        except FileNotFoundError:
+            raise HTTPException(status_code=503, detail="Modelo no encontrado. Entrena antes de predecir.")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error cargando el modelo: {e}")
 
         df = pd.DataFrame([data])
+        # Primera etapa: si el evento cae dentro de un prototipo normal, no se consulta el bosque
+        prototypes = PROTOTYPE_HANDLE.get()
+        if prototypes is not None and not prototypes.needs_forest(df)[0]:
+            return {"anomaly": False, "stage": "prototypes", "model_version": version}
+
         df["src_ip"] = sum([int(num) << (8 * i) for i, num in enumerate(reversed(df["src_ip"][0].split('.')))])
         df["dest_ip"] = sum([int(num) << (8 * i) for i, num in enumerate(reversed(df["dest_ip"][0].split('.')))])
         df["proto"] = df["proto"].astype("category").cat.codes
         df = (df - df.min()) / (df.max() - df.min())
 
-        prediction = model.predict(df)
+        _, prediction = model.score(df)
 
-        return {"anomaly": bool(prediction[0] == -1)}
+        return {"anomaly": bool(prediction[0] == -1), "model_version": version}
 
     except Exception as e:
         return {"error": str(e)}
@@ -171,28 +232,40 @@ async def list_rules(file: Optional[str] = Query(None, description="Nombre del a
         return {"error": str(e)}
 
 
-@router.put("/rules/{sid}/{status}")
-async def toggle_rule(sid: int, status: str):
-    """Activa o desactiva una regla según su `sid`."""
+@router.get("/rules/daemon")
+async def rule_daemon_health():
+    """Salud del servicio de reglas (rule_daemon.py): último latido, contadores y lag de eventos pendientes."""
+    return await rule_daemon.health()
+
+
+@router.put("/rules/{status}")
+async def toggle_rules(status: str, sids: List[int] = Body(..., embed=True)):
+    """Activa o desactiva en bloque las reglas de `sids` (una sola escritura y publicación de sml.rules)."""
     if status not in ["enable", "disable"]:
         return {"error": "Estado inválido. Usa 'enable' o 'disable'."}
-
     try:
-        with open(RULES_FILE, "r") as file:
-            lines = file.readlines()
+        found = await asyncio.to_thread(RULE_STORE.set_enabled, sids, status == "enable")
+        await asyncio.to_thread(RULE_STORE.publish)
+        return {"message": f"{found} de {len(sids)} reglas {status} correctamente.", "found": found}
+    except Exception as e:
+        return {"error": str(e)}
 
-        updated_lines = []
-        for line in lines:
-            if f"sid:{sid};" in line:
-                if status == "disable" and not line.startswith("#"):
-                    line = "#" + line  # Desactivar
-                elif status == "enable":
-                    line = line.lstrip("#")  # Activar
-            updated_lines.append(line)
 
-        with open(RULES_FILE, "w") as file:
-            file.writelines(updated_lines)
+@router.put("/rules/{sid}/{status}")
+async def toggle_rule(sid: int, status: str):
+    """Activa o desactiva una regla según su `sid` (el de una regla de grupo compactada aplica a sus reglas)."""
+    if status not in ["enable", "disable"]:
+        return {"error": "Estado inválido. Usa 'enable' o 'disable'."}
 
+    try:
+        # Una regla compactada (metadata:sml compacted) sólo existe en sml.rules: se aplica a las que cubre
+        members = await asyncio.to_thread(RULE_STORE.group_members, sid)
+        if not await asyncio.to_thread(RULE_STORE.set_enabled, [sid], status == "enable"):
+            return {"error": f"La regla {sid} no existe."}
+        await asyncio.to_thread(RULE_STORE.publish)
+        if members:
+            return {"message": f"Regla de grupo {sid} {status} correctamente ({len(members)} reglas: "
+                               f"{', '.join(map(str, members))}).", "members": members}
         return {"message": f"Regla {sid} {status} correctamente."}
     except Exception as e:
         return {"error": str(e)}
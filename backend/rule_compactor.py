@@ -0,0 +1,341 @@
+"""
+rule_compactor.py
+
+📌 Función principal:
+    Compactación de las reglas generadas por el modelo antes de publicar sml.rules: las reglas con la misma
+    acción y protocolo se funden en listas de direcciones, bloques CIDR y rangos de puertos. generate_rules
+    emite una regla por (src_ip, dest_ip, dest_port), así que sin compactar sml.rules (y el tiempo de recarga
+    y de inspección de Suricata) crece linealmente con las tuplas anómalas.
+
+⚙️ Cómo funciona:
+    - Cada regla se descompone en (acción, proto, origen, puerto origen, destino, puerto destino); las
+      direcciones y los puertos son intervalos enteros (los CIDR se calculan sólo al escribir la regla). Sólo se compactan reglas cuyas opciones
+      son msg/sid/rev (las generadas); el resto se publica tal cual.
+    - Fusión exacta por dimensión: se agrupan las reglas que coinciden en todo salvo una dimensión y se
+      une esa dimensión (unión de intervalos; summarize_address_range da los bloques CIDR exactos). Se repite
+      origen → destino → puerto destino → puerto origen hasta que no baja el número de reglas. Unir una
+      dimensión con las demás iguales no cambia el tráfico que casa.
+    - Única ampliación, opt-in (RULES_COMPACT_ANY_SPORT, desactivada por defecto): en reglas alert, un
+      puerto origen efímero (≥ 1024) pasa a "any" (una regla atada a un puerto efímero casi nunca vuelve a
+      casar y, sin esto, reglas del mismo origen y destino no se pueden fundir). Nunca en reglas drop: la
+      compactación no cambia lo que se bloquea.
+    - Política: una regla drop nunca cubre puertos sólo-alerta (ALERT_ONLY_PORTS / ip_policy.json); si
+      los cubre (p. ej. la política cambió después de generarla), esos puertos pasan a una regla alert.
+    - Listas de más de RULES_COMPACT_MAX_ITEMS elementos se trocean en varias reglas.
+    - Una regla que no se funde con otras conserva su sid y su msg; las fusionadas reciben un sid
+      estable (hash del contenido, desde RULES_COMPACT_SID_BASE) y `metadata:sml compacted` para que
+      rule_store no las adopte como reglas manuales.
+
+🔗 Usado por:
+    - rule_store.py → render() al publicar sml.rules
+
+🧪 Uso:
+    python rule_compactor.py               # antes/después sobre el almacén de reglas actual
+    python rule_compactor.py --bench 100000
+"""
+import hashlib
+import ipaddress
+import re
+import sys
+import time
+
+from constants import (
+    RULES_COMPACT_ANY_SPORT,
+    RULES_COMPACT_MAX_ITEMS,
+    RULES_COMPACT_SID_BASE,
+)
+from rule_store import COMPACTED_MARKER
+
+ANY = "any"
+MAX_PORT = 65535
+EPHEMERAL_MIN = 1024
+RULE_RE = re.compile(r"^(\w+)\s+(\w+)\s+(\S+)\s+(\S+)\s+->\s+(\S+)\s+(\S+)\s*\((.*)\)\s*$")
+OPTION_RE = re.compile(r'\s*(\w+)\s*(?::\s*("[^"]*"|[^;]*?))?\s*;')
+COMPACTABLE_OPTIONS = {"msg", "sid", "rev"}
+
+SRC, SPORT, DST, DPORT = 2, 3, 4, 5  # posiciones en la tupla de campos
+MERGE_ORDER = (SRC, DST, DPORT, SPORT)
+
+
+# ── Direcciones y puertos ───────────────────────────────────────────────
+# Direcciones y puertos se representan igual: tupla de intervalos enteros (lo, hi) disjuntos y ordenados.
+# Las IPv6 se desplazan V6_OFFSET para que nunca se fundan con IPv4; los CIDR salen al formatear.
+V6_OFFSET = 1 << 33
+PARSE_CACHE_MAX = 500000
+
+
+def _items(token):
+    return token[1:-1].split(",") if token.startswith("[") and token.endswith("]") else [token]
+
+
+def _merge_intervals(intervals):
+    if len(intervals) == 1:
+        return tuple(intervals)
+    out = []
+    for lo, hi in sorted(intervals):
+        if out and lo <= out[-1][1] + 1:
+            out[-1] = (out[-1][0], max(out[-1][1], hi))
+        else:
+            out.append((lo, hi))
+    return tuple(out)
+
+
+_ADDRESS_CACHE = {}
+_ADDRESS_TEXT = {}  # dirección (entero desplazado) → texto, para no volver a formatear al escribir
+
+
+def _address_interval(token):
+    cached = _ADDRESS_CACHE.get(token)
+    if cached is None:
+        item = token.strip()
+        if "/" in item:
+            net = ipaddress.ip_network(item, strict=False)
+            offset = 0 if net.version == 4 else V6_OFFSET
+            cached = (int(net.network_address) + offset, int(net.broadcast_address) + offset)
+        else:
+            ip = ipaddress.ip_address(item)
+            value = int(ip) + (0 if ip.version == 4 else V6_OFFSET)
+            cached = (value, value)
+            if len(_ADDRESS_TEXT) < PARSE_CACHE_MAX:
+                _ADDRESS_TEXT[value] = str(ip)
+        if len(_ADDRESS_CACHE) < PARSE_CACHE_MAX:
+            _ADDRESS_CACHE[token] = cached
+    return cached
+
+
+def parse_addresses(token):
+    """ANY, tupla de intervalos de direcciones u None (negaciones, variables: no se compacta)."""
+    if token == ANY:
+        return ANY
+    try:
+        return _merge_intervals([_address_interval(item) for item in _items(token)])
+    except ValueError:
+        return None
+
+
+def parse_ports(token):
+    """ANY, tupla de intervalos de puertos u None."""
+    if token == ANY:
+        return ANY
+    intervals = []
+    try:
+        for item in _items(token):
+            item = item.strip()
+            if ":" in item:
+                lo, hi = item.split(":", 1)
+                intervals.append((int(lo or 0), int(hi or MAX_PORT)))
+            else:
+                intervals.append((int(item), int(item)))
+    except ValueError:
+        return None
+    return _merge_intervals(intervals)
+
+
+def _subtract_ports(intervals, ports):
+    """(intervalos sin `ports`, intervalos con los `ports` que caían dentro)."""
+    full = [(0, MAX_PORT)] if intervals == ANY else list(intervals)
+    inside = sorted(p for p in ports if any(lo <= p <= hi for lo, hi in full))
+    rest = []
+    for lo, hi in full:
+        cut = lo
+        for p in inside:
+            if lo <= p <= hi:
+                if cut <= p - 1:
+                    rest.append((cut, p - 1))
+                cut = p + 1
+        if cut <= hi:
+            rest.append((cut, hi))
+    return tuple(rest), _merge_intervals([(p, p) for p in inside])
+
+
+def _union(values):
+    if any(v == ANY for v in values):
+        return ANY
+    return _merge_intervals([iv for v in values for iv in v])
+
+
+def address_items(value):
+    """Elementos de lista Suricata (IP o CIDR) que cubren exactamente los intervalos."""
+    if value == ANY:
+        return [ANY]
+    items = []
+    for lo, hi in value:
+        cls, offset = (ipaddress.IPv4Address, 0) if lo < V6_OFFSET else (ipaddress.IPv6Address, V6_OFFSET)
+        if lo == hi:
+            text = _ADDRESS_TEXT.get(lo)
+            items.append(text if text is not None else str(cls(lo - offset)))
+            continue
+        for net in ipaddress.summarize_address_range(cls(lo - offset), cls(hi - offset)):
+            items.append(str(net.network_address) if net.prefixlen == net.max_prefixlen else str(net))
+    return items
+
+
+def port_items(value):
+    if value == ANY or value == ((0, MAX_PORT),):
+        return [ANY]
+    return [str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in value]
+
+
+def _chunks(items, size):
+    """Trozos de como mucho `size` elementos, ya formateados como valor Suricata (lista si hay más de uno)."""
+    return [parts[0] if len(parts) == 1 else f"[{','.join(parts)}]"
+            for parts in (items[i:i + size] for i in range(0, len(items), size))]
+
+
+# ── Reglas ──────────────────────────────────────────────────────────────
+_PARSE_CACHE = {}
+
+
+def parse_rule(line):
+    """(campos, opciones) de una regla compactable; None si no lo es. En rule_daemon.py el almacén se publica
+    una y otra vez con casi las mismas reglas: sólo se analizan las nuevas."""
+    if line in _PARSE_CACHE:
+        return _PARSE_CACHE[line]
+    parsed = _parse_rule(line)
+    if len(_PARSE_CACHE) < PARSE_CACHE_MAX:
+        _PARSE_CACHE[line] = parsed
+    return parsed
+
+
+def _parse_rule(line):
+    match = RULE_RE.match(line.strip())
+    if match is None:
+        return None
+    action, proto, src, sport, dst, dport, opts = match.groups()
+    options = {k: (v or "") for k, v in OPTION_RE.findall(opts)}
+    if not options or not set(options) <= COMPACTABLE_OPTIONS or "sid" not in options:
+        return None
+    fields = (action, proto, parse_addresses(src), parse_ports(sport), parse_addresses(dst), parse_ports(dport))
+    if any(f is None for f in fields):
+        return None
+    return fields, options
+
+
+def _merge_pass(entries, dim):
+    """Une la dimensión `dim` de las entradas que coinciden en todas las demás."""
+    groups = {}
+    for entry in entries:
+        fields = entry[0]
+        groups.setdefault(fields[:dim] + fields[dim + 1:], []).append(entry)
+    out = []
+    for key, group in groups.items():
+        if len(group) == 1:
+            out.append(group[0])
+            continue
+        merged = _union([entry[0][dim] for entry in group])
+        out.append((key[:dim] + (merged,) + key[dim:], sum(e[1] for e in group), group[0][2], [e[3] for e in group]))
+    return out
+
+
+def _flatten(members):
+    """SIDs de un árbol de fusiones (listas anidadas; no se concatenan en cada pasada)."""
+    out, stack = [], [members]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        else:
+            out.append(item)
+    return sorted(out)
+
+
+def _sid(text, used):
+    sid = RULES_COMPACT_SID_BASE + int(hashlib.sha256(text.encode()).hexdigest(), 16) % 1000000
+    while sid in used:
+        sid = RULES_COMPACT_SID_BASE + (sid - RULES_COMPACT_SID_BASE + 1) % 1000000
+    used.add(sid)
+    return sid
+
+
+def compact_rules(rules, alert_only_ports=(), max_items=RULES_COMPACT_MAX_ITEMS, any_sport=RULES_COMPACT_ANY_SPORT,
+                  used_sids=()):
+    """Compacta `rules` (líneas activas). Devuelve (líneas, resumen con reglas antes/después y segundos,
+    {SID de grupo: SIDs de las reglas fundidas}).
+
+    `used_sids`: SIDs ya ocupados en sml.rules (los nuevos SID de grupo los evitan)."""
+    t0 = time.perf_counter()
+    passthrough, entries = [], []
+    used = set(int(s) for s in used_sids)
+    for line in rules:
+        parsed = parse_rule(line)
+        if parsed is None:
+            passthrough.append(line)
+            continue
+        fields, options = parsed
+        if any_sport and fields[0] == "alert" and fields[SPORT] != ANY and fields[SPORT][0][0] >= EPHEMERAL_MIN:
+            fields = fields[:SPORT] + (ANY,) + fields[SPORT + 1:]
+        sid = int(options["sid"])
+        used.add(sid)
+        entries.append((fields, 1, (line, options), sid))  # (campos, nº fundidas, primera regla, SIDs fundidos)
+
+    # Fusión exacta por dimensión hasta una vuelta completa sin cambios (repetir la misma dimensión justo
+    # después de fundirla no cambia nada, así que esa pasada ya cuenta como estable)
+    stable, i = 0, 0
+    while stable < len(MERGE_ORDER):
+        before = len(entries)
+        entries = _merge_pass(entries, MERGE_ORDER[i % len(MERGE_ORDER)])
+        stable = stable + 1 if len(entries) == before else 1
+        i += 1
+
+    # Política: drop nunca sobre puertos sólo-alerta
+    alert_only = set(int(p) for p in alert_only_ports)
+    demoted = 0
+    if alert_only:
+        checked = []
+        for fields, n, first, members in entries:
+            if fields[0] == "drop":
+                rest, hit = _subtract_ports(fields[DPORT], alert_only)
+                if hit:
+                    demoted += 1
+                    if rest:
+                        checked.append((fields[:DPORT] + (rest,), n, first, members))
+                    checked.append((("alert",) + fields[1:DPORT] + (hit,), n, first, members))
+                    continue
+            checked.append((fields, n, first, members))
+        entries = checked
+
+    kept, out, groups = set(), [], {}
+    for fields, n, (line, options), members in entries:
+        action, proto = fields[0], fields[1]
+        for src in _chunks(address_items(fields[SRC]), max_items):
+            for sport in _chunks(port_items(fields[SPORT]), max_items):
+                for dst in _chunks(address_items(fields[DST]), max_items):
+                    for dport in _chunks(port_items(fields[DPORT]), max_items):
+                        head = f"{action} {proto} {src} {sport} -> {dst} {dport}"
+                        if n == 1 and options["sid"] not in kept:
+                            kept.add(options["sid"])
+                            if head == line.split("(")[0].strip():
+                                out.append(line)
+                                continue
+                            msg = options.get("msg") or '"ML anomaly"'
+                            rev = f" rev:{options['rev']};" if "rev" in options else ""
+                            out.append(f"{head} (msg:{msg}; sid:{options['sid']};{rev})")
+                            continue
+                        sid = _sid(head, used)
+                        groups[sid] = _flatten(members)
+                        out.append(f'{head} (msg:"ML compacted group ({n} rules)"; {COMPACTED_MARKER} '
+                                   f"sid:{sid}; rev:1;)")
+    out = passthrough + out
+    stats = {"before": len(rules), "after": len(out), "demoted": demoted,
+             "seconds": round(time.perf_counter() - t0, 4)}
+    return out, stats, groups
+
+
+if __name__ == "__main__":
+    from ip_policy import load_policy
+
+    policy = load_policy()
+    if "--bench" in sys.argv:
+        from rule_renderer import render_rules, synthetic_anomalies
+
+        i = sys.argv.index("--bench")
+        n = int(sys.argv[i + 1]) if len(sys.argv) > i + 1 else 100000
+        lines = render_rules(synthetic_anomalies(n), policy, -0.05, set(), set())
+    else:
+        from rule_store import RuleStore
+
+        store = RuleStore().load()
+        lines = [r for r, enabled in store.conn.execute("SELECT rule, enabled FROM rules ORDER BY id") if enabled]
+    compacted, stats, _ = compact_rules(lines, policy.alert_only_ports)
+    print(f"[RC] 🗜 {stats['before']} reglas → {stats['after']} ({stats['demoted']} drop → alert por política) "
+          f"en {stats['seconds']:.3f}s")
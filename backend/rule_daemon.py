@@ -0,0 +1,230 @@
+"""
+rule_daemon.py
+
+📌 Función principal:
+    Servicio persistente de generación de reglas: sustituye al cron que lanzaba generate_rules.py cada
+    5 minutos. El intérprete, pandas/sklearn, el modelo (MODEL_HANDLE) y los perfiles por src_ip
+    (profile_index.py) se cargan una vez y se quedan en memoria; cada despertar llama a
+    generate_rules.generate_suricata_rules(), que vacía la cola por lotes adaptativos (el coste medido
+    por evento se conserva entre despertares).
+
+⚙️ Cómo funciona:
+    - Se despierta con cada inserción en `events`: change stream de MongoDB si el servidor lo permite
+      (replica set); si no (mongo standalone), sondeo ligero cada RULE_DAEMON_POLL_S segundos buscando
+      un evento con `processed != True`.
+    - Si una ejecución agota su presupuesto sin vaciar la cola, se encadena la siguiente sin esperar. Si
+      falla, espera RULE_DAEMON_POLL_S antes de reintentar (sin bucle caliente).
+    - Latido en db.config {_id: "rule_daemon"} cada lote y al menos cada RULE_DAEMON_HEARTBEAT_S:
+      contadores, último error, modo de espera, backlog y tiempo estimado de vaciado de la última
+      ejecución, y el retraso (lag) = antigüedad del evento pendiente más antiguo (ObjectId). Lo lee GET /rules/daemon (routes.py), que marca el servicio como caído si el
+      latido tiene más de RULE_DAEMON_STALE_S segundos.
+
+🔗 Usado por:
+    - cron/entrypoint.sh (contenedor "cron") → python /app/rule_daemon.py
+    - routes.py → health() para GET /rules/daemon
+
+🧪 Uso:
+    python rule_daemon.py          # servicio
+    python rule_daemon.py --once   # una sola pasada (igual que python generate_rules.py)
+"""
+import asyncio
+import datetime as dt
+import os
+import signal
+import socket
+import sys
+import time
+
+from constants import RULE_DAEMON_POLL_S, RULE_DAEMON_HEARTBEAT_S, RULE_DAEMON_STALE_S
+
+HEALTH_ID = "rule_daemon"
+COUNTERS = ("runs", "batches", "events", "processed", "anomalies", "new_rules", "errors")
+
+
+async def pending_lag():
+    """(segundos desde el evento pendiente más antiguo, su fecha ISO); (0.0, None) sin pendientes."""
+    from db_connection import db
+
+    oldest = await db["events"].find_one({"processed": {"$ne": True}}, {"_id": 1}, sort=[("_id", 1)])
+    if oldest is None:
+        return 0.0, None
+    created = oldest["_id"].generation_time
+    return max(0.0, (dt.datetime.now(dt.timezone.utc) - created).total_seconds()), created.isoformat()
+
+
+class RuleDaemon:
+    """Bucle de generación de reglas con espera por change stream o sondeo."""
+
+    def __init__(self, poll_s=RULE_DAEMON_POLL_S, heartbeat_s=RULE_DAEMON_HEARTBEAT_S):
+        self.poll_s = poll_s
+        self.heartbeat_s = heartbeat_s
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.mode = None
+        self.started_at = dt.datetime.now(dt.timezone.utc).isoformat()
+        self.last_run = None
+        self.last_error = None
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    # ── Estado ───────────────────────────────────────────────────────────
+    async def heartbeat(self):
+        from db_connection import db
+        from generate_rules import MODEL_HANDLE
+
+        lag_s, oldest = await pending_lag()
+        doc = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "heartbeat_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "mode": self.mode,
+            "model_version": MODEL_HANDLE.version,
+            "counters": self.counters,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+            "lag_s": round(lag_s, 3),
+            "oldest_pending_at": oldest,
+            "backlog": (self.last_run or {}).get("backlog"),
+            "drain_eta_s": (self.last_run or {}).get("drain_eta_s"),
+        }
+        await db["config"].update_one({"_id": HEALTH_ID}, {"$set": doc}, upsert=True)
+
+    async def run_once(self) -> dict:
+        from generate_rules import generate_suricata_rules
+
+        t0 = time.perf_counter()
+        stats = await generate_suricata_rules()
+        stats["seconds"] = round(time.perf_counter() - t0, 4)
+        stats["at"] = dt.datetime.now(dt.timezone.utc).isoformat()
+        self.counters["runs"] += 1
+        for k in ("batches", "events", "processed", "anomalies", "new_rules"):
+            self.counters[k] += int(stats.get(k) or 0)
+        if stats.get("error"):
+            self.counters["errors"] += 1
+            self.last_error = {"at": stats["at"], "error": stats["error"]}
+        self.last_run = stats
+        return stats
+
+    # ── Espera de eventos nuevos ────────────────────────────────────────
+    async def _sleep(self, seconds):
+        """Espera interrumpible por stop()."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _has_pending(self):
+        from db_connection import db
+
+        return await db["events"].find_one({"processed": {"$ne": True}}, {"_id": 1}) is not None
+
+    async def _wait_poll(self, timeout):
+        """Sondeo: vuelve en cuanto hay un evento pendiente o vence `timeout`."""
+        deadline = time.monotonic() + timeout
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            if await self._has_pending():
+                return
+            await self._sleep(min(self.poll_s, max(deadline - time.monotonic(), 0)))
+
+    async def _wait_stream(self, stream, timeout):
+        """Change stream: vuelve con la primera inserción (incluidas las ocurridas durante el lote anterior)."""
+        deadline = time.monotonic() + timeout
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            if await stream.try_next() is not None:
+                return
+
+    async def _open_stream(self):
+        from db_connection import db
+        from pymongo.errors import PyMongoError
+
+        try:
+            stream = db["events"].watch([{"$match": {"operationType": "insert"}}],
+                                        max_await_time_ms=int(self.poll_s * 1000))
+            await stream.try_next()  # mongo standalone falla aquí (change streams requieren replica set)
+            return stream
+        except PyMongoError as e:
+            print(f"[RD] ℹ Change streams no disponibles ({e.__class__.__name__}); sondeo cada {self.poll_s:.1f}s")
+            return None
+
+    # ── Bucle ────────────────────────────────────────────────────────────
+    async def run(self):
+        from generate_rules import PROFILE_INDEX
+        from profile_index import ensure_built
+
+        try:
+            await ensure_built(PROFILE_INDEX)
+        except Exception as e:
+            print(f"[RD] ⚠ No se pudo construir el índice de perfiles: {e}")
+        stream = await self._open_stream()
+        self.mode = "change_stream" if stream is not None else "poll"
+        print(f"[RD] 🚀 Servicio de reglas en marcha (modo {self.mode})")
+        last_beat = 0.0
+        try:
+            while not self._stop.is_set():
+                try:
+                    stats = await self.run_once()
+                except Exception as e:  # generate_suricata_rules ya captura; esto es la conexión/latido
+                    stats = {"processed": 0, "error": str(e)}
+                    self.counters["errors"] += 1
+                    self.last_error = {"at": dt.datetime.now(dt.timezone.utc).isoformat(), "error": str(e)}
+                    print(f"[RD] ⚠ Error en el lote: {e}")
+                try:
+                    await self.heartbeat()
+                    last_beat = time.monotonic()
+                except Exception as e:
+                    print(f"[RD] ⚠ No se pudo escribir el latido: {e}")
+
+                if stats.get("error"):
+                    await self._sleep(self.poll_s)  # ejecución fallida: los eventos siguen pendientes
+                    continue
+                if stats.get("processed") and not stats.get("drained"):
+                    continue  # presupuesto agotado con cola: siguiente ejecución sin esperar
+                timeout = max(self.heartbeat_s - (time.monotonic() - last_beat), 0.0)
+                if stream is not None:
+                    try:
+                        await self._wait_stream(stream, timeout)
+                    except Exception as e:
+                        print(f"[RD] ⚠ Change stream cerrado ({e}); se pasa a sondeo")
+                        stream, self.mode = None, "poll"
+                else:
+                    await self._wait_poll(timeout)
+        finally:
+            if stream is not None:
+                await stream.close()
+            print("[RD] 🛑 Servicio de reglas detenido")
+
+async def health(stale_s=RULE_DAEMON_STALE_S) -> dict:
+    """Último latido del servicio + lag actual (se recalcula: no depende de que el servicio esté vivo)."""
+    from db_connection import db
+
+    doc = await db["config"].find_one({"_id": HEALTH_ID}, {"_id": 0}) or {}
+    lag_s, oldest = await pending_lag()
+    age = None
+    if doc.get("heartbeat_at"):
+        age = (dt.datetime.now(dt.timezone.utc) - dt.datetime.fromisoformat(doc["heartbeat_at"])).total_seconds()
+    return {
+        **doc,
+        "alive": age is not None and age <= stale_s,
+        "heartbeat_age_s": None if age is None else round(age, 3),
+        "lag_s": round(lag_s, 3),
+        "oldest_pending_at": oldest,
+    }
+
+
+async def _main(once=False):
+    if once:
+        from generate_rules import generate_suricata_rules
+
+        print(await generate_suricata_rules())
+        return
+    daemon = RuleDaemon()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, daemon.stop)
+    await daemon.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(once="--once" in sys.argv))
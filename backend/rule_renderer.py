@@ -0,0 +1,201 @@
+"""
+rule_renderer.py
+
+📌 Función principal:
+    Síntesis de reglas Suricata por columnas para un lote de anomalías: reglas de escaneo de puertos,
+    contextuales (perfil del src_ip) y por evento. Sustituye a los tres recorridos `iterrows()` de
+    generate_rules.py y a la antigua generate_rule() fila a fila (pd.to_numeric, ipaddress y SHA-256 por
+    fila). La salida es la misma, en el mismo orden.
+
+⚙️ Cómo funciona:
+    - Tipados, acción (drop/alert), claves y filtros de política se calculan sobre columnas completas.
+    - La normalización de IPs (ipaddress) y de src_port se hace una vez por valor distinto
+      (pd.factorize) y se reparte con un índice.
+    - La deduplicación por (src_ip, dest_ip, dest_port) y por patrón base de la regla es vectorizada
+      (duplicated / isin), reproduciendo el orden de prioridad del recorrido secuencial.
+    - Sólo el SHA-256 del SID y el formateo final de cadenas siguen siendo por fila (listas por
+      comprensión sobre arreglos, sin Series por fila).
+    - Diferencia deliberada: severidad/longitud no numéricas cuentan como 0. Antes, int(NaN) lanzaba una
+      excepción que abortaba el lote entero.
+
+🔗 Usado por:
+    - generate_rules.py → process_batch()
+
+🧪 Uso:
+    python rule_renderer.py --bench 100000
+"""
+import hashlib
+import ipaddress
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+SCAN_MIN_PORTS = 10       # más de N src_port distintos desde un origen → regla de escaneo
+CONTEXT_MIN_EVENTS = 10   # más de N eventos en el perfil del origen → regla contextual por rango de puertos
+
+
+def _normalize_ip(value):
+    try:
+        return str(ipaddress.ip_address(value))
+    except Exception:
+        return None
+
+
+def _src_port(value):
+    """Igual que la antigua generate_rule: 0/None → "any"; NaN o no convertible → None (sin regla)."""
+    try:
+        return str(int(value)) if value else "any"
+    except Exception:
+        return None
+
+
+def map_unique(values, fn) -> np.ndarray:
+    """fn aplicada una vez por valor distinto (NaN incluido), alineada con `values` (dtype object)."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    mapped = np.array([fn(u) for u in uniques] + [fn(np.nan)], dtype=object)
+    return mapped[codes]  # código -1 (NaN) → último elemento
+
+
+def _sha_mod(strings, mod):
+    return np.fromiter((int(hashlib.sha256(s.encode()).hexdigest(), 16) % mod for s in strings),
+                       dtype=np.int64, count=len(strings))
+
+
+def _column(df, name, default):
+    return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+
+def scan_rules(anomalies, rule_patterns) -> list:
+    """Reglas `alert ip <src> any -> any any` para orígenes con más de SCAN_MIN_PORTS src_port distintos."""
+    sport = anomalies["src_port"]
+    # Como el set() del recorrido original: valores iguales cuentan una vez, cada NaN cuenta aparte
+    frame = pd.DataFrame({"src": anomalies["src_ip"].to_numpy(), "port": sport.to_numpy(), "nan": sport.isna().to_numpy()})
+    grouped = frame.groupby("src", sort=False)
+    distinct = grouped["port"].nunique() + grouped["nan"].sum()
+    rules = []
+    for ip in distinct.index[distinct.to_numpy() > SCAN_MIN_PORTS]:
+        ip_str = _normalize_ip(ip)
+        if ip_str is None:
+            print(f"[RR] ⚠ Error generando regla para IP {ip}: dirección no válida")
+            continue
+        rule_base = f"alert ip {ip_str} any -> any any"
+        if rule_base not in rule_patterns:
+            sid = 2000000 + int(hashlib.sha256(ip_str.encode()).hexdigest(), 16) % 900000
+            rules.append(f'{rule_base} (msg:"Detected port scanning activity from {ip_str}"; sid:{sid}; rev:1;)')
+            rule_patterns.add(rule_base)
+            print(f"[RR] 🚨 Regla de escaneo añadida para {ip_str}")
+    return rules
+
+
+def contextual_rules(anomalies, profiles, existing_rules) -> list:
+    """Reglas por rango de puertos del perfil del origen (mismo texto y SID que la antigua generate_contextual_rule)."""
+    src = anomalies["src_ip"].map(str)  # str() como hacía generate_contextual_rule (NaN → "nan")
+    codes, uniques = pd.factorize(src)
+    found = [profiles.get(u) for u in uniques]
+    count = np.array([p["count"] if p else 0 for p in found], dtype=np.int64)[codes]
+    mask = count > CONTEXT_MIN_EVENTS
+    if not mask.any():
+        return []
+    pmin = np.array([p["port_min"] if p else 0 for p in found], dtype=np.int64)[codes][mask]
+    pmax = np.array([p["port_max"] if p else 0 for p in found], dtype=np.int64)[codes][mask]
+    src_m = src[mask]
+    proto = anomalies["proto"].map(str)[mask]
+    dport = anomalies["dest_port"].map(str)[mask]
+    sid = 3000000 + _sha_mod((src_m + "-" + dport + "-" + proto).tolist(), 900000)
+    rules = ("alert " + proto + " " + src_m + " any -> any " + pd.Series(pmin, index=src_m.index).astype(str) + ":"
+             + pd.Series(pmax, index=src_m.index).astype(str) + ' (msg:"Suspicious port range access from '
+             + src_m + '"; sid:' + pd.Series(sid, index=src_m.index).astype(str) + ";)")
+    return [r for r in rules.tolist() if r not in existing_rules]
+
+
+def event_rules(anomalies, policy, thr, existing_rules, rule_patterns) -> list:
+    """Una regla por (src_ip, dest_ip, dest_port), igual que la antigua generate_rule(); actualiza rule_patterns."""
+    src_raw, dst_raw = anomalies["src_ip"], anomalies["dest_ip"]
+    dport = pd.to_numeric(anomalies["dest_port"], errors="coerce").fillna(0).astype(np.int64).to_numpy()
+    proto = _column(anomalies, "proto", "").map(str).str.lower().to_numpy(dtype=object)
+    src = map_unique(src_raw, _normalize_ip)
+    dst = map_unique(dst_raw, _normalize_ip)
+    sport = map_unique(_column(anomalies, "src_port", 0), _src_port)
+
+    ok = np.array(src_raw.notna() & dst_raw.notna() & ~anomalies.duplicated(["src_ip", "dest_ip", "dest_port"]),
+                  dtype=bool)
+    ok &= np.isin(proto, ["tcp", "udp"]) & (dport > 0)
+    ok &= pd.notna(src) & pd.notna(dst) & pd.notna(sport)
+    if ok.any():
+        ok[ok] = ~(policy.is_allowed(dst[ok]) | policy.is_ignored(dport[ok]))
+    if not ok.any():
+        return []
+
+    sel = np.flatnonzero(ok)
+    src, dst, sport, proto, dport = src[sel], dst[sel], sport[sel], proto[sel], dport[sel]
+    sev = pd.to_numeric(_column(anomalies, "alert_severity", 0), errors="coerce").fillna(0).astype(np.int64).to_numpy()[sel]
+    pkt = pd.to_numeric(_column(anomalies, "packet_length", 0), errors="coerce").fillna(0).astype(np.int64).to_numpy()[sel]
+    score = pd.to_numeric(_column(anomalies, "anomaly_score", 0.0), errors="coerce").to_numpy(dtype=np.float64)[sel]
+    should_drop = _column(anomalies, "should_drop", False).astype(bool).to_numpy()[sel]
+    should_drop &= ~policy.is_alert_only(dport)
+    action = np.where(should_drop & (score < thr), "drop", "alert").astype(object)
+
+    # Cadenas por columnas; round()/format sobre floats de Python para reproducir exactamente el texto
+    score_py = score.tolist()
+    dport_s = dport.astype(str).astype(object)
+    sev_s = sev.astype(str).astype(object)
+    pkt_s = pkt.astype(str).astype(object)
+    uid = src + "-" + dst + "-" + proto + "-" + dport_s + "-" + sev_s + "-" + pkt_s + "-" \
+        + np.array([str(round(x, 3)) for x in score_py], dtype=object)
+    sid = 3000000 + _sha_mod(uid.tolist(), 500000)
+    base = action + " " + proto + " " + src + " " + sport + " -> " + dst + " " + dport_s
+    msg = np.array([f"{x:.2f}" for x in score_py], dtype=object)
+    rules = base + ' (msg:"ML anomaly (score: ' + msg + ", len: " + pkt_s + ", severity: " + sev_s \
+        + f', thr: {thr:.2f})"; sid:' + sid.astype(str).astype(object) + "; rev:1;)"
+
+    # Patrón base no visto y regla no existente; entre las restantes, la primera por patrón base
+    base_s, rules_s = pd.Series(base), pd.Series(rules)
+    keep = np.array(~base_s.isin(rule_patterns) & ~rules_s.isin(existing_rules), dtype=bool)
+    keep[keep] = ~base_s[keep].duplicated().to_numpy()
+    rule_patterns.update(base[keep].tolist())
+    return rules[keep].tolist()
+
+
+def render_rules(anomalies, policy, thr, existing_rules, rule_patterns, profiles=None) -> list:
+    """Reglas nuevas para un lote de anomalías (ya filtradas, deduplicadas y ordenadas por score):
+    escaneo + contextuales + por evento, en ese orden. Añade a `rule_patterns` los patrones usados."""
+    scan = scan_rules(anomalies, rule_patterns)
+    context = contextual_rules(anomalies, profiles, existing_rules) if profiles is not None and len(profiles) else []
+    events = event_rules(anomalies, policy, thr, existing_rules, rule_patterns)
+    print(f"[RR] ➕ Reglas nuevas: {len(scan)} de escaneo, {len(context)} contextuales, {len(events)} por evento")
+    return scan + context + events
+
+
+def synthetic_anomalies(n, seed=0) -> pd.DataFrame:
+    """Lote sintético con la forma de `anomalies` en generate_rules (benchmark)."""
+    rng = np.random.default_rng(seed)
+    src = np.array([f"10.{a}.{b}.{c}" for a, b, c in rng.integers(0, 40, (n, 3))], dtype=object)
+    dst = np.array([f"192.168.{a}.{b}" for a, b in rng.integers(0, 60, (n, 2))], dtype=object)
+    df = pd.DataFrame({
+        "_id": np.arange(n),
+        "src_ip": src,
+        "dest_ip": dst,
+        "proto": rng.choice(["TCP", "UDP", "ICMP"], n, p=[0.6, 0.35, 0.05]),
+        "src_port": rng.integers(1024, 65535, n).astype(float),
+        "dest_port": rng.choice([22, 53, 80, 443, 3389, 8080, 445, 23], n),
+        "alert_severity": rng.integers(0, 4, n),
+        "packet_length": rng.integers(40, 1500, n),
+        "anomaly_score": rng.normal(-0.1, 0.05, n),
+        "should_drop": rng.random(n) < 0.3,
+    })
+    df.loc[rng.random(n) < 0.01, "src_port"] = np.nan
+    return df.sort_values("anomaly_score").drop_duplicates(["proto", "src_ip", "dest_ip", "dest_port"], keep="first")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        from ip_policy import load_policy
+
+        n = int(sys.argv[sys.argv.index("--bench") + 1]) if len(sys.argv) > sys.argv.index("--bench") + 1 else 100000
+        df = synthetic_anomalies(n)
+        t0 = time.perf_counter()
+        out = render_rules(df, load_policy(), -0.05, set(), set())
+        dt = time.perf_counter() - t0
+        print(f"[RR] ⏱ {len(df)} anomalías → {len(out)} reglas en {dt:.3f}s ({dt / len(df) * 1e6:.1f} µs/anomalía)")
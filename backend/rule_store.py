@@ -0,0 +1,465 @@
+"""
+rule_store.py
+
+📌 Función principal:
+    Almacén de reglas Suricata en SQLite (embebido, sin servicios nuevos) indexado por SID y por patrón
+    base de la regla (la parte anterior a "("). Sustituye al parseo completo de sml.rules en cada ejecución
+    (load_existing_rules) y a las reescrituras completas del archivo en generate_rules.py y en
+    routes.toggle_rule. sml.rules pasa a ser una vista publicada del almacén.
+
+⚙️ Cómo funciona:
+    - Tabla `rules` (id de inserción, sid único, base indexado, texto único, enabled, origen, fechas).
+      Las reglas nuevas se añaden con INSERT OR IGNORE: nunca se reescriben las existentes.
+    - Deduplicación O(1): `rules` y `patterns` son conjuntos en memoria (texto y patrón base de todas las
+      reglas, activas o no). Se cargan una vez y se actualizan con cada inserción; refresh() sólo los
+      recarga si otra conexión escribió (PRAGMA data_version no cambia con las escrituras propias).
+    - Un único escritor: flock sobre `<db>.lock` alrededor de cada escritura y publicación (API y servicio
+      de reglas corren en contenedores distintos), además de BEGIN IMMEDIATE en SQLite.
+    - publish() genera sml.rules (manuales, reglas del modelo compactadas por rule_compactor.py y
+      desactivadas con "#", en orden de inserción) y sólo lo escribe si cambia su SHA-256: archivo temporal
+      + fsync + os.replace + fsync del directorio, así Suricata nunca lee un archivo a medias. Si no cambió
+      la generación de las reglas (contador en `meta`, sube con cada escritura) ni la política, ni siquiera
+      lo genera; la compactación se cachea y se hace fuera del flock.
+    - Ediciones a mano: si sml.rules no coincide con la última publicación (tamaño/mtime), se adopta antes
+      de volver a publicar. Reglas nuevas → origen "manual"; SID conocido con otro texto → se guarda el
+      texto nuevo como "manual"; comentar/descomentar → desactivar/activar (en una regla de grupo, todas sus
+      reglas fundidas); línea borrada → la regla se desactiva (o se elimina si ya estaba desactivada).
+      La tabla `published` dice qué línea representaba cada regla. La primera vez importa así el archivo.
+
+🔗 Usado por:
+    - generate_rules.py → load_existing_rules(), add() por lote y publish() antes de recargar Suricata
+    - routes.py         → set_enabled() + publish() en PUT /rules/{sid}/{status} y PUT /rules/{status}
+
+🧪 Uso:
+    python rule_store.py            # resumen del almacén
+    python rule_store.py --publish  # fuerza la publicación de sml.rules
+"""
+import fcntl
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from constants import RULE_STORE_DB, RULES_COMPACT, RULES_FILE
+
+COMPACTED_MARKER = "metadata:sml compacted;"
+SID_RE = re.compile(r"sid:\s*(\d+)\s*;")
+HEADER = "# sml.rules: generado desde rule_store.py (las ediciones a mano se adoptan en la siguiente publicación)\n"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    id         INTEGER PRIMARY KEY,
+    sid        INTEGER NOT NULL UNIQUE,
+    base       TEXT    NOT NULL,
+    rule       TEXT    NOT NULL UNIQUE,
+    enabled    INTEGER NOT NULL DEFAULT 1,
+    source     TEXT    NOT NULL DEFAULT 'ml',
+    created_at REAL    NOT NULL,
+    updated_at REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rules_base ON rules (base);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+-- Última publicación: qué línea de sml.rules (line_sid) representa cada regla (sid); las reglas fundidas
+-- por rule_compactor.py apuntan al SID de su regla de grupo
+CREATE TABLE IF NOT EXISTS published (
+    line_sid INTEGER NOT NULL,
+    sid      INTEGER NOT NULL,
+    PRIMARY KEY (line_sid, sid)
+);
+CREATE INDEX IF NOT EXISTS published_sid ON published (sid);
+CREATE TABLE IF NOT EXISTS published_lines (line_sid INTEGER PRIMARY KEY, line TEXT NOT NULL);
+-- Reglas de cada regla de grupo publicada alguna vez: su SID sigue sirviendo para activar/desactivar
+-- sus reglas aunque ya no aparezca en sml.rules (p. ej. tras desactivarla)
+CREATE TABLE IF NOT EXISTS groups (
+    group_sid INTEGER NOT NULL,
+    sid       INTEGER NOT NULL,
+    PRIMARY KEY (group_sid, sid)
+);
+"""
+
+
+def parse_rule(line):
+    """(sid, base, regla sin "#", enabled) de una línea de sml.rules; None si no es una regla con sid
+    (o si es una regla de grupo de rule_compactor.py, que se regenera en cada publicación)."""
+    line = line.strip()
+    if COMPACTED_MARKER in line:
+        return None
+    enabled = not line.startswith("#")
+    rule = line.lstrip("#").strip()
+    match = SID_RE.search(rule)
+    if not rule or "(" not in rule or match is None:
+        return None
+    return int(match.group(1)), rule.split("(")[0].strip(), rule, enabled
+
+
+def _chunks(sids, size=500):
+    """Trozos de `sids` dentro del límite de variables por sentencia de SQLite."""
+    for i in range(0, len(sids), size):
+        yield sids[i:i + size]
+
+
+class RuleStore:
+    """Reglas indexadas por SID y patrón base, con sml.rules publicado de forma atómica."""
+
+    def __init__(self, path=RULE_STORE_DB, rules_file=RULES_FILE, policy=None, compact=RULES_COMPACT):
+        self.path = path
+        self.rules_file = rules_file
+        self._policy = policy
+        self.compact = compact
+        self.last_compaction = None
+        self.rules = set()
+        self.patterns = set()
+        self._conn = None
+        self._version = None
+        self._mutex = threading.RLock()  # hilos del mismo proceso (publish() va a un hilo desde la API)
+        self._compaction_cache = None
+
+    # ── Conexión y bloqueo ───────────────────────────────────────────────
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # autocommit: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _writer(self):
+        """Escritor único entre procesos (flock) + transacción SQLite."""
+        with self._mutex, open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self.conn
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                self.conn.execute("COMMIT")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @property
+    def policy(self):
+        if self._policy is None:
+            from ip_policy import load_policy
+
+            self._policy = load_policy()
+        return self._policy
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _bump(self, conn):
+        """Generación del contenido de `rules`: publish() no vuelve a generar sml.rules si no cambió."""
+        conn.execute("INSERT INTO meta (key, value) VALUES ('generation', '1') "
+                     "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def _publish_key(self):
+        ports = ",".join(str(p) for p in sorted(self.policy.alert_only_ports)) if self.compact else ""
+        return f"{self._meta('generation') or 0}|{int(bool(self.compact))}|{ports}"
+
+    def _data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # ── Lectura ──────────────────────────────────────────────────────────
+    def load(self):
+        """Adopta ediciones a mano de sml.rules y carga los índices de deduplicación."""
+        self._adopt_file()
+        self.rules, self.patterns = set(), set()
+        for base, rule in self.conn.execute("SELECT base, rule FROM rules"):
+            self.rules.add(rule)
+            self.patterns.add(base)
+        self._version = self._data_version()
+        print(f"[RS] 📖 Almacén de reglas cargado: {len(self.rules)} reglas")
+        return self
+
+    def refresh(self):
+        """Recarga los índices sólo si otro proceso escribió desde la última lectura (o si nunca se cargaron)."""
+        if self._version is None or self._data_version() != self._version or self._file_changed():
+            self.load()
+        return self
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM rules").fetchone()[0]
+
+    def get(self, sid):
+        row = self.conn.execute("SELECT sid, rule, enabled, source FROM rules WHERE sid = ?", (int(sid),)).fetchone()
+        return None if row is None else {"sid": row[0], "rule": row[1], "enabled": bool(row[2]), "source": row[3]}
+
+    # ── Escritura ────────────────────────────────────────────────────────
+    def add(self, rules, source="ml") -> int:
+        """Inserta las reglas que no existan (por texto o SID). Devuelve cuántas se añadieron."""
+        now = time.time()
+        added, conflicts = 0, 0
+        with self._writer() as conn:
+            for rule in rules:
+                parsed = parse_rule(rule)
+                if parsed is None:
+                    continue
+                sid, base, text, enabled = parsed
+                cur = conn.execute("INSERT OR IGNORE INTO rules (sid, base, rule, enabled, source, created_at, updated_at) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", (sid, base, text, int(enabled), source, now, now))
+                if cur.rowcount:
+                    added += 1
+                    self.rules.add(text)
+                    self.patterns.add(base)
+                elif text not in self.rules:
+                    conflicts += 1  # mismo SID que otra regla: Suricata rechazaría el duplicado
+            if added:
+                self._bump(conn)
+        if conflicts:
+            print(f"[RS] ⚠ {conflicts} reglas descartadas por SID ya usado por otra regla")
+        return added
+
+    def group_members(self, sid) -> list:
+        """SIDs de las reglas que cubre una regla de grupo (`metadata:sml compacted`); [] si no lo es."""
+        return [row[0] for row in self.conn.execute("SELECT sid FROM groups WHERE group_sid = ? ORDER BY sid",
+                                                    (int(sid),))]
+
+    def set_enabled(self, sids, enabled) -> int:
+        """Activa/desactiva en bloque por SID. Devuelve cuántas reglas existían.
+
+        El SID de una regla de grupo (sólo existe en sml.rules, ver `groups`) se aplica a todas las reglas que
+        cubre y cuenta como una regla encontrada."""
+        sids = [int(s) for s in sids]
+        found = changed = 0
+        with self._writer() as conn:
+            groups = {}
+            for chunk in _chunks(sids):
+                marks = ",".join("?" * len(chunk))
+                for group_sid, sid in conn.execute(f"SELECT group_sid, sid FROM groups WHERE group_sid IN ({marks})",
+                                                   chunk):
+                    groups.setdefault(group_sid, []).append(sid)
+            found = len(groups)
+            sids = [sid for sid in sids if sid not in groups]
+            for chunk in _chunks(sids):
+                marks = ",".join("?" * len(chunk))
+                found += conn.execute(f"SELECT COUNT(*) FROM rules WHERE sid IN ({marks})", chunk).fetchone()[0]
+            for chunk in _chunks(sids + [sid for members in groups.values() for sid in members]):
+                marks = ",".join("?" * len(chunk))
+                changed += conn.execute(f"UPDATE rules SET enabled = ?, updated_at = ? WHERE sid IN ({marks}) "
+                                        "AND enabled != ?", [int(enabled), time.time(), *chunk, int(enabled)]).rowcount
+            if changed:
+                self._bump(conn)
+        return found
+
+    # ── sml.rules ────────────────────────────────────────────────────────
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.rules_file)
+            return f"{st.st_mtime_ns}:{st.st_size}"
+        except FileNotFoundError:
+            return None
+
+    def _file_changed(self):
+        stamp = self._file_stamp()
+        return stamp is not None and stamp != self._meta("published_stamp")
+
+    def _read_file(self):
+        """({sid: (base, texto, enabled)} de las reglas, {sid: enabled} de las reglas de grupo) de sml.rules."""
+        rules, groups = {}, {}
+        with open(self.rules_file, "r") as f:
+            for line in f:
+                if COMPACTED_MARKER in line:
+                    match = SID_RE.search(line)
+                    if match:
+                        groups[int(match.group(1))] = not line.strip().startswith("#")
+                    continue
+                parsed = parse_rule(line)
+                if parsed is not None:
+                    sid, base, text, enabled = parsed
+                    rules[sid] = (base, text, enabled)
+        return rules, groups
+
+    def _adopt_file(self) -> bool:
+        """Incorpora un sml.rules no publicado por el almacén (primer uso o edición a mano). Devuelve si cambió algo."""
+        if not self._file_changed():
+            return False
+        now = time.time()
+        counts = dict.fromkeys(("added", "edited", "toggled", "disabled", "deleted"), 0)
+        with self._writer() as conn:
+            if not self._file_changed():  # otro proceso lo adoptó mientras se esperaba el bloqueo
+                return False
+            file_rules, file_groups = self._read_file()
+            stored = {sid: (rule, bool(enabled)) for sid, rule, enabled in conn.execute("SELECT sid, rule, enabled FROM rules")}
+            # Texto publicado de cada línea: una regla que el compactador reescribió (puerto origen → any)
+            # conserva su SID y no es una edición a mano mientras su texto siga igual
+            published = {sid: line.lstrip("#").strip() for sid, line in conn.execute("SELECT line_sid, line FROM published_lines")}
+            for sid, (base, text, enabled) in file_rules.items():
+                try:
+                    if sid in stored and published.get(sid) == text:
+                        if stored[sid][1] != enabled:
+                            conn.execute("UPDATE rules SET enabled = ?, updated_at = ? WHERE sid = ?", (int(enabled), now, sid))
+                            counts["toggled"] += 1
+                    elif sid not in stored:
+                        conn.execute("INSERT INTO rules (sid, base, rule, enabled, source, created_at, updated_at) "
+                                     "VALUES (?, ?, ?, ?, 'manual', ?, ?)", (sid, base, text, int(enabled), now, now))
+                        counts["added"] += 1
+                    elif stored[sid][0] != text:
+                        conn.execute("UPDATE rules SET rule = ?, base = ?, enabled = ?, source = 'manual', updated_at = ? "
+                                     "WHERE sid = ?", (text, base, int(enabled), now, sid))
+                        counts["edited"] += 1
+                        print(f"[RS] ✏ Regla {sid} editada a mano: se adopta el texto nuevo como regla manual")
+                    elif stored[sid][1] != enabled:
+                        conn.execute("UPDATE rules SET enabled = ?, updated_at = ? WHERE sid = ?", (int(enabled), now, sid))
+                        counts["toggled"] += 1
+                except sqlite3.IntegrityError:
+                    print(f"[RS] ⚠ Regla {sid} de sml.rules ignorada: su texto ya existe con otro SID")
+
+            # Reglas publicadas cuya línea se comentó (reglas de grupo) o se borró
+            lines = {}
+            for line_sid, sid in conn.execute("SELECT line_sid, sid FROM published"):
+                lines.setdefault(sid, []).append(line_sid)
+            present = {sid: enabled for sid, (_, _, enabled) in file_rules.items()}
+            present.update(file_groups)
+            for sid, line_sids in lines.items():
+                if sid in file_rules or sid not in stored:
+                    continue
+                seen = [present[l] for l in line_sids if l in present]
+                if not seen and not stored[sid][1]:
+                    conn.execute("DELETE FROM rules WHERE sid = ?", (sid,))
+                    counts["deleted"] += 1
+                elif stored[sid][1] and (not seen or not all(seen)):
+                    conn.execute("UPDATE rules SET enabled = 0, updated_at = ? WHERE sid = ?", (now, sid))
+                    counts["disabled"] += 1
+            # Adoptado: no se vuelve a leer hasta que cambie de nuevo (publish() lo reescribe si hace falta)
+            self._set_meta("published_stamp", self._file_stamp())
+            self._set_meta("published_sha", None)
+            self._set_meta("published_key", None)
+            changed = any(counts.values())
+            if changed:
+                self._bump(conn)
+        if changed:
+            print(f"[RS] 📥 sml.rules adoptado: {counts['added']} reglas nuevas, {counts['edited']} editadas, "
+                  f"{counts['toggled']} cambios de estado, {counts['disabled']} desactivadas por línea comentada o "
+                  f"borrada, {counts['deleted']} eliminadas")
+        return changed
+
+    def render(self):
+        """(contenido de sml.rules, pares (line_sid, sid)): reglas manuales activas, reglas del modelo
+        (compactadas si RULES_COMPACT) y reglas desactivadas comentadas."""
+        manual, generated, disabled, sids = [], [], [], []
+        for rule, enabled, source, sid in self.conn.execute("SELECT rule, enabled, source, sid FROM rules ORDER BY id"):
+            sids.append(sid)
+            if not enabled:
+                disabled.append(f"#{rule}")
+            else:
+                (manual if source == "manual" else generated).append(rule)
+        groups = {}
+        if self.compact and generated:
+            from rule_compactor import compact_rules
+
+            # Caché de la última compactación: activar/desactivar reglas manuales o volver a publicar sin cambios
+            # en las reglas del modelo no vuelve a compactar
+            key = hashlib.sha256("\n".join(generated + [str(sorted(self.policy.alert_only_ports)),
+                                                         str(len(sids)), str(sum(sids))]).encode()).hexdigest()
+            if self._compaction_cache is not None and self._compaction_cache[0] == key:
+                _, generated, groups = self._compaction_cache
+            else:
+                generated, self.last_compaction, groups = compact_rules(generated, self.policy.alert_only_ports,
+                                                                        used_sids=sids)
+                self._compaction_cache = (key, generated, groups)
+                print(f"[RS] 🗜 Reglas del modelo compactadas: {self.last_compaction['before']} → "
+                      f"{self.last_compaction['after']} en {self.last_compaction['seconds']:.3f}s")
+        else:
+            self.last_compaction = {"before": len(generated), "after": len(generated), "demoted": 0, "seconds": 0.0}
+        lines = manual + generated + disabled
+        mapping = []
+        for line in lines:
+            line_sid = int(SID_RE.search(line).group(1))
+            mapping.extend((line_sid, sid) for sid in groups.get(line_sid, (line_sid,)))
+        return HEADER + "".join(f"{line}\n" for line in lines), mapping
+
+    def publish(self, force=False) -> bool:
+        """Escribe sml.rules de forma atómica si su contenido cambió. Devuelve si se escribió.
+
+        Sin cambios en las reglas (generación), la política ni el archivo, vuelve sin generar nada. El archivo se
+        genera fuera del flock sobre una instantánea de lectura; si otro proceso escribió entre medias, se
+        repite. Llamadas desde código async: asyncio.to_thread(store.publish)."""
+        with self._mutex:
+            if self._adopt_file():
+                self.load()
+            while True:
+                if not force and not self._file_changed() and self._publish_key() == self._meta("published_key"):
+                    return False
+                self.conn.execute("BEGIN")
+                try:
+                    key = self._publish_key()
+                    content, mapping = self.render()
+                finally:
+                    self.conn.execute("COMMIT")
+                content = content.encode()
+                digest = hashlib.sha256(content).hexdigest()
+                with self._writer() as conn:
+                    if self._publish_key() != key:
+                        continue  # otro proceso cambió las reglas mientras se generaba
+                    if not force and digest == self._meta("published_sha") and not self._file_changed():
+                        self._set_meta("published_key", key)
+                        return False
+                    self._write_file(content)
+                    # Sólo las filas que cambiaron: reescribir ~100k filas en cada publicación tenía el flock segundos
+                    self._sync_table("published", ("line_sid", "sid"), set(mapping))
+                    self._sync_table("published_lines", ("line_sid", "line"),
+                                     {(int(m.group(1)), line) for line in content.decode().splitlines()
+                                      if (m := SID_RE.search(line))})
+                    # Un SID de grupo reutilizado sustituye al grupo anterior; se olvidan las reglas borradas
+                    members = [(line_sid, sid) for line_sid, sid in mapping if line_sid != sid]
+                    conn.executemany("DELETE FROM groups WHERE group_sid = ?", {(g,) for g, _ in members})
+                    conn.executemany("INSERT OR IGNORE INTO groups (group_sid, sid) VALUES (?, ?)", members)
+                    conn.execute("DELETE FROM groups WHERE sid NOT IN (SELECT sid FROM rules)")
+                    self._set_meta("published_sha", digest)
+                    self._set_meta("published_stamp", self._file_stamp())
+                    self._set_meta("published_key", key)
+                print(f"[RS] 📝 sml.rules publicado ({len(content)} bytes, sha256 {digest[:12]})")
+                return True
+
+    def _sync_table(self, table, columns, rows):
+        """Deja en `table` exactamente las filas `rows` (conjunto de tuplas), tocando sólo las diferencias."""
+        cols = ", ".join(columns)
+        current = set(self.conn.execute(f"SELECT {cols} FROM {table}"))
+        where = " AND ".join(f"{c} = ?" for c in columns)
+        self.conn.executemany(f"DELETE FROM {table} WHERE {where}", current - rows)
+        self.conn.executemany(f"INSERT OR REPLACE INTO {table} ({cols}) VALUES ({', '.join('?' * len(columns))})",
+                              rows - current)
+
+    def _write_file(self, content):
+        """Archivo temporal + fsync + os.replace + fsync del directorio."""
+        directory = os.path.dirname(self.rules_file) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.rules_file}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.rules_file)
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def summary(self) -> dict:
+        enabled, total = self.conn.execute("SELECT COALESCE(SUM(enabled), 0), COUNT(*) FROM rules").fetchone()
+        by_source = dict(self.conn.execute("SELECT source, COUNT(*) FROM rules GROUP BY source").fetchall())
+        return {"rules": total, "enabled": enabled, "disabled": total - enabled, "by_source": by_source,
+                "published_sha": self._meta("published_sha"), "last_compaction": self.last_compaction}
+
+
+if __name__ == "__main__":
+    store = RuleStore().load()
+    if "--publish" in sys.argv:
+        store.publish(force=True)
+    print(store.summary())
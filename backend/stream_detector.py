@@ -0,0 +1,216 @@
+"""
+stream_detector.py
+
+📌 Función principal:
+    Detector de anomalías en línea (Half-Space Trees, Tan et al. 2011) que puntúa y aprende cada evento
+    en tiempo constante al ingresar, complementando al Isolation Forest por lotes de generate_rules.py.
+
+⚙️ Cómo funciona:
+    - T árboles binarios completos de profundidad D sobre el espacio de features normalizado a [0, 1].
+      Cada nodo corta una dimensión aleatoria por la mitad de su rango de trabajo (espacio aleatorizado).
+    - Cada árbol guarda dos perfiles de masa por nodo: `ref` (ventana anterior) y `latest` (ventana en curso).
+      Al completar `window` eventos, latest pasa a ser ref y se reinicia.
+    - Score de un evento por árbol: ref[nodo] · 2^profundidad, en el nodo más profundo del camino con masa
+      suficiente (>= size_limit). anomaly_score = 1 - media_t(log2(1 + score_t)) / log2(1 + window · 2^D),
+      en [0, 1] (1 = más anómalo; masa cero en la raíz de todos los árboles → 1).
+    - Coste por evento: O(T · D) sin depender del histórico; todos los árboles avanzan a la vez (numpy).
+
+📦 Estado:
+    Acotado y fijo: 2 · T · (2^(D+1) - 1) contadores + los cortes. snapshot()/load() lo guardan en
+    STREAM_DETECTOR_STATE (.npz, archivo temporal + os.replace) para sobrevivir reinicios.
+
+🔗 Usado por:
+    - suricata_to_mongo.py → `stream_score` / `stream_anomaly` en cada evento insertado
+"""
+import math
+import os
+import time
+import zlib
+
+import numpy as np
+
+from constants import (
+    STREAM_DETECTOR_STATE,
+    STREAM_TREES,
+    STREAM_DEPTH,
+    STREAM_WINDOW,
+    STREAM_ANOMALY_THRESHOLD,
+)
+
+FEATURES = ["src_port", "dest_port", "packet_length", "alert_severity", "proto", "hour"]
+_PROTO_CODES = {"TCP": 0.2, "UDP": 0.4, "ICMP": 0.6, "IPV6-ICMP": 0.8}
+_LOG_MAX_LEN = math.log1p(65535)
+
+
+def event_features(event) -> np.ndarray:
+    """Vector en [0, 1] calculado sólo con los campos del propio evento (O(1))."""
+    def num(key):
+        try:
+            return float(event.get(key) or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    proto = str(event.get("proto", "")).upper()
+    proto_code = _PROTO_CODES.get(proto)
+    if proto_code is None:
+        proto_code = (zlib.crc32(proto.encode()) % 1000) / 1000.0
+    ts = str(event.get("timestamp", ""))
+    hour = int(ts[11:13]) if len(ts) >= 13 and ts[11:13].isdigit() else 0
+    return np.array([
+        min(num("src_port"), 65535.0) / 65535.0,
+        min(num("dest_port"), 65535.0) / 65535.0,
+        math.log1p(min(max(num("packet_length"), 0.0), 65535.0)) / _LOG_MAX_LEN,
+        min(max(num("alert_severity"), 0.0), 4.0) / 4.0,
+        proto_code,
+        hour / 23.0,
+    ])
+
+
+class HalfSpaceTrees:
+    """Half-Space Trees con perfiles de masa en arreglos (T × nodos)."""
+
+    def __init__(self, n_features=len(FEATURES), n_trees=STREAM_TREES, depth=STREAM_DEPTH,
+                 window=STREAM_WINDOW, size_limit=None, seed=42):
+        self.n_features = n_features
+        self.n_trees = n_trees
+        self.depth = depth
+        self.window = window
+        self.size_limit = size_limit if size_limit is not None else max(1, int(0.1 * window))
+        n_internal = 2 ** depth - 1
+        n_nodes = 2 ** (depth + 1) - 1
+        rng = np.random.default_rng(seed)
+
+        # Espacio de trabajo aleatorizado por árbol: [s - r, s + r] con r = 2·max(s, 1 - s)
+        s = rng.random((n_trees, n_features))
+        r = 2 * np.maximum(s, 1 - s)
+        lo = np.zeros((n_trees, n_internal, n_features))
+        hi = np.zeros((n_trees, n_internal, n_features))
+        lo[:, 0], hi[:, 0] = s - r, s + r
+        self.split_feature = rng.integers(0, n_features, size=(n_trees, n_internal)).astype(np.int32)
+        self.split_value = np.zeros((n_trees, n_internal))
+        t_idx = np.arange(n_trees)
+        for node in range(n_internal):
+            q = self.split_feature[:, node]
+            mid = (lo[t_idx, node, q] + hi[t_idx, node, q]) / 2
+            self.split_value[:, node] = mid
+            left, right = 2 * node + 1, 2 * node + 2
+            if left < n_internal:
+                lo[:, left], hi[:, left] = lo[:, node], hi[:, node]
+                hi[t_idx, left, q] = mid
+                lo[:, right], hi[:, right] = lo[:, node], hi[:, node]
+                lo[t_idx, right, q] = mid
+
+        self.ref = np.zeros((n_trees, n_nodes), dtype=np.int32)
+        self.latest = np.zeros((n_trees, n_nodes), dtype=np.int32)
+        self.seen = 0
+        self.windows = 0
+        self._init_index()
+
+    def _init_index(self):
+        n_internal = self.split_feature.shape[1]
+        n_nodes = self.ref.shape[1]
+        self._feat_flat = self.split_feature.ravel()
+        self._value_flat = self.split_value.ravel()
+        self._internal_base = np.arange(self.n_trees, dtype=np.int64) * n_internal
+        self._node_base = (np.arange(self.n_trees, dtype=np.int64) * n_nodes)[:, None]
+        self._tree_idx = np.arange(self.n_trees)
+        self._depth_weight = 2.0 ** np.arange(self.depth + 1)
+        self._log_max = math.log2(1.0 + self.window * 2.0 ** self.depth)
+
+    def _paths(self, x):
+        """Índices planos (en ref/latest) de los nodos visitados por cada árbol (T × (D+1))."""
+        path = np.zeros((self.n_trees, self.depth + 1), dtype=np.int64)
+        node = np.zeros(self.n_trees, dtype=np.int64)
+        for d in range(self.depth):
+            idx = self._internal_base + node
+            go_right = x.take(self._feat_flat.take(idx)) > self._value_flat.take(idx)
+            node = 2 * node + 1 + go_right
+            path[:, d + 1] = node
+        return path + self._node_base
+
+    def _score_path(self, path):
+        if self.windows == 0:
+            return None
+        mass = self.ref.reshape(-1).take(path)
+        # Nodo más profundo con masa >= size_limit (la raíz siempre cuenta)
+        ok = mass >= self.size_limit
+        ok[:, 0] = True
+        k = self.depth - np.argmax(ok[:, ::-1], axis=1)
+        per_tree = mass[self._tree_idx, k] * self._depth_weight[k]
+        return 1.0 - float(np.log2(1.0 + per_tree).mean()) / self._log_max
+
+    def score_learn(self, x, learn=True):
+        """anomaly_score del evento (None durante la primera ventana) y actualización del modelo."""
+        path = self._paths(x)
+        score = self._score_path(path)
+        if learn:
+            # Sin índices repetidos: cada árbol visita cada nodo a lo sumo una vez
+            self.latest.reshape(-1)[path.ravel()] += 1
+            self.seen += 1
+            if self.seen % self.window == 0:
+                self.ref, self.latest = self.latest, self.ref
+                self.latest[:] = 0
+                self.windows += 1
+        return score
+
+    def snapshot(self, path=STREAM_DETECTOR_STATE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp, split_feature=self.split_feature, split_value=self.split_value,
+                 ref=self.ref, latest=self.latest,
+                 params=np.array([self.n_features, self.n_trees, self.depth, self.window,
+                                  self.size_limit, self.seen, self.windows]))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=STREAM_DETECTOR_STATE):
+        with np.load(path) as data:
+            n_features, n_trees, depth, window, size_limit, seen, windows = (int(v) for v in data["params"])
+            model = cls.__new__(cls)
+            model.n_features, model.n_trees, model.depth = n_features, n_trees, depth
+            model.window, model.size_limit = window, size_limit
+            model.seen, model.windows = seen, windows
+            model.split_feature = data["split_feature"]
+            model.split_value = data["split_value"]
+            model.ref = np.ascontiguousarray(data["ref"])
+            model.latest = np.ascontiguousarray(data["latest"])
+        model._init_index()
+        return model
+
+
+class StreamDetector:
+    """Envoltorio para la ingesta: features del evento, score, snapshots periódicos y coste medio."""
+
+    def __init__(self, path=STREAM_DETECTOR_STATE, snapshot_every=5000, threshold=STREAM_ANOMALY_THRESHOLD):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.threshold = threshold
+        self.model = None
+        if os.path.exists(path):
+            try:
+                self.model = HalfSpaceTrees.load(path)
+                print(f"[SD] ♻️ Estado restaurado: {self.model.seen} eventos, {self.model.windows} ventanas")
+            except Exception as e:
+                print(f"[SD] ⚠ No se pudo restaurar {path}: {e}")
+        if self.model is None:
+            self.model = HalfSpaceTrees()
+        self.avg_us = 0.0
+
+    def process(self, event, learn=True) -> dict:
+        """Campos a añadir al evento: stream_score (o None en calentamiento) y stream_anomaly."""
+        t0 = time.perf_counter()
+        score = self.model.score_learn(event_features(event), learn=learn)
+        self.avg_us = 0.99 * self.avg_us + 0.01 * (time.perf_counter() - t0) * 1e6
+        if learn and self.model.seen % self.snapshot_every == 0:
+            self.snapshot()
+        return {
+            "stream_score": None if score is None else round(score, 6),
+            "stream_anomaly": score is not None and score >= self.threshold,
+        }
+
+    def snapshot(self):
+        try:
+            self.model.snapshot(self.path)
+            print(f"[SD] 💾 Snapshot ({self.model.seen} eventos, ~{self.avg_us:.0f} µs/evento)")
+        except Exception as e:
+            print(f"[SD] ⚠ No se pudo guardar el snapshot: {e}")
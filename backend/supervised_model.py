@@ -0,0 +1,325 @@
+"""
+supervised_model.py
+
+📌 Función principal:
+    Detector supervisado (HistGradientBoosting) entrenado con las sesiones etiquetadas `normal`/`anomaly`
+    que recoge suricata_to_mongo.py, guardado en SUPERVISED_MODEL como un scorer compacto.
+
+⚙️ Entrenamiento:
+    - Los agregados de build_features (ports_used, conn_per_ip, port_rarity, proto_ports, port_entropy...)
+      dependen de la ventana sobre la que se calculan, y score_events los calcula sobre el lote de
+      generate_rules (de pocas decenas a RULES_BATCH_MAX eventos, mezclados). Por eso no se entrena con
+      sesiones completas (una sesión es de una sola clase): los eventos etiquetados, en orden de llegada, se
+      reparten en ventanas de tamaño log-uniforme [SUPERVISED_WINDOW_MIN, RULES_BATCH_MAX] y proporción de
+      anomalías aleatoria (build_windows, SUPERVISED_WINDOW_PASSES pasadas), y build_features se aplica a
+      cada ventana, como al puntuar.
+    - HistGradientBoostingClassifier con class_weight="balanced": el ajuste usa todos los núcleos (OpenMP).
+    - Validación: el último 20% de cada clase en orden de llegada, en sus propias ventanas (una pasada); ningún
+      evento de validación entra en las ventanas de entrenamiento. Umbral de probabilidad por F1 en ellas
+      (threshold_optimizer.sweep).
+    - Comprobación antes de publicar: un lote de SUPERVISED_CHECK_BATCH anomalías de validación, puntuado
+      con score_events como en generate_rules, debe detectarse al menos en SUPERVISED_MIN_BATCH_RECALL; si
+      no, el modelo no se guarda (sus positivos generan reglas sin pasar por el umbral del bosque).
+
+📦 Scorer compacto:
+    Los árboles se aplanan a arreglos numpy (mismo recorrido sin ramas que forest_compiler.py: las hojas
+    apuntan a sí mismas con umbral +inf). El .pkl no contiene objetos de sklearn: carga en milisegundos.
+
+🔗 Usado por:
+    - generate_rules.py → `SUPERVISED_HANDLE.get()` y `score_events(events)` por lote, junto al Isolation Forest
+
+🧪 Uso:
+    python supervised_model.py [--max-iter 200]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+import joblib
+import numpy as np
+
+from constants import (
+    SUPERVISED_MODEL,
+    SUPERVISED_METRICS_JSON,
+    SUPERVISED_WINDOW_MIN,
+    SUPERVISED_WINDOW_PASSES,
+    SUPERVISED_CHECK_BATCH,
+    SUPERVISED_MIN_BATCH_RECALL,
+    RULES_BATCH_MAX,
+    LABEL_NORMAL,
+    LABEL_ANOMALY,
+    ANOMALY_PREDICTION,
+)
+from ml_processing import build_features, stable_feature_matrix, STABLE_FEATURES
+
+COLLECTION_NAME = "events"
+PROJECTION = {
+    "_id": 1, "src_ip": 1, "dest_ip": 1, "proto": 1, "src_port": 1, "dest_port": 1,
+    "alert_severity": 1, "packet_length": 1, "timestamp": 1, "tcp_flags": 1, "tcp_flags_tc": 1,
+    "training_label": 1,
+}
+_CHUNK_ROWS = 4096
+
+
+class CompactBoostedScorer:
+    """Árboles de un HistGradientBoostingClassifier binario aplanados en arreglos."""
+
+    def __init__(self, arrays, baseline, max_depth, threshold, feature_names):
+        self.feature = arrays["feature"]
+        self.split = arrays["split"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.baseline = float(baseline)
+        self.max_depth = int(max_depth)
+        self.threshold = float(threshold)
+        self.feature_names_in_ = np.array(feature_names, dtype=object)
+        self.n_features_in_ = len(feature_names)
+
+    @classmethod
+    def from_model(cls, model, threshold=0.5):
+        feats, splits, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for (predictor,) in model._predictors:
+            nodes = predictor.nodes
+            n = len(nodes)
+            leaf = nodes["is_leaf"].astype(bool)
+            self_idx = np.arange(n) + offset
+            feats.append(np.where(leaf, 0, nodes["feature_idx"]).astype(np.int32))
+            splits.append(np.where(leaf, np.inf, nodes["num_threshold"]).astype(np.float64))
+            lefts.append(np.where(leaf, self_idx, nodes["left"] + offset).astype(np.int32))
+            rights.append(np.where(leaf, self_idx, nodes["right"] + offset).astype(np.int32))
+            values.append(np.where(leaf, nodes["value"], 0.0))
+            roots.append(offset)
+            max_depth = max(max_depth, int(nodes["depth"].max()))
+            offset += n
+        arrays = {
+            "feature": np.concatenate(feats), "split": np.concatenate(splits),
+            "left": np.concatenate(lefts), "right": np.concatenate(rights),
+            "value": np.concatenate(values), "roots": np.asarray(roots, dtype=np.int32),
+        }
+        return cls(arrays, np.ravel(model._baseline_prediction)[0], max_depth, threshold, STABLE_FEATURES)
+
+    def _raw(self, X):
+        n, n_features = X.shape
+        node = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        row_base = (np.arange(n, dtype=np.int64) * n_features)[:, None]
+        flat = X.ravel()
+        for _ in range(self.max_depth):
+            x = np.take(flat, row_base + np.take(self.feature, node))
+            node = np.where(x <= np.take(self.split, node), np.take(self.left, node), np.take(self.right, node))
+        return self.baseline + np.take(self.value, node).sum(axis=1)
+
+    def predict_proba(self, X):
+        """Probabilidad de anomalía por fila."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        out = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], _CHUNK_ROWS):
+            out[start:start + _CHUNK_ROWS] = 1.0 / (1.0 + np.exp(-self._raw(X[start:start + _CHUNK_ROWS])))
+        return out
+
+    def score(self, X):
+        """(probabilidad de anomalía, etiqueta -1/1) con el umbral calibrado."""
+        proba = self.predict_proba(X)
+        return proba, np.where(proba > self.threshold, ANOMALY_PREDICTION, 1)
+
+    def score_events(self, events):
+        """Score de un lote de eventos crudos (features de ventana sobre el lote), alineado con `events`."""
+        df = build_features(list(events))
+        if df is None:
+            return np.empty(0), np.empty(0, dtype=int)
+        proba, labels = self.score(stable_feature_matrix(df))
+        # build_features reordena (merge/sort por timestamp): realinear por event_id
+        order = {eid: i for i, eid in enumerate(df["event_id"].astype(str))}
+        idx = np.array([order[str(e.get("_id"))] for e in events])
+        return proba[idx], labels[idx]
+
+
+class SupervisedHandle:
+    """Scorer supervisado cacheado; se recarga si cambia el archivo. None si no hay modelo."""
+
+    def __init__(self, path=SUPERVISED_MODEL):
+        self.path = path
+        self._stamp = None
+        self.scorer = None
+
+    def get(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != self._stamp:
+            try:
+                self.scorer = joblib.load(self.path)
+                self._stamp = stamp
+                print(f"[SV] 🔄 Modelo supervisado cargado (umbral={self.scorer.threshold:.3f})")
+            except Exception as e:
+                print(f"[SV] ⚠ No se pudo cargar {self.path}: {e}")
+                return None
+        return self.scorer
+
+
+async def load_labeled_events():
+    """Eventos etiquetados (normal/anomaly) de todas las sesiones, en orden de llegada (_id)."""
+    from db_connection import db
+
+    query = {"training_mode": True, "training_label": {"$in": [LABEL_NORMAL, LABEL_ANOMALY]}}
+    events = await db[COLLECTION_NAME].find(query, PROJECTION).sort("_id", 1).to_list(length=None)
+    print(f"[SV] 📥 {len(events)} eventos etiquetados "
+          f"({sum(e.get('training_label') == LABEL_ANOMALY for e in events)} anomalías)")
+    return events
+
+
+def build_windows(events, passes=1, seed=42, min_size=SUPERVISED_WINDOW_MIN, max_size=RULES_BATCH_MAX):
+    """Reparte `events` (en orden de llegada) en ventanas como los lotes que puntúa generate_rules.
+
+    Tamaño log-uniforme en [min_size, max_size] y fracción de anomalías uniforme en [0, 1]: hay ventanas
+    sólo de anomalías, sólo normales y mezcladas en cualquier proporción. En cada pasada cada evento cae en
+    una sola ventana y cada ventana conserva el orden de llegada; con varias pasadas el mismo evento se ve
+    en contextos (lotes) distintos."""
+    rng = np.random.default_rng(seed)
+    streams = ([e for e in events if e.get("training_label") == LABEL_ANOMALY],
+               [e for e in events if e.get("training_label") != LABEL_ANOMALY])
+    max_size = max(min_size, min(max_size, len(events)))
+    windows = []
+    for _ in range(passes):
+        pos = [0, 0]
+        while pos[0] < len(streams[0]) or pos[1] < len(streams[1]):
+            size = int(math.exp(rng.uniform(math.log(min_size), math.log(max_size))))
+            left = [len(streams[0]) - pos[0], len(streams[1]) - pos[1]]
+            n_anomaly = min(int(round(size * rng.uniform())), left[0])
+            n_normal = min(size - n_anomaly, left[1])
+            if not n_anomaly + n_normal:  # la clase elegida se agotó: la ventana sale de la otra
+                n_anomaly = min(size, left[0])
+            window = streams[0][pos[0]:pos[0] + n_anomaly] + streams[1][pos[1]:pos[1] + n_normal]
+            pos[0] += n_anomaly
+            pos[1] += n_normal
+            windows.append(sorted(window, key=lambda e: str(e.get("_id"))))
+    return windows
+
+
+def split_events(events, val_fraction=0.2):
+    """(entrenamiento, validación): el último `val_fraction` de cada clase en orden de llegada se reserva.
+
+    La separación es por eventos y no por ventanas: con varias pasadas un mismo evento aparece en varias
+    ventanas, y ninguno de validación debe verse al entrenar."""
+    train, val = [], []
+    for label in (LABEL_ANOMALY, LABEL_NORMAL):
+        stream = [e for e in events if e.get("training_label") == label]
+        cut = len(stream) - int(round(len(stream) * val_fraction))
+        train += stream[:cut]
+        val += stream[cut:]
+    return train, val
+
+
+def window_features(windows):
+    """(X float32, y) con build_features aplicado a cada ventana por separado."""
+    Xs, ys = [], []
+    for window in windows:
+        df = build_features(window)
+        if df is None:
+            continue
+        Xs.append(stable_feature_matrix(df).astype(np.float32))
+        ys.append((df["training_label"].astype(str) == LABEL_ANOMALY).to_numpy(dtype=np.int8))
+    if not Xs:
+        return np.empty((0, len(STABLE_FEATURES)), dtype=np.float32), np.empty(0, dtype=np.int8)
+    return np.vstack(Xs), np.concatenate(ys)
+
+
+def heldout_batch_recall(scorer, events, size=SUPERVISED_CHECK_BATCH):
+    """Fracción detectada de un lote de `size` anomalías de validación puntuado como en generate_rules."""
+    batch = [e for e in events if e.get("training_label") == LABEL_ANOMALY][:size]
+    if not batch:
+        return None
+    _, labels = scorer.score_events(batch)
+    return float(np.mean(labels == ANOMALY_PREDICTION))
+
+
+def fit_supervised(X_tr, y_tr, X_val, y_val, max_iter=200, seed=42):
+    """Ajusta HGB, calibra el umbral en validación y devuelve (scorer compacto, métricas)."""
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    from sklearn.metrics import average_precision_score
+    from threshold_optimizer import sweep
+
+    model = HistGradientBoostingClassifier(max_iter=max_iter, class_weight="balanced",
+                                           early_stopping=True, random_state=seed)
+    t0 = time.perf_counter()
+    model.fit(X_tr, y_tr)
+    fit_s = time.perf_counter() - t0
+
+    scorer = CompactBoostedScorer.from_model(model)
+    proba = scorer.predict_proba(X_val)
+    if not np.allclose(proba, model.predict_proba(X_val)[:, 1], atol=1e-6):
+        raise RuntimeError("El scorer compacto no coincide con el modelo de sklearn")
+    # sweep marca anomalía si score < umbral: se barre sobre -probabilidad. Entre los umbrales con F1
+    # máximo se elige el más cercano a 0.5 (con clases bien separadas el empate abarca un intervalo amplio)
+    res = sweep(-proba, y_val)
+    best = None
+    if res["f1"].size:
+        tied = np.flatnonzero(res["f1"] == res["f1"].max())
+        i = int(tied[np.argmin(np.abs(-res["threshold"][tied] - 0.5))])
+        scorer.threshold = float(min(max(-res["threshold"][i], 0.0), 1.0))
+        best = {k: float(res[k][i]) for k in ("f1", "precision", "recall")}
+
+    t0 = time.perf_counter()
+    scorer.predict_proba(X_val)
+    score_us = (time.perf_counter() - t0) / max(len(X_val), 1) * 1e6
+    metrics = {
+        "n_train": int(len(y_tr)), "n_val": int(len(y_val)), "anomaly_rate": float(np.concatenate([y_tr, y_val]).mean()),
+        "n_iter": int(model.n_iter_), "n_nodes": int(len(scorer.value)), "threads": os.cpu_count(),
+        "fit_s": round(fit_s, 3), "score_us": round(score_us, 3),
+        "threshold": scorer.threshold,
+        "ap": float(average_precision_score(y_val, proba)),
+        "f1": None if best is None else best["f1"],
+        "precision": None if best is None else best["precision"],
+        "recall": None if best is None else best["recall"],
+    }
+    return scorer, metrics
+
+
+async def train_supervised(model_path=SUPERVISED_MODEL, metrics_path=SUPERVISED_METRICS_JSON, max_iter=200):
+    train_events, val_events = split_events(await load_labeled_events())
+    labels = lambda events: {e.get("training_label") for e in events}
+    if labels(train_events) != labels(val_events) or len(labels(train_events)) != 2:
+        print("[SV] ⚠ Se necesitan sesiones etiquetadas con ambas clases (normal y anomaly).")
+        return None
+    train_windows = build_windows(train_events, passes=SUPERVISED_WINDOW_PASSES)
+    val_windows = build_windows(val_events, seed=43)
+    X_tr, y_tr = window_features(train_windows)
+    X_val, y_val = window_features(val_windows)
+    print(f"[SV] 🔍 Entrenando HistGradientBoosting con {len(y_tr)} filas en {len(train_windows)} ventanas "
+          f"({int(y_tr.sum())} anomalías)...")
+    scorer, metrics = fit_supervised(X_tr, y_tr, X_val, y_val, max_iter=max_iter)
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    metrics["n_windows"] = len(train_windows) + len(val_windows)
+    metrics["heldout_batch_recall"] = heldout_batch_recall(scorer, val_events)
+    if metrics["heldout_batch_recall"] is not None and metrics["heldout_batch_recall"] < SUPERVISED_MIN_BATCH_RECALL:
+        print(f"[SV] ❌ Un lote de {SUPERVISED_CHECK_BATCH} anomalías de validación sólo se detecta en un "
+              f"{metrics['heldout_batch_recall']:.0%} (< {SUPERVISED_MIN_BATCH_RECALL:.0%}): no se guarda el modelo.")
+        with open(metrics_path, "w") as f:
+            json.dump({**metrics, "published": False}, f, indent=2)
+        return None
+
+    tmp = f"{model_path}.tmp-{os.getpid()}"
+    joblib.dump(scorer, tmp)
+    os.replace(tmp, model_path)
+    metrics["model_kb"] = round(os.path.getsize(model_path) / 1024, 1)
+    with open(metrics_path, "w") as f:
+        json.dump(metrics, f, indent=2)
+    print(f"[SV] ✅ Modelo supervisado guardado en {model_path}: AP={metrics['ap']:.3f} F1={metrics['f1']} "
+          f"lote de anomalías={metrics['heldout_batch_recall']} fit={metrics['fit_s']}s "
+          f"score={metrics['score_us']}µs/evento")
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrenamiento del detector supervisado (HistGradientBoosting)")
+    parser.add_argument("--max-iter", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(train_supervised(max_iter=args.max_iter))
@@ -9,6 +9,8 @@ Este módulo se encarga de leer en tiempo real el archivo de logs `eve.json` gen
 - Fuera de modo entrenamiento, solo almacena eventos tipo 'alert' para análisis y generación de reglas.
 - Cada evento se identifica mediante un hash único para evitar duplicados.
 - Añade campos `training_mode` y `training_label` para poder distinguir los datos en fases posteriores del sistema.
+- Puntúa cada evento al llegar con el detector en línea (stream_detector.py): campos `stream_score` y
+  `stream_anomaly`. El detector aprende de todo lo que no esté etiquetado como anomalía.
 
 🔗 Dependencias:
 - MongoDB vía `db_connection.py`
@@ -26,6 +28,7 @@ import datetime as dt
 from typing import Tuple
 from db_connection import db
 from constants import LABEL_NORMAL, LABEL_ANOMALY
+from stream_detector import StreamDetector
 
 LOG_FILE = "/var/log/suricata/eve.json"
 
@@ -122,7 +125,15 @@ async def main():
     await db.list_collection_names()  # Confirma la conexión
     collection = db["events"]
     config_collection = db["config"]
+    detector = StreamDetector()
 
+    try:
+        await _ingest(collection, config_collection, detector)
+    finally:
+        detector.snapshot()
+
+
+async def _ingest(collection, config_collection, detector):
     async for event in monitor_log_file():
         is_training, training_label, session_hash = await read_mode(config_collection)
 
@@ -171,7 +182,8 @@ async def main():
             "anomaly": 1 if training_label == "anomaly" else 0,
         }
 
-
+        # Score en línea (tiempo constante); no aprender de tráfico etiquetado como anomalía
+        event_data.update(detector.process(event_data, learn=event_data["training_label"] != LABEL_ANOMALY))
 
         await insert_event_if_new(collection, event_data)
 
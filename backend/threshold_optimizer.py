@@ -0,0 +1,104 @@
+"""
+threshold_optimizer.py
+
+📌 Función principal:
+    Seleccionar el umbral del Isolation Forest (anomalía si score < umbral) evaluando de forma exacta
+    TP/FP/FN en TODOS los umbrales candidatos con un solo ordenamiento: O(n log n).
+
+⚙️ Cómo funciona:
+    1. Se ordenan los scores una vez (ascendente: primero los más anómalos).
+    2. Con la suma acumulada de etiquetas se obtiene, para cada valor distinto de score `u`,
+       cuántos eventos quedan por debajo (predichos como anomalía) y cuántos de ellos son anomalías reales.
+    3. Precision/recall/F1 salen de esos conteos como arreglos, sin llamar a sklearn por umbral.
+    Con `sample_weight` cada fila cuenta como `peso` eventos (filas únicas de training_compaction.py):
+    los conteos son sumas acumuladas de pesos y el resultado es el mismo que con el conjunto expandido.
+
+🔗 Usado por:
+    - train_model.py (umbral por F1)
+    - evaluate.py    (umbral por F1 con precisión mínima MIN_PRECISION_FOR_THRESHOLD)
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def weighted_quantiles(s_sorted, w_sorted, qs):
+    """Cuantiles de `s_sorted` (ya ordenado) con pesos, como np.quantile sobre el conjunto expandido."""
+    cum = np.cumsum(w_sorted)
+    pos = np.asarray(qs, dtype=np.float64) * (cum[-1] - 1)
+    lo_i = np.searchsorted(cum, np.floor(pos), side="right")
+    hi_i = np.searchsorted(cum, np.ceil(pos), side="right")
+    return s_sorted[lo_i] + (s_sorted[hi_i] - s_sorted[lo_i]) * (pos - np.floor(pos))
+
+
+def sweep(scores, y_true, quantile_range: Optional[Tuple[float, float]] = None, sample_weight=None) -> dict:
+    """Conteos y métricas exactas para cada umbral candidato.
+
+    Candidatos: cada valor distinto de score, más uno justo por encima del máximo (todo anomalía).
+    Con `quantile_range=(lo, hi)` se limitan a los umbrales dentro de esos cuantiles de los scores.
+    `sample_weight` (enteros >= 0) repite cada fila ese número de veces sin expandirla.
+    Devuelve un dict de arreglos alineados: threshold, tp, fp, fn, precision, recall, f1.
+    """
+    s_raw = np.asarray(scores, dtype=np.float64)
+    y_raw = np.asarray(y_true).astype(np.int64)
+    if s_raw.size == 0:
+        empty = np.array([], dtype=np.float64)
+        return {k: empty for k in ("threshold", "tp", "fp", "fn", "precision", "recall", "f1")}
+
+    order = np.argsort(s_raw)  # los empates se agrupan igual sin importar su orden
+    s = s_raw[order]
+    y = y_raw[order]
+    w = np.ones(s.size, dtype=np.int64) if sample_weight is None else np.asarray(sample_weight, dtype=np.int64)[order]
+    positives = int((y * w).sum())
+
+    # below[j] / tp_below[j] = eventos / anomalías reales entre las j filas de score más bajo
+    below = np.concatenate(([0], np.cumsum(w)))
+    tp_below = np.concatenate(([0], np.cumsum(y * w)))
+    first = np.flatnonzero(np.concatenate(([True], s[1:] != s[:-1])))
+    thresholds = np.append(s[first], np.nextafter(s[-1], np.inf))
+    j = np.append(first, s.size)
+
+    if quantile_range is not None:
+        lo, hi = np.quantile(s, quantile_range) if sample_weight is None else weighted_quantiles(s, w, quantile_range)
+        keep = (thresholds >= lo) & (thresholds <= hi)
+        if keep.any():
+            thresholds, j = thresholds[keep], j[keep]
+
+    k = below[j]  # eventos con score < umbral
+    tp = tp_below[j]
+    fp = k - tp
+    fn = positives - tp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(k > 0, tp / np.maximum(k, 1), 0.0)
+        recall = np.where(positives > 0, tp / max(positives, 1), 0.0)
+        denom = 2 * tp + fp + fn
+        f1 = np.where(denom > 0, 2 * tp / np.maximum(denom, 1), 0.0)
+    return {
+        "threshold": thresholds, "tp": tp, "fp": fp, "fn": fn,
+        "precision": precision, "recall": recall, "f1": f1,
+    }
+
+
+def best_threshold(scores, y_true, min_precision: Optional[float] = None,
+                   quantile_range: Optional[Tuple[float, float]] = None, sample_weight=None) -> Optional[dict]:
+    """Umbral que maximiza F1 (opcionalmente con precisión >= min_precision).
+
+    En empate gana el umbral más bajo (el más conservador). Devuelve None si ningún umbral
+    cumple la restricción. `sample_weight` como en sweep().
+    """
+    res = sweep(scores, y_true, quantile_range=quantile_range, sample_weight=sample_weight)
+    f1 = res["f1"]
+    if f1.size == 0:
+        return None
+    ok = np.ones(f1.size, dtype=bool) if min_precision is None else res["precision"] >= min_precision
+    if not ok.any():
+        return None
+    i = int(np.argmax(np.where(ok, f1, -1.0)))
+    return {
+        "threshold": float(res["threshold"][i]),
+        "precision": float(res["precision"][i]),
+        "recall": float(res["recall"][i]),
+        "f1": float(f1[i]),
+        "tp": int(res["tp"][i]), "fp": int(res["fp"][i]), "fn": int(res["fn"][i]),
+        "candidates": int(f1.size),
+    }
@@ -15,8 +15,21 @@
     - Salida:
         - `/app/models/isolation_forest_model.pkl` → Modelo entrenado
         - `/app/models/suricata_anomaly_analysis.csv` → Resultados de score y predicción por evento
+        - `/app/models/labeled_scores.npz` → Scores por event_id para evaluate.py (labeled_store.py)
+        - `/app/models/registry/vNNNN/` → Versión registrada y promovida (model_registry.py)
     - Librerías: scikit-learn (IsolationForest), pandas, numpy, joblib
 
+🧩 Uso:
+    - Como script: `python train_model.py` (añadir `--incremental [--window=ID]` para ampliar el modelo vigente,
+      `--no-compact` para entrenar sin compactar y `--compare-full` para medir el ahorro frente al conjunto completo)
+    - Como librería: `train(progress=callback)` (lo usa training_service.py para el endpoint /train).
+      Los artefactos se publican de forma atómica (archivo temporal + os.replace).
+
+🗜 Compactación (etapa "compact", training_compaction.py):
+    Las filas idénticas (tras cuantizar a TRAINING_COMPACTION_DECIMALS) se colapsan en filas únicas con peso.
+    El bosque se ajusta con una muestra ponderada del conjunto compacto, se puntúa sólo cada fila única
+    (el score se expande a todos los eventos con el índice inverso) y el umbral se calibra con pesos.
+
 📝 Requisitos previos:
     Asegurarse de haber ejecutado `ml_processing.py` para que los datos estén preparados antes de entrenar.
 
@@ -24,9 +37,12 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
-from sklearn.metrics import f1_score
 import joblib
+import json
 import os
+import sys
+import time
+from contextlib import contextmanager
 from constants import ANOMALY_PREDICTION
 try:
     from constants import LABEL_ANOMALY, LABEL_NORMAL, DEFAULT_PERCENTILE
@@ -34,159 +50,399 @@ except Exception:
     LABEL_ANOMALY = "anomaly"
     LABEL_NORMAL = "normal"
     DEFAULT_PERCENTILE = 0.98
-import ipaddress
+from constants import INCREMENTAL_TREES_PER_WINDOW, INCREMENTAL_MAX_TREES, PREPROCESSED_META_JSON
+from ip_codec import ip_to_numeric, derived_ip_columns
+from threshold_optimizer import best_threshold
+from forest_compiler import export_forest
+from model_registry import current_model_path, publish_version
+from training_compaction import compact_rows, fit_frame, weighted_quantile
+from labeled_store import write_scores
 
 # Rutas de los archivos
 DATA_PATH = "/app/models/suricata_preprocessed.csv"
 MODEL_DIR = "/app/models"
 MODEL_PATH = os.path.join(MODEL_DIR, "isolation_forest_model.pkl")
+RESULT_FILE = os.path.join(MODEL_DIR, "suricata_anomaly_analysis.csv")
 
-# Verificar si el archivo de datos existe
-if not os.path.exists(DATA_PATH):
-    print(f"[TM]❌ No se encontró el archivo {DATA_PATH}. Asegúrate de ejecutar el preprocesamiento antes.")
-    exit(1)
+STAGES = ["load", "prepare", "compact", "fit", "save", "score", "threshold", "results", "publish"]
 
-df = pd.read_csv(DATA_PATH, dtype={"event_id": str})
 
-def ip_to_numeric(ip):
-    try:
-        return int(ipaddress.ip_address(ip))
-    except:
-        return 0
+class TrainingError(Exception):
+    """Error de entrenamiento con mensaje apto para logs/API."""
 
-df["src_ip"] = df["src_ip"].apply(ip_to_numeric)
-df["dest_ip"] = df["dest_ip"].apply(ip_to_numeric)
 
-# Verificar si hay valores NaN o datos faltantes
-if df.isnull().values.any():
-    print("[TM] ⚠ Advertencia: Se encontraron valores NaN en los datos. Rellenando con ceros.")
-    df.fillna(0, inplace=True)
+def _atomic_dump(obj, path):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
 
-# Asegurar que todas las columnas sean numéricas excepto event_id
-for col in df.columns:
-    if col != "event_id":
-        df[col] = pd.to_numeric(df[col], errors="coerce")
 
-# Si todavía hay NaN, reemplazarlos con ceros
-df.fillna(0, inplace=True)
+def _atomic_csv(df, path):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
 
-df_original = df.copy()
 
-# [TM-DBG] Mostrar los primeros event_id antes de cualquier modificación
-if "event_id" in df.columns:
-    print("[TM-DBG] Primeros event_id antes del entrenamiento:")
-    print(df[["event_id"]].head(10))
-else:
-    print("[TM-DBG] ⚠ event_id no encontrado en df")
+@contextmanager
+def _stage(name, timings, progress):
+    """Mide la duración de una etapa y notifica inicio/fin al callback de progreso."""
+    if progress:
+        progress(name, "running", None)
+    t0 = time.perf_counter()
+    yield
+    timings[name] = round(time.perf_counter() - t0, 4)
+    if progress:
+        progress(name, "done", timings[name])
 
-label_column = "label_num"
-# Conjunto de características completo para predicción
-X_full_df = df.drop(columns=["timestamp", "src_ip", "dest_ip", "label_text", label_column, "event_id"], errors="ignore")
-feature_cols = X_full_df.columns.tolist()
-# Nota: event_id no se incluye en el entrenamiento ya que representa un identificador único de MongoDB (ObjectId),
-# no aporta valor predictivo y podría sesgar el modelo. Se conserva solo en los resultados para trazabilidad.
-y = df[label_column] if label_column in df.columns else None
 
-# Crear la carpeta models/ si no existe
-os.makedirs(MODEL_DIR, exist_ok=True)
+def load_training_frame(data_path=DATA_PATH):
+    """Lee el CSV preprocesado y lo deja numérico (excepto event_id)."""
+    if not os.path.exists(data_path):
+        raise TrainingError(f"No se encontró el archivo {data_path}. Asegúrate de ejecutar el preprocesamiento antes.")
 
-# Verificar que no haya columnas vacías antes de entrenar
-if X_full_df.shape[1] == 0:
-    print("[TM] ❌ Error: No hay columnas en los datos después del preprocesamiento.")
-    exit(1)
+    df = pd.read_csv(data_path, dtype={"event_id": str})
 
-# Entrenar el modelo Isolation Forest
-print("[TM] 🔍 Entrenando modelo Isolation Forest...")
-model = IsolationForest(contamination=0.05, random_state=42)  # 5% de tráfico anómalo
+    df["src_ip"] = ip_to_numeric(df["src_ip"])
+    df["dest_ip"] = ip_to_numeric(df["dest_ip"])
 
-try:
-    # Entrenar solo con tráfico normal si existe etiqueta
-    df_train = df.copy()
-    if "training_label" in df_train.columns:
-        df_train = df_train[df_train["training_label"].astype(str).str.lower() == "normal"]
-    elif "label_text" in df_train.columns:
-        df_train = df_train[df_train["label_text"].astype(str).str.lower() == "normal"]
-
-    X_train = df_train[feature_cols].values
-    X_full = X_full_df.values
-
-    print(f"[TM] 🧪 Columnas usadas para entrenamiento: {feature_cols}")
-    print(f"[TM] 🧪 Muestras de entrenamiento: {len(X_train)} / {len(X_full)} totales")
-    model.fit(X_train)
-    # Guardar el modelo en la carpeta persistente
-    joblib.dump(model, MODEL_PATH)
-    print(f"[TM] ✅ Modelo entrenado y guardado en {MODEL_PATH}")
-
-    # **Evaluación del Modelo**
-    print("\n [TM] 📊 Evaluando el modelo...")
-
-    # Puntajes de normalidad: mayor = más normal
-    scores = model.decision_function(X_full)
-
-    # Selección de umbral para maximizar F1 si hay ground truth
-    best_thr = None
-    best_f1 = None
-    # Construir y_true de forma robusta según columnas disponibles
-    y_true = None
+    # Verificar si hay valores NaN o datos faltantes
+    if df.isnull().values.any():
+        print("[TM] ⚠ Advertencia: Se encontraron valores NaN en los datos. Rellenando con ceros.")
+        df.fillna(0, inplace=True)
+
+    # Asegurar que todas las columnas sean numéricas excepto event_id
+    for col in df.columns:
+        if col != "event_id":
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # Si todavía hay NaN, reemplazarlos con ceros
+    df.fillna(0, inplace=True)
+    return df
+
+
+def feature_frame(df, label_column="label_num"):
+    """Conjunto de características completo para predicción."""
+    # Nota: event_id no se incluye en el entrenamiento ya que representa un identificador único de MongoDB (ObjectId),
+    # no aporta valor predictivo y podría sesgar el modelo. Se conserva solo en los resultados para trazabilidad.
+    return df.drop(columns=["timestamp", "src_ip", "dest_ip", "label_text", label_column, "event_id"]
+                   + derived_ip_columns(["src_ip", "dest_ip"]), errors="ignore")
+
+
+def normal_rows(df):
+    """Filtra tráfico normal si existe etiqueta; si no, devuelve todo."""
+    if "training_label" in df.columns:
+        return df[df["training_label"].astype(str).str.lower() == "normal"]
+    if "label_text" in df.columns:
+        return df[df["label_text"].astype(str).str.lower() == "normal"]
+    return df
+
+
+def true_labels(df_original):
+    """Construye y_true (1 = anomalía) de forma robusta según columnas disponibles."""
     if "label" in df_original.columns:
-        y_true = (df_original["label"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
-    elif "label_text" in df_original.columns:
-        y_true = (df_original["label_text"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
-    elif "training_label" in df_original.columns:
-        y_true = (df_original["training_label"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
-    elif "label_num" in df_original.columns:
+        return (df_original["label"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
+    if "label_text" in df_original.columns:
+        return (df_original["label_text"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
+    if "training_label" in df_original.columns:
+        return (df_original["training_label"].astype(str).str.lower() == LABEL_ANOMALY).astype(int).values
+    if "label_num" in df_original.columns:
         # Si -1 está presente, asúmelo como anomalía; si no, usa 1 como anomalía
         uniques = set(pd.Series(df_original["label_num"]).dropna().unique().tolist())
         if -1 in uniques:
-            y_true = (df_original["label_num"] == -1).astype(int).values
-        else:
-            y_true = (df_original["label_num"] == 1).astype(int).values
-
-    if y_true is not None:
-        # Barrido de cuantiles altos (región de anomalías)
-        quantiles = np.linspace(0.80, 0.995, 60)
-        grid = np.quantile(scores, quantiles)
-        # Evitar duplicados en la rejilla
-        grid = np.unique(grid)
-        evals = []
-        for t in grid:
-            y_pred_bin = (scores < t).astype(int)
-            f1 = f1_score(y_true, y_pred_bin, zero_division=0)
-            evals.append((t, f1))
-        best_thr, best_f1 = max(evals, key=lambda x: x[1]) if evals else (np.quantile(scores, DEFAULT_PERCENTILE), None)
-        if best_f1 is not None:
-            print(f"[TM] 🎯 Umbral seleccionado por F1: {best_thr:.6f} (F1={best_f1:.3f})")
+            return (df_original["label_num"] == -1).astype(int).values
+        return (df_original["label_num"] == 1).astype(int).values
+    return None
+
+
+def _load_previous_model(model_path, feature_cols):
+    """Modelo vigente apto para ampliar con warm_start (mismas columnas); None si hay que entrenar de cero.
+
+    El vigente es el de la versión CURRENT del registro (el que puntúa eventos), no el .pkl suelto, que
+    puede ser de un entrenamiento no promovido; sin registro se usa `model_path`."""
+    model_path = current_model_path(fallback=model_path)
+    if not os.path.exists(model_path):
+        return None
+    try:
+        model = joblib.load(model_path)
+    except Exception as e:
+        print(f"[TM] ⚠ No se pudo cargar el modelo previo ({e}); se entrena desde cero.")
+        return None
+    if list(getattr(model, "feature_names_in_", [])) != list(feature_cols):
+        print("[TM] ⚠ Las columnas cambiaron respecto al modelo previo; se entrena desde cero.")
+        return None
+    return model
+
+
+def retire_oldest_trees(model, n):
+    """Elimina los `n` árboles más antiguos (y su metadata) de un IsolationForest ajustado."""
+    if n <= 0:
+        return model
+    model.estimators_ = model.estimators_[n:]
+    model.estimators_features_ = model.estimators_features_[n:]
+    model._average_path_length_per_tree = model._average_path_length_per_tree[n:]
+    model._decision_path_lengths = model._decision_path_lengths[n:]
+    if len(getattr(model, "_seeds", [])) > len(model.estimators_):
+        model._seeds = model._seeds[-len(model.estimators_):]
+    model.tree_provenance_ = list(getattr(model, "tree_provenance_", []))[n:]
+    model.n_estimators = len(model.estimators_)
+    return model
+
+
+def fit_forest(X, sample_weight=None):
+    """Isolation Forest nuevo. Con `sample_weight`, X son filas únicas compactadas (ver training_compaction.py)."""
+    model = IsolationForest(contamination=0.05, random_state=42)  # 5% de tráfico anómalo
+    if sample_weight is None:
+        return model.fit(X)
+    model.fit(fit_frame(X, sample_weight, model.n_estimators * 256))
+    # offset_ se calculó sobre la muestra: recalcularlo con el conjunto compacto ponderado
+    model.offset_ = weighted_quantile(model.score_samples(X), sample_weight, model.contamination)
+    return model
+
+
+def extend_forest(model, X_window, window, trees_per_window=None, max_trees=None, sample_weight=None):
+    """Añade árboles entrenados sólo con la ventana nueva (warm_start) y retira los más antiguos.
+
+    El coste de ajuste depende del tamaño de la ventana, no del histórico; el tamaño del modelo
+    queda acotado a `max_trees`. `tree_provenance_` guarda la ventana de origen de cada árbol.
+    Con `sample_weight`, X_window son filas únicas compactadas con sus pesos.
+    """
+    trees_per_window = trees_per_window or INCREMENTAL_TREES_PER_WINDOW
+    max_trees = max_trees or INCREMENTAL_MAX_TREES
+    n_prev = len(model.estimators_)
+    provenance = list(getattr(model, "tree_provenance_", [{"window": "initial"}] * n_prev))
+    generation = int(getattr(model, "n_windows_", 0)) + 1
+    # Semilla distinta por ventana: tras retirar árboles el avance del random_state se repetiría
+    model.set_params(warm_start=True, n_estimators=n_prev + trees_per_window, random_state=42 + generation)
+    if sample_weight is None:
+        model.fit(X_window)
     else:
-        best_thr = np.quantile(scores, DEFAULT_PERCENTILE)
-        print(f"[TM] 📈 Umbral por percentil (sin etiquetas): {best_thr:.6f} (p={DEFAULT_PERCENTILE})")
-
-    # Predicción binaria basada en umbral
-    predictions = np.where(scores < best_thr, ANOMALY_PREDICTION, 1)
-
-    result_df = pd.DataFrame()
-    # Mantener campos clave
-    for col in ["proto", "src_port", "dest_port", "alert_severity", "packet_length",
-                "hour", "is_night", "ports_used", "conn_per_ip", "port_entropy", "failed_ratio", "hour_anomaly",
-                "event_id", "src_ip", "dest_ip", "timestamp"]:
-        if col in df_original.columns:
-            result_df[col] = df_original[col]
-    # Añadir resultados del modelo
-    if "event_id" in df_original.columns:
-        result_df["event_id"] = df_original["event_id"].astype(str)
-    result_df["anomaly_score"] = scores
-    result_df["prediction"] = predictions
-    # Convertimos la predicción a binaria para consistencia (1 = anomalía, 0 = normal)
-    result_df["is_anomaly"] = (predictions == ANOMALY_PREDICTION).astype(int)
-    # Añadir columna label en formato texto ("anomaly"/"normal"), como en otros scripts
-    result_df["label"] = result_df["prediction"].apply(lambda x: "anomaly" if x == ANOMALY_PREDICTION else "normal")
-    # Contar anomalías detectadas
-    total_anomalies = (predictions == ANOMALY_PREDICTION).sum()
-    print(f"[TM] ⚠ Total de anomalías detectadas: {total_anomalies} de {len(X_full)} eventos.")
-    # Guardar en CSV
-    result_file = "/app/models/suricata_anomaly_analysis.csv"
-    result_df.to_csv(result_file, index=False)
-    print(f"[TM] ✅ Resultados guardados en {result_file}")
-    # Mostrar conteo de instancias por etiqueta
-    print(result_df["label"].value_counts())
-except Exception as e:
-    print(f"[TM] ❌ Error al entrenar el modelo: {e}")
+        model.fit(fit_frame(X_window, sample_weight, trees_per_window * 256, seed=42 + generation))
+    model.tree_provenance_ = provenance + [window] * (len(model.estimators_) - n_prev)
+    model.n_windows_ = generation
+    if len(model.estimators_) > max_trees:
+        retire_oldest_trees(model, len(model.estimators_) - max_trees)
+        # offset_ se calculó con los árboles retirados: recalcularlo con el bosque final
+        if model.contamination != "auto":
+            if sample_weight is None:
+                model.offset_ = np.percentile(model.score_samples(X_window), 100.0 * model.contamination)
+            else:
+                model.offset_ = weighted_quantile(model.score_samples(X_window), sample_weight, model.contamination)
+    print(f"[TM] 🌲 Bosque: {len(model.estimators_)} árboles de "
+          f"{len({p.get('window') for p in model.tree_provenance_})} ventanas (máx {max_trees})")
+    return model
+
+
+def _training_session():
+    """Sesión de entrenamiento registrada por ml_processing.py junto al CSV (None si no hay)."""
+    try:
+        with open(PREPROCESSED_META_JSON) as f:
+            return json.load(f).get("training_session")
+    except (OSError, ValueError):
+        return None
+
+
+def _compare_full_fit(X_train, X_full):
+    """Segundos de ajuste + scoring con el conjunto sin compactar (sólo para medir el ahorro)."""
+    t0 = time.perf_counter()
+    fit_forest(X_train).decision_function(X_full)
+    return time.perf_counter() - t0
+
+
+def train(data_path=DATA_PATH, model_path=MODEL_PATH, result_file=RESULT_FILE, progress=None,
+          incremental=False, window_id=None, publish=True, compact=True, compare_full=False):
+    """Entrena el Isolation Forest y publica modelo + resultados.
+
+    `progress(stage, status, seconds)` se invoca al iniciar/terminar cada etapa de STAGES.
+    Con `incremental=True` amplía el modelo vigente con árboles de la ventana actual (ver extend_forest).
+    Con `publish=True` el modelo se registra como nueva versión y se promueve (ver model_registry.py).
+    Con `compact=True` ajuste, scoring y umbral usan filas únicas con peso (ver training_compaction.py);
+    `compare_full=True` repite ajuste + scoring sin compactar para informar del tiempo ahorrado.
+    Devuelve un resumen con métricas y duración por etapa.
+    """
+    timings = {}
+
+    with _stage("load", timings, progress):
+        df = load_training_frame(data_path)
+        df_original = df.copy()
+
+    with _stage("prepare", timings, progress):
+        # [TM-DBG] Mostrar los primeros event_id antes de cualquier modificación
+        if "event_id" in df.columns:
+            print("[TM-DBG] Primeros event_id antes del entrenamiento:")
+            print(df[["event_id"]].head(10))
+        else:
+            print("[TM-DBG] ⚠ event_id no encontrado en df")
+
+        X_full_df = feature_frame(df)
+        feature_cols = X_full_df.columns.tolist()
+
+        # Verificar que no haya columnas vacías antes de entrenar
+        if X_full_df.shape[1] == 0:
+            raise TrainingError("No hay columnas en los datos después del preprocesamiento.")
+
+        # Entrenar solo con tráfico normal si existe etiqueta
+        df_train = normal_rows(df)
+        X_train = df_train[feature_cols]
+        X_full = X_full_df
+
+    with _stage("compact", timings, progress):
+        y_true = true_labels(df_original)
+        compaction = None
+        if compact:
+            train_set = compact_rows(X_train)
+            full_set = compact_rows(X_full, y_true)
+            X_fit, w_fit = train_set.X, train_set.weight
+            X_score, w_score, y_score = full_set.X, full_set.weight, full_set.y
+            compaction = {
+                "n_train": int(len(X_train)), "unique_train": int(len(train_set.X)), "train_ratio": round(train_set.ratio, 2),
+                "n_total": int(len(X_full)), "unique_total": int(len(full_set.X)), "total_ratio": round(full_set.ratio, 2),
+            }
+            print(f"[TM] 🗜 Compactación: entrenamiento {len(X_train)} → {len(train_set.X)} filas únicas "
+                  f"(x{train_set.ratio:.1f}), evaluación {len(X_full)} → {len(full_set.X)} (x{full_set.ratio:.1f})")
+        else:
+            X_fit, w_fit = X_train, None
+            X_score, w_score, y_score = X_full, None, y_true
+
+    # Crear la carpeta models/ si no existe
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+
+    with _stage("fit", timings, progress):
+        previous = _load_previous_model(model_path, feature_cols) if incremental else None
+        print(f"[TM] 🧪 Columnas usadas para entrenamiento: {feature_cols}")
+        print(f"[TM] 🧪 Muestras de entrenamiento: {len(X_train)} / {len(X_full)} totales")
+        window = {"window": window_id or time.strftime("%Y%m%d-%H%M%S"), "trained_at": time.time(), "n_samples": int(len(X_train))}
+        t0 = time.perf_counter()  # sólo el ajuste: es lo que _compare_full_fit mide sin compactar
+        if previous is not None:
+            print(f"[TM] 🌲 Entrenamiento incremental: +{INCREMENTAL_TREES_PER_WINDOW} árboles sobre la ventana {window['window']}")
+            model = extend_forest(previous, X_fit, window, sample_weight=w_fit)
+        else:
+            print("[TM] 🔍 Entrenando modelo Isolation Forest...")
+            model = fit_forest(X_fit, sample_weight=w_fit)
+            model.tree_provenance_ = [window] * len(model.estimators_)
+        fit_s = time.perf_counter() - t0
+
+    with _stage("save", timings, progress):
+        # Guardar el modelo en la carpeta persistente (publicación atómica)
+        _atomic_dump(model, model_path)
+        print(f"[TM] ✅ Modelo entrenado y guardado en {model_path}")
+        try:
+            export_forest(model, source_path=model_path)
+        except Exception as e:
+            print(f"[TM] ⚠ No se pudo exportar el bosque compilado: {e}")
+
+    with _stage("score", timings, progress):
+        # **Evaluación del Modelo**
+        print("\n [TM] 📊 Evaluando el modelo...")
+        # Puntajes de normalidad: mayor = más normal (con compactación, una vez por fila única)
+        scores_unique = model.decision_function(X_score)
+        scores = scores_unique if w_score is None else scores_unique[full_set.inverse]
+
+    with _stage("threshold", timings, progress):
+        # Selección de umbral para maximizar F1 si hay ground truth
+        best_thr = None
+        best_f1 = None
+        fallback_thr = (np.quantile(scores_unique, DEFAULT_PERCENTILE) if w_score is None
+                        else weighted_quantile(scores_unique, w_score, DEFAULT_PERCENTILE))
+
+        if y_true is not None:
+            # Barrido exacto de todos los umbrales en la región de cuantiles altos (región de anomalías)
+            best = best_threshold(scores_unique, y_score, quantile_range=(0.80, 0.995), sample_weight=w_score)
+            if best is not None:
+                best_thr, best_f1 = best["threshold"], best["f1"]
+            else:
+                best_thr = fallback_thr
+            if best_f1 is not None:
+                print(f"[TM] 🎯 Umbral seleccionado por F1: {best_thr:.6f} (F1={best_f1:.3f})")
+        else:
+            best_thr = fallback_thr
+            print(f"[TM] 📈 Umbral por percentil (sin etiquetas): {best_thr:.6f} (p={DEFAULT_PERCENTILE})")
+
+    with _stage("results", timings, progress):
+        # Predicción binaria basada en umbral
+        predictions = np.where(scores < best_thr, ANOMALY_PREDICTION, 1)
+
+        result_df = pd.DataFrame()
+        # Mantener campos clave
+        for col in ["proto", "src_port", "dest_port", "alert_severity", "packet_length",
+                    "hour", "is_night", "ports_used", "conn_per_ip", "port_entropy", "failed_ratio", "hour_anomaly",
+                    "event_id", "src_ip", "dest_ip", "timestamp"]:
+            if col in df_original.columns:
+                result_df[col] = df_original[col]
+        # Añadir resultados del modelo
+        if "event_id" in df_original.columns:
+            result_df["event_id"] = df_original["event_id"].astype(str)
+        result_df["anomaly_score"] = scores
+        result_df["prediction"] = predictions
+        # Convertimos la predicción a binaria para consistencia (1 = anomalía, 0 = normal)
+        result_df["is_anomaly"] = (predictions == ANOMALY_PREDICTION).astype(int)
+        # Añadir columna label en formato texto ("anomaly"/"normal"), como en otros scripts
+        result_df["label"] = np.where(predictions == ANOMALY_PREDICTION, "anomaly", "normal")
+        # Contar anomalías detectadas
+        total_anomalies = int((predictions == ANOMALY_PREDICTION).sum())
+        print(f"[TM] ⚠ Total de anomalías detectadas: {total_anomalies} de {len(X_full)} eventos.")
+        # Guardar en CSV
+        _atomic_csv(result_df, result_file)
+        print(f"[TM] ✅ Resultados guardados en {result_file}")
+        # Mismos scores en el almacén por event_id que lee evaluate.py (sin merge de CSVs)
+        if "event_id" in result_df.columns:
+            try:
+                write_scores(result_df["event_id"], scores, predictions,
+                             proto=result_df.get("proto"), dest_port=result_df.get("dest_port"))
+            except Exception as e:
+                print(f"[TM] ⚠ No se pudo actualizar el almacén de scores: {e}")
+        # Mostrar conteo de instancias por etiqueta
+        print(result_df["label"].value_counts())
+
+    if compaction is not None:
+        compaction["fit_score_s"] = round(fit_s + timings["score"], 4)
+        if compare_full:
+            full_s = _compare_full_fit(X_train, X_full)
+            compaction["full_fit_score_s"] = round(full_s, 4)
+            compaction["saved_s"] = round(full_s - compaction["fit_score_s"], 4)
+            print(f"[TM] ⏱ Ajuste + scoring: {compaction['fit_score_s']}s compactado vs {full_s:.4f}s completo "
+                  f"(ahorro {compaction['saved_s']}s)")
+
+    version = None
+    if publish:
+        with _stage("publish", timings, progress):
+            version = publish_version(
+                feature_cols,
+                threshold=float(best_thr),
+                training_session=_training_session(),
+                metrics={"f1": best_f1, "anomalies": total_anomalies, "n_train": int(len(X_train)),
+                         "n_total": int(len(X_full)), "n_trees": len(model.estimators_), "compaction": compaction},
+                model_path=model_path,
+            )
+
+    return {
+        "version": version,
+        "model_path": model_path,
+        "result_file": result_file,
+        "feature_cols": feature_cols,
+        "n_train": int(len(X_train)),
+        "n_total": int(len(X_full)),
+        "threshold": float(best_thr),
+        "f1": None if best_f1 is None else float(best_f1),
+        "anomalies": total_anomalies,
+        "n_trees": len(model.estimators_),
+        "incremental": previous is not None,
+        "compaction": compaction,
+        "stages": timings,
+    }
+
+
+def main():
+    incremental = "--incremental" in sys.argv
+    window_id = next((a.split("=", 1)[1] for a in sys.argv if a.startswith("--window=")), None)
+    try:
+        train(incremental=incremental, window_id=window_id,
+              compact="--no-compact" not in sys.argv, compare_full="--compare-full" in sys.argv)
+    except TrainingError as e:
+        print(f"[TM] ❌ Error: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"[TM] ❌ Error al entrenar el modelo: {e}")
+
+
+if __name__ == "__main__":
+    main()
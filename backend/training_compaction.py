@@ -0,0 +1,77 @@
+"""
+training_compaction.py
+
+📌 Función principal:
+    Compactar el conjunto de entrenamiento: las sesiones normales repiten miles de veces el mismo vector
+    de features (consultas DNS/NTP periódicas, etc.). Las filas idénticas (o idénticas tras cuantizar)
+    se colapsan en filas únicas con un peso = número de repeticiones.
+
+⚙️ Cómo funciona:
+    - compact_rows(): redondeo opcional a `decimals` y deduplicación con np.unique sobre la fila
+      completa como bytes (una ordenación, O(n log n)). Devuelve las filas únicas, sus pesos y el
+      índice inverso (fila original → fila única) para volver a expandir resultados.
+    - weighted_resample(): muestra i.i.d. proporcional al peso. El Isolation Forest sub-muestrea
+      `max_samples` filas por árbol de forma uniforme (scikit-learn 1.6 ignora sample_weight al
+      elegirlas), así que se ajusta con una muestra de n_estimators · max_samples filas extraída del
+      conjunto compacto: cada árbol ve la misma distribución que con el conjunto completo.
+      fit_frame() devuelve esas filas (o el conjunto expandido, si es más pequeño).
+    - weighted_quantile(): percentil con pesos (offset_ del bosque y umbrales por percentil).
+
+🔗 Usado por:
+    - train_model.py → ajuste, scoring y calibración del umbral sobre filas únicas (etapa "compact")
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from constants import TRAINING_COMPACTION_DECIMALS
+from threshold_optimizer import weighted_quantiles
+
+
+class CompactedSet(NamedTuple):
+    X: pd.DataFrame          # filas únicas (mismas columnas que la entrada)
+    weight: np.ndarray       # int64, repeticiones de cada fila única
+    inverse: np.ndarray      # int64, fila original → fila única
+    y: Optional[np.ndarray]  # etiqueta de cada fila única (si se compactó con etiquetas)
+
+    @property
+    def ratio(self) -> float:
+        """Filas originales por fila única (1.0 = sin duplicados)."""
+        return len(self.inverse) / max(len(self.X), 1)
+
+
+def compact_rows(X: pd.DataFrame, y=None, decimals: Optional[int] = TRAINING_COMPACTION_DECIMALS) -> CompactedSet:
+    """Colapsa filas idénticas de X (y de la etiqueta, si se pasa) en filas únicas con peso."""
+    values = np.ascontiguousarray(X.to_numpy(dtype=np.float64))
+    if decimals is not None:
+        values = np.round(values, decimals) + 0.0  # + 0.0: -0.0 y 0.0 deben agruparse juntos
+    key = values if y is None else np.column_stack([values, np.asarray(y, dtype=np.float64)])
+    key = np.ascontiguousarray(key)
+    rows = key.view(np.dtype((np.void, key.dtype.itemsize * key.shape[1]))).ravel()
+    _, first, inverse, counts = np.unique(rows, return_index=True, return_inverse=True, return_counts=True)
+    X_unique = pd.DataFrame(values[first], columns=X.columns)
+    y_unique = None if y is None else np.asarray(y)[first]
+    return CompactedSet(X_unique, counts.astype(np.int64), inverse.ravel().astype(np.int64), y_unique)
+
+
+def weighted_resample(weight, size, seed=42) -> np.ndarray:
+    """Índices (con reemplazo) de `size` filas con probabilidad proporcional a `weight`."""
+    cum = np.cumsum(weight, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    return np.searchsorted(cum, rng.random(size) * cum[-1], side="right")
+
+
+def fit_frame(X: pd.DataFrame, weight, size, seed=42) -> pd.DataFrame:
+    """Filas para ajustar un bosque sub-muestreado: el conjunto expandido si no supera `size` filas,
+    si no una muestra ponderada de `size` filas (ver weighted_resample)."""
+    if weight.sum() <= size:
+        return X.iloc[np.repeat(np.arange(len(X)), weight)]
+    return X.iloc[weighted_resample(weight, size, seed)]
+
+
+def weighted_quantile(values, weight, q) -> float:
+    """np.quantile(np.repeat(values, weight), q) sin expandir (interpolación lineal)."""
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values)
+    return float(weighted_quantiles(values[order], np.asarray(weight)[order], q))
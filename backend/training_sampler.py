@@ -0,0 +1,291 @@
+"""
+training_sampler.py
+
+📌 Función principal:
+    Muestrear una sesión de entrenamiento directamente desde MongoDB (colección `events`) con memoria acotada:
+    un reservorio estratificado por (etiqueta, hora, proto) en una sola pasada, y features calculadas sólo
+    para las filas muestreadas.
+
+🎯 Motivo:
+    IsolationForest usa `max_samples` filas por árbol, pero ml_processing.py materializa la sesión completa.
+    Aquí la memoria es proporcional a la muestra (+ agregados por clave), no a la longitud de la sesión.
+
+⚙️ Cómo funciona:
+    1. Cada evento recibe una clave aleatoria u ~ U(0,1). Cada estrato guarda los eventos con u < tau_estrato
+       (muestreo bottom-k): la muestra de cada estrato es uniforme en todo momento.
+    2. Si el total supera la capacidad, el estrato más grande expulsa su clave máxima y baja su tau
+       (reparto equitativo entre estratos: las clases/horas/protocolos raros no desaparecen).
+    3. Durante la misma pasada se mantienen los agregados globales que necesitan las features
+       (conteos por src_ip / dest_ip / dest_port / proto, puertos por origen, hora modal, media/std por proto)
+       y el estado secuencial por src_ip (ventana de 5 min, velocidad, ratio de SYN). Las features
+       secuenciales se congelan en el momento en que un evento entra al reservorio.
+    4. Al final se construye el DataFrame sólo con las filas muestreadas y se aplica la misma
+       etiqueta/selección/normalización que ml_processing.py (select_and_normalize).
+
+⚠️ Diferencias con ml_processing.py:
+    - RobustScaler se ajusta sobre la muestra, no sobre la sesión completa.
+    - Las features secuenciales asumen llegada aproximadamente cronológica (orden natural de inserción).
+
+🧪 Uso:
+    python training_sampler.py [--session S] [--size 50000] [--seed 42]
+    (o `python ml_processing.py --train_only --sample=50000`)
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import random
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from constants import PREPROCESSED_CSV, PREPROCESSED_META_JSON, TRAINING_SAMPLE_SIZE
+
+COLLECTION_NAME = "events"
+PROJECTION = {
+    "_id": 1, "src_ip": 1, "dest_ip": 1, "proto": 1, "src_port": 1, "dest_port": 1,
+    "alert_severity": 1, "packet_length": 1, "timestamp": 1,
+    "training_mode": 1, "training_label": 1, "tcp_flags": 1, "tcp_flags_tc": 1,
+}
+_WINDOW_5M = timedelta(minutes=5)
+
+
+def _parse_ts(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        ts = pd.to_datetime(value, errors="coerce")
+        return None if pd.isna(ts) else ts.to_pydatetime()
+
+
+def _num(value):
+    try:
+        out = float(value)
+        return 0.0 if math.isnan(out) else out
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _SourceState:
+    """Agregados y estado secuencial de una IP origen."""
+    __slots__ = ("count", "dest_count", "sev_pos", "ports", "hours", "syn", "last_ts", "diffs", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.dest_count = 0
+        self.sev_pos = 0
+        self.ports = Counter()
+        self.hours = [0] * 24
+        self.syn = deque(maxlen=20)
+        self.last_ts = None
+        self.diffs = deque(maxlen=5)
+        self.recent = deque()
+
+
+class StratifiedReservoir:
+    """Reservorio estratificado de capacidad fija (bottom-k por estrato, reparto equitativo)."""
+
+    def __init__(self, capacity, seed=42):
+        self.capacity = int(capacity)
+        self.rng = random.Random(seed)
+        self.heaps = defaultdict(list)   # estrato → heap de (-u, seq, fila)
+        self.tau = defaultdict(lambda: 1.0)
+        self.seen = Counter()
+        self.size = 0
+        self._seq = 0
+
+    def offer(self, stratum, make_row):
+        """Ofrece un evento; `make_row()` sólo se invoca si el evento entra a la muestra."""
+        self.seen[stratum] += 1
+        u = self.rng.random()
+        if u >= self.tau[stratum]:
+            return False
+        self._seq += 1
+        heapq.heappush(self.heaps[stratum], (-u, self._seq, make_row()))
+        self.size += 1
+        if self.size > self.capacity:
+            largest = max(self.heaps, key=lambda s: len(self.heaps[s]))
+            neg_u, _, _ = heapq.heappop(self.heaps[largest])
+            self.tau[largest] = -neg_u
+            self.size -= 1
+        return True
+
+    def rows(self):
+        out = [item for heap in self.heaps.values() for item in heap]
+        out.sort(key=lambda item: item[1])  # orden de llegada
+        return [row for _, _, row in out]
+
+    def strata(self):
+        """Población y tamaño de muestra por estrato (peso = población / muestra)."""
+        return [{"stratum": list(s), "seen": int(self.seen[s]), "sampled": len(self.heaps.get(s, []))}
+                for s in sorted(self.seen, key=str)]
+
+
+class SessionSampler:
+    """Una pasada sobre los eventos: reservorio + agregados globales para las features."""
+
+    def __init__(self, capacity=TRAINING_SAMPLE_SIZE, seed=42):
+        self.reservoir = StratifiedReservoir(capacity, seed)
+        self.sources = defaultdict(_SourceState)
+        self.dest_ip_count = Counter()
+        self.dest_port_count = Counter()
+        self.proto_stats = defaultdict(lambda: [0, 0.0, 0.0])   # Welford: n, media, M2
+        self.proto_ports = defaultdict(set)
+        self.has_tcp_flags = False
+        self.total = 0
+
+    def add(self, event):
+        self.total += 1
+        src = event.get("src_ip", 0)
+        dest_ip = event.get("dest_ip", 0)
+        dest_port = event.get("dest_port", 0)
+        proto = event.get("proto", 0)
+        sev = _num(event.get("alert_severity", 0))
+        pkt = _num(event.get("packet_length", 0))
+        ts = _parse_ts(event.get("timestamp"))
+        hour = ts.hour if ts is not None else 0
+
+        st = self.sources[src]
+        st.count += 1
+        if dest_ip is not None:
+            st.dest_count += 1
+        st.sev_pos += sev > 0
+        st.ports[dest_port] += 1
+        st.hours[hour] += 1
+        self.dest_ip_count[dest_ip] += 1
+        self.dest_port_count[dest_port] += 1
+        n, mean, m2 = self.proto_stats[proto]
+        n += 1
+        delta = pkt - mean
+        mean += delta / n
+        self.proto_stats[proto] = [n, mean, m2 + delta * (pkt - mean)]
+        self.proto_ports[proto].add(dest_port)
+
+        # Estado secuencial por origen (el valor se congela si el evento entra a la muestra)
+        if "tcp_flags" in event and "tcp_flags_tc" in event:
+            self.has_tcp_flags = True
+        st.syn.append(1 if event.get("tcp_flags_tc") == "S" else 0)
+        if ts is not None:
+            if st.last_ts is not None:
+                st.diffs.append((ts - st.last_ts).total_seconds())
+            st.last_ts = ts
+            while st.recent and ts - st.recent[0] >= _WINDOW_5M:
+                st.recent.popleft()
+            st.recent.append(ts)
+
+        label = event.get("training_label") if event.get("training_mode") is True else None
+        stratum = (str(label), hour, str(proto))
+
+        def make_row():
+            row = {k: event.get(k) for k in PROJECTION if k in event}
+            row.update(_id=str(event.get("_id", "")), src_ip=src, dest_ip=dest_ip, dest_port=dest_port, proto=proto)
+            row["hour"] = hour
+            row["conn_velocity"] = float(np.mean(st.diffs)) if st.diffs else 0.0
+            row["conn_5m"] = float(len(st.recent)) if ts is not None else 0.0
+            row["syn_ratio"] = float(np.mean(st.syn))
+            return row
+
+        self.reservoir.offer(stratum, make_row)
+
+    def frame(self):
+        """DataFrame de la muestra con las features de ml_processing.py (antes de normalizar)."""
+        df = pd.DataFrame(self.reservoir.rows())
+        if df.empty:
+            return df
+        for col in ["packet_length", "alert_severity"]:
+            if col not in df.columns:
+                df[col] = 0
+        df["event_id"] = df["_id"]
+        df["is_night"] = ((df["hour"] < 7) | (df["hour"] > 20)).astype(int)
+
+        src = df["src_ip"]
+        per_src = {ip: self.sources[ip] for ip in src.unique()}
+        df["ports_used"] = src.map({ip: len(s.ports) for ip, s in per_src.items()})
+        df["conn_per_ip"] = src.map({ip: s.dest_count for ip, s in per_src.items()})
+        df["port_entropy"] = src.map({ip: _entropy(s.ports) for ip, s in per_src.items()})
+        if self.has_tcp_flags:
+            df["failed_ratio"] = df["syn_ratio"]
+        else:
+            df["failed_ratio"] = src.map({ip: s.sev_pos / s.count for ip, s in per_src.items()})
+        modal_hour = src.map({ip: int(np.argmax(s.hours)) for ip, s in per_src.items()})
+        df["hour_anomaly"] = ((df["hour"] - modal_hour).abs() > 3).astype(int)
+
+        stats = {p: (m, math.sqrt(m2 / (n - 1)) if n > 1 else np.nan) for p, (n, m, m2) in self.proto_stats.items()}
+        df["proto_pkt_mean"] = df["proto"].map({p: v[0] for p, v in stats.items()})
+        df["proto_pkt_std"] = df["proto"].map({p: v[1] for p, v in stats.items()})
+        df["proto_ports"] = df["proto"].map({p: len(v) for p, v in self.proto_ports.items()})
+        pkt = pd.to_numeric(df["packet_length"], errors="coerce")
+        df["pkt_anomaly"] = ((pkt - df["proto_pkt_mean"]).abs() > 2 * df["proto_pkt_std"]).astype(int)
+
+        df["port_rarity"] = 1.0 / (1e-6 + df["dest_port"].map(self.dest_port_count) / self.total)
+        df["ip_rarity"] = 1.0 / (1e-6 + df["dest_ip"].map(self.dest_ip_count) / self.total)
+        return df.drop(columns=["_id", "syn_ratio"])
+
+
+def _entropy(counts):
+    total = sum(counts.values())
+    p = np.fromiter(counts.values(), dtype=np.float64) / total
+    return float(-np.sum(p * np.log(p + 1e-10)))
+
+
+async def sample_training_session(session=None, size=TRAINING_SAMPLE_SIZE, seed=42, batch_size=2000):
+    """Recorre la sesión (la más reciente si no se indica) y devuelve (DataFrame preprocesado, meta)."""
+    from db_connection import db
+    from ml_processing import select_and_normalize
+
+    collection = db[COLLECTION_NAME]
+    if session is None:
+        sessions = await collection.distinct("training_session", {"training_mode": True})
+        if not sessions:
+            print("[TS-S] ⚠ No se encontraron sesiones de entrenamiento.")
+            return None, None
+        session = sessions[-1]
+    print(f"[TS-S] 🎯 Sesión {session}: reservorio de {size} eventos (seed={seed})")
+
+    t0 = time.perf_counter()
+    sampler = SessionSampler(size, seed)
+    cursor = collection.find({"training_mode": True, "training_session": session}, PROJECTION).batch_size(batch_size)
+    async for event in cursor:
+        sampler.add(event)
+    scan_s = time.perf_counter() - t0
+
+    df = sampler.frame()
+    if df.empty:
+        print("[TS-S] ⚠ La sesión no tiene eventos.")
+        return None, None
+    df = select_and_normalize(df)
+    meta = {
+        "training_session": session, "rows": int(len(df)), "created_at": time.time(),
+        "sampled": True, "population": sampler.total, "capacity": size, "seed": seed,
+        "scan_seconds": round(scan_s, 3), "sources": len(sampler.sources),
+        "strata": sampler.reservoir.strata(),
+    }
+    print(f"[TS-S] ✅ {len(df)} de {sampler.total} eventos muestreados en {scan_s:.2f}s "
+          f"({len(meta['strata'])} estratos)")
+    return df, meta
+
+
+async def main(session=None, size=TRAINING_SAMPLE_SIZE, seed=42):
+    df, meta = await sample_training_session(session, size, seed)
+    if df is None:
+        print("[TS-S] ⚠ No se generó ningún archivo CSV.")
+        return
+    df.to_csv(PREPROCESSED_CSV, index=False)
+    with open(PREPROCESSED_META_JSON, "w") as f:
+        json.dump(meta, f)
+    print(f"[TS-S] ✅ Muestra guardada en {PREPROCESSED_CSV}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Muestreo estratificado de una sesión de entrenamiento")
+    parser.add_argument("--session", default=None)
+    parser.add_argument("--size", type=int, default=TRAINING_SAMPLE_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(main(args.session, args.size, args.seed))
@@ -0,0 +1,186 @@
+"""
+training_service.py
+
+📌 Función principal:
+    Ejecutar el entrenamiento (train_model.train) como un trabajo en segundo plano dentro de un pool de procesos,
+    en lugar de lanzar un intérprete nuevo por cada entrenamiento.
+
+⚙️ Comportamiento:
+    - Un único worker (ProcessPoolExecutor, contexto `spawn`) que se mantiene vivo entre trabajos:
+      pandas/sklearn se importan una sola vez por worker.
+    - Sólo un entrenamiento a la vez: un segundo envío mientras hay uno en cola/en curso se rechaza.
+    - El worker publica el progreso por etapa (inicio, fin, duración) en TRAINING_STATUS_JSON,
+      escrito de forma atómica para que la API (u otros procesos) lo lean sin ver estados a medias.
+    - train_model.train publica el modelo con archivo temporal + os.replace.
+    - Si hay ground truth, el mismo worker calibra el umbral con evaluate.compute_metrics (sin gráficos).
+    - Si el worker muere (p. ej. OOM durante un ajuste grande) el pool queda roto: el trabajo se marca
+      `failed` con la causa y el pool se recrea en el siguiente envío (un reintento) o consulta de estado.
+
+🔗 Usado por:
+    - routes.py → POST /train, GET /train/status
+    - main.py   → entrenamiento inicial al arrancar si no hay modelo
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from constants import TRAINING_STATUS_JSON, GROUND_TRUTH_CSV
+
+_executor: Optional[ProcessPoolExecutor] = None
+_current: Optional[dict] = None
+
+
+class TrainingAlreadyRunning(Exception):
+    pass
+
+
+def _write_status(status: dict, path: str = TRAINING_STATUS_JSON):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp, path)
+
+
+def read_status(path: str = TRAINING_STATUS_JSON) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"state": "idle"}
+
+
+def _evaluate(progress):
+    """Métricas y umbral calibrado en el mismo worker (evaluate.compute_metrics, sin gráficos).
+
+    Sin ground truth no hay nada que evaluar; un fallo de evaluación no invalida el modelo entrenado.
+    """
+    if not os.path.exists(GROUND_TRUTH_CSV):
+        return None
+    from evaluate import compute_metrics
+
+    progress("evaluate", "running", None)
+    t0 = time.perf_counter()
+    try:
+        result = compute_metrics()
+    except Exception as e:
+        progress("evaluate", "failed", round(time.perf_counter() - t0, 4))
+        return {"error": str(e)}
+    progress("evaluate", "done", round(time.perf_counter() - t0, 4))
+    return {k: v for k, v in result.items() if k not in ("df", "score_col")}
+
+
+def _run_job(job_id: str, preprocess: bool, status_path: str, incremental: bool = False) -> dict:
+    """Cuerpo del trabajo; se ejecuta en el proceso worker."""
+    import train_model
+
+    status = {"job_id": job_id, "state": "running", "started_at": time.time(), "stages": {}}
+    _write_status(status, status_path)
+
+    def progress(stage, state, seconds):
+        status["stage"] = stage
+        status["stages"][stage] = {"state": state, "seconds": seconds}
+        _write_status(status, status_path)
+
+    try:
+        if preprocess:
+            from ml_processing import main as preprocess_main
+            progress("preprocess", "running", None)
+            t0 = time.perf_counter()
+            asyncio.run(preprocess_main(train_only=True))
+            progress("preprocess", "done", round(time.perf_counter() - t0, 4))
+        summary = train_model.train(progress=progress, incremental=incremental)
+        summary["evaluation"] = _evaluate(progress)
+        status.update(state="done", summary=summary)
+    except Exception as e:
+        status.update(state="failed", error=str(e))
+    status["finished_at"] = time.time()
+    status["duration"] = round(status["finished_at"] - status["started_at"], 4)
+    _write_status(status, status_path)
+    return status
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _reset_executor():
+    """Descarta un pool roto (worker muerto); el siguiente _get_executor() crea uno nuevo."""
+    global _executor
+    if _executor is not None:
+        try:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        except Exception:
+            pass
+        _executor = None
+
+
+def _worker_died(job_id: str, exc: BaseException):
+    """Estado final de un trabajo cuyo worker murió sin escribirlo."""
+    status = read_status()
+    if status.get("job_id") == job_id and status.get("state") in {"queued", "running"}:
+        status.update(state="failed", error=f"El worker de entrenamiento terminó de forma inesperada "
+                                            f"(¿falta de memoria?): {exc}", finished_at=time.time())
+        _write_status(status)
+        print(f"[TS] ❌ Entrenamiento {job_id}: worker caído ({exc})")
+    return status
+
+
+def _on_done(job_id: str):
+    def callback(future):
+        exc = None if future.cancelled() else future.exception()
+        if isinstance(exc, BrokenProcessPool):
+            _worker_died(job_id, exc)
+    return callback
+
+
+def is_running() -> bool:
+    return _current is not None and not _current["future"].done()
+
+
+def submit_training(preprocess: bool = False, incremental: bool = False) -> dict:
+    """Encola un entrenamiento. Lanza TrainingAlreadyRunning si ya hay uno en curso."""
+    global _current
+    if is_running():
+        raise TrainingAlreadyRunning(_current["job_id"])
+    job_id = uuid.uuid4().hex[:12]
+    _write_status({"job_id": job_id, "state": "queued", "queued_at": time.time(), "stages": {}})
+    try:
+        future = _get_executor().submit(_run_job, job_id, preprocess, TRAINING_STATUS_JSON, incremental)
+    except BrokenProcessPool:
+        print("[TS] ⚠ Pool de entrenamiento roto (worker caído); se recrea")
+        _reset_executor()
+        future = _get_executor().submit(_run_job, job_id, preprocess, TRAINING_STATUS_JSON, incremental)
+    future.add_done_callback(_on_done(job_id))
+    _current = {"job_id": job_id, "future": future}
+    print(f"[TS] 🚀 Entrenamiento {job_id} encolado (preprocess={preprocess}, incremental={incremental})")
+    return {"job_id": job_id, "state": "queued"}
+
+
+def job_status() -> dict:
+    status = read_status()
+    # Si el worker murió sin escribir el estado final, reflejarlo
+    if _current is not None and _current["future"].done():
+        exc = None if _current["future"].cancelled() else _current["future"].exception()
+        if isinstance(exc, BrokenProcessPool):
+            _reset_executor()
+            status = _worker_died(_current["job_id"], exc)
+        elif exc is not None and status.get("state") in {"queued", "running"}:
+            status.update(state="failed", error=str(exc))
+    return status
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
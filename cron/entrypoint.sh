@@ -12,27 +12,12 @@ fi
 
 export PATH="/usr/local/bin:$PATH"
 
-# Archivo de logs para la tarea cron
+# Servicio persistente de reglas (sustituye al cron de 5 minutos): modelo y estado en memoria,
+# se despierta con los eventos nuevos. Una pasada suelta: python /app/generate_rules.py
 LOG_FILE="/var/log/generate_rules_cron.log"
-
-
-# Crear el archivo de log si no existe
 touch $LOG_FILE
-chmod 666 $LOG_FILE  # Permitir escritura para cron
-
-# Aplicar permisos correctos al crontab
-chmod 0644 /etc/cron.d/generate_rules_cron
-crontab /etc/cron.d/generate_rules_cron
-
-# Iniciar el servicio cron en segundo plano
-echo "🚀 Iniciando cron..."
-service cron start
-
-# Esperar hasta que el archivo de log tenga contenido antes de leerlo
-echo "⏳ Esperando logs de ejecución..."
-while [ ! -s "$LOG_FILE" ]; do
-    sleep 5
-done
+exec > >(tee -a "$LOG_FILE") 2>&1
 
-# Mostrar logs en tiempo real
-tail -f $LOG_FILE
+echo "🚀 Iniciando servicio de reglas..."
+# exec: el servicio pasa a ser el PID 1 y recibe el SIGTERM de `docker stop` (termina el lote en curso)
+exec python -u /app/rule_daemon.py